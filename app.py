@@ -1,19 +1,28 @@
-from flask import Flask, request, jsonify
-from nepse import Nepse
-from sqlalchemy import create_engine
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+import functools
 import logging
-import pandas as pd
 from datetime import datetime, timedelta
-import re
 import os
+import time
 from dotenv import load_dotenv
-import httpx
-from psycopg2 import sql, extras
-import psycopg2.errors
-from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+import archive
+import batch
+import cache
+import lazy
+import metrics
+import resilience
+import timing
+import trading_calendar
+import upstream
+from auth import TokenManager
+from typing import TYPE_CHECKING
+# pandas, SQLAlchemy and the modules built on them (db, bulk, ingest, rollups,
+# history, jobs, backfill, security_master, normalize) are imported inside the
+# functions that use them, so routes that never touch the database do not pay
+# for them on a cold start; see bench/bench_startup.py
+if TYPE_CHECKING:
+    import pandas as pd
 
-import rollbar
-import rollbar.contrib.flask
 from flask import got_request_exception
 
 import sys
@@ -32,8 +41,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-with app.app_context():
-    """init rollbar module"""
+
+def _init_rollbar():
+    """init rollbar module, on the first report"""
+    import rollbar
+    import rollbar.contrib.flask
     rollbar.init(
         '8e328fef1b784ce686ac78356f7ac2546b1b7a8b030c13bee02ee92d987a176aed173b018202c52c81ff9293c3a09ed1',
         # environment name - any string, like 'production' or 'development'
@@ -42,11 +54,26 @@ with app.app_context():
         root=os.path.dirname(os.path.realpath(__file__)),
         # flask already sets up logging
         allow_logging_basic_config=False)
+    return rollbar
+
+def _init_nepse():
+    from nepse import Nepse
+    client = Nepse()
+    client.setTLSVerification(False)
+    return client
+
+rollbar = lazy.Lazy(_init_rollbar)
+
+def _report_request_exception(sender, exception, **extra):
+    rollbar.contrib.flask.report_exception(sender, exception, **extra)
 
+with app.app_context():
     # send exceptions from `app` to rollbar, using flask's signal system.
-    got_request_exception.connect(rollbar.contrib.flask.report_exception, app)
+    got_request_exception.connect(_report_request_exception, app)
     
-nepse = Nepse()
+nepse = lazy.Lazy(_init_nepse)
+token_manager = TokenManager(nepse)
+response_cache = cache.ResponseCache(cache.create_backend())
 
 
 sector_wise_dtype_spec = {
@@ -79,7 +106,55 @@ dtype_spec = {
     'marketCapitalization': 'float64'
 }        
 
-nepse.setTLSVerification(False)
+# compiled once, on first use; see normalize.FrameSchema
+@functools.cache
+def price_volume_schema():
+    from normalize import FrameSchema
+    return FrameSchema(
+        dtype_spec,
+        date_formats={'businessDate': 'ISO8601', 'lastUpdatedTime': '%Y-%m-%dT%H:%M:%S.%f'},
+        drop=('id',),
+        float32=('openPrice', 'highPrice', 'lowPrice', 'closePrice', 'previousDayClosePrice',
+                 'fiftyTwoWeekHigh', 'fiftyTwoWeekLow', 'lastUpdatedPrice', 'averageTradedPrice'),
+        categorical=('symbol', 'securityName'),
+        sort_by='businessDate',
+    )
+
+@functools.cache
+def sector_wise_schema():
+    from normalize import FrameSchema
+    return FrameSchema(
+        sector_wise_dtype_spec,
+        date_formats={'businessDate': 'ISO8601', 'createdAt': '%Y-%m-%d'},
+        categorical=('sectorName',),
+    )
+
+@app.before_request
+def _start_request_timing():
+    g.request_started = time.perf_counter()
+    g.request_spans = timing.begin_request()
+    resilience.begin_request()
+
+@app.after_request
+def _finish_request_timing(response):
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    timing.request_seconds.observe(elapsed, route=route, method=request.method, status=response.status_code)
+    if timing.SERVER_TIMING:
+        response.headers['Server-Timing'] = timing.server_timing(g.request_spans, elapsed)
+    return response
+
+@app.teardown_request
+def _end_request_timing(exc):
+    timing.end_request()
+    resilience.end_request()
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({"message": "Unauthorized", "status": 401}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def hello():
@@ -95,7 +170,7 @@ def market_status():
             logger.error(f"Validation failed: {validation['message']}")
             return jsonify(validation), validation['status']
         logger.info('Getting authorization headers')
-        response = nepse.getMarketStatus()        
+        response = _cached_upstream('market_status', lambda: resilience.call(nepse.getMarketStatus))
         return jsonify({"status":"success","data":response}), 200
         
     except Exception as e:
@@ -109,42 +184,16 @@ def financial():
     data = request.get_json()
     
     try:
-        # Validate request data
-        validation = api_validation(data)
-        if validation is not None:
-            return jsonify(validation), validation['status']
-        
-        # Log the request
-        logger.info("Received valid scrape request")
-        # Check security code exists
-        if 'security_id' not in data:
-            logger.error("security_id is required")
-            return jsonify({"message": "security_id is required", "status": 400}), 400
-        if type(data['security_id']) is not int:
-            logger.error("security_id must be an integer")
-            return jsonify({"message": "security_id must be an integer", "status": 400}), 400
-        
-        security_id = get_security_id_from_price_volume(data['security_id'])
-        if len(security_id) == 0:
-            logger.error(f"Security ID {data['security_id']} not found")
-            return jsonify({"message": f"Security ID {data['security_id']} not found", "status": 404}), 404
+        error = _validate_security_request(data)
+        if error is not None:
+            return jsonify(error[0]), error[1]
         else:
             try:
-                # Get authorization headers
-                logger.info('Getting authorization headers')
-                auth_header = nepse.getAuthorizationHeaders()
-                logger.info('Authorization successful')
-                url=f'https://www.nepalstock.com.np/api/nots/application/reports/{data['security_id']}'
-                client = httpx.Client(verify=False, http2=True, timeout=100)
-                response = client.get(
-                        url,
-                        headers=(auth_header),
-                    )
-                if response.status_code == 200:
-                    return jsonify({"status":"success","data":response.json()[0]}), 200
-                else:
-                    return jsonify({"message": "Failed to retrieve data", "status": response.status_code}), response.status_code
-                # Get the authorization headers
+                url=f'{upstream.NEPSE_BASE_URL}/api/nots/application/reports/{data['security_id']}'
+                response = token_manager.get(url, on_fetch=lambda response: archive.record_response(
+                    'financial', response, params={'security_id': data['security_id']}))
+                body, status = _report_result(response)
+                return jsonify(body), status
             except Exception as e:
                 logger.error(f"Error during login: {str(e)}")
                 return jsonify({"message": "Login failed", "status": 500}), 500
@@ -159,42 +208,16 @@ def divided():
     data = request.get_json()
     
     try:
-        # Validate request data
-        validation = api_validation(data)
-        if validation is not None:
-            return jsonify(validation), validation['status']
-        
-        # Log the request
-        logger.info("Received valid scrape request")
-        # Check security code exists
-        if 'security_id' not in data:
-            logger.error("security_id is required")
-            return jsonify({"message": "security_id is required", "status": 400}), 400
-        if type(data['security_id']) is not int:
-            logger.error("security_id must be an integer")
-            return jsonify({"message": "security_id must be an integer", "status": 400}), 400
-        
-        security_id = get_security_id_from_price_volume(data['security_id'])
-        if len(security_id) == 0:
-            logger.error(f"Security ID {data['security_id']} not found")
-            return jsonify({"message": f"Security ID {data['security_id']} not found", "status": 404}), 404
+        error = _validate_security_request(data)
+        if error is not None:
+            return jsonify(error[0]), error[1]
         else:
             try:
-                # Get authorization headers
-                logger.info('Getting authorization headers')
-                auth_header = nepse.getAuthorizationHeaders()
-                logger.info('Authorization successful')
-                url=f'https://www.nepalstock.com.np/api/nots/application/dividend/{data['security_id']}'
-                client = httpx.Client(verify=False, http2=True, timeout=100)
-                response = client.get(
-                        url,
-                        headers=(auth_header),
-                    )
-                if response.status_code == 200:
-                    return jsonify({"status":"success","data":response.json()[0]}), 200
-                else:
-                    return jsonify({"message": "Failed to retrieve data", "status": response.status_code}), response.status_code
-                # Get the authorization headers
+                url=f'{upstream.NEPSE_BASE_URL}/api/nots/application/dividend/{data['security_id']}'
+                response = token_manager.get(url, on_fetch=lambda response: archive.record_response(
+                    'divided', response, params={'security_id': data['security_id']}))
+                body, status = _report_result(response)
+                return jsonify(body), status
             except Exception as e:
                 logger.error(f"Error during login: {str(e)}")
                 return jsonify({"message": "Login failed", "status": 500}), 500
@@ -204,6 +227,59 @@ def divided():
         return jsonify({"message": "Authorization failed", "status": 500}), 500
 
 
+@app.route('/api/v1/financial/batch', methods=['POST'])
+def financial_batch():
+    logger.info('financial batch endpoint accessed')
+    return _batch_reports('financial')
+
+@app.route('/api/v1/divided/batch', methods=['POST'])
+def divided_batch():
+    logger.info('divided batch endpoint accessed')
+    return _batch_reports('divided')
+
+def _batch_reports(kind):
+    """
+    Stream `kind` reports for a list of security ids (or "all") as NDJSON,
+    one line per id as soon as it completes.
+    """
+    data = request.get_json()
+    try:
+        validation = api_validation(data)
+        if validation is not None:
+            return jsonify(validation), validation['status']
+        if 'security_ids' not in data:
+            logger.error("security_ids is required")
+            return jsonify({"message": "security_ids is required", "status": 400}), 400
+        requested = data['security_ids']
+        if requested != 'all' and not (
+                isinstance(requested, list) and all(type(security_id) is int for security_id in requested)):
+            logger.error("security_ids must be a list of integers or \"all\"")
+            return jsonify({"message": "security_ids must be a list of integers or \"all\"", "status": 400}), 400
+        concurrency = data.get('concurrency')
+        if concurrency is not None and (type(concurrency) is not int or concurrency < 1):
+            return jsonify({"message": "concurrency must be a positive integer", "status": 400}), 400
+
+        known = get_security_id_from_price_volume(None)
+        if known is False:
+            return jsonify({"message": "Failed to load security ids", "status": 500}), 500
+        if requested == 'all':
+            security_ids, missing_ids = known, []
+        else:
+            known = set(known)
+            requested = list(dict.fromkeys(requested))
+            security_ids = [security_id for security_id in requested if security_id in known]
+            missing_ids = [security_id for security_id in requested if security_id not in known]
+        logger.info(f"Batch {kind} for {len(security_ids)} securities ({len(missing_ids)} unknown)")
+        return Response(
+            stream_with_context(batch.stream_ndjson(kind, security_ids, token_manager, missing_ids, concurrency)),
+            mimetype='application/x-ndjson',
+        )
+    except Exception as e:
+        rollbar.report_exc_info()
+        logger.error(f"Error starting {kind} batch: {str(e)}")
+        return jsonify({"message": f"Failed to retrieve {kind} batch", "status": 500}), 500
+
+
 @app.route('/api/v1/sector-summary', methods=['POST'])
 def save_sector_summary():
     logger.info('sector_summary endpoint accessed')
@@ -214,8 +290,8 @@ def save_sector_summary():
         if validation is not None:
             logger.error(f"Validation failed: {validation['message']}")
             return jsonify(validation), validation['status']
-        current_sector_wise_summary =_retrieve_current_sector_wise_summary()
-        return jsonify(current_sector_wise_summary), 200
+        body, status = _submit_job('sector_summary', _retrieve_current_sector_wise_summary, data)
+        return jsonify(body), status
     except Exception as e:
         rollbar.report_exc_info()
         logger.error(f"Error getting market summary: {str(e)}")
@@ -235,11 +311,11 @@ def save_price_volume_history():
         # Log the request
         logger.info("Received valid scrape request")
         
-        # Process the request
-        result = retrieve_current_price_volume_history()
+        # Process the request in the background
+        body, status = _submit_job('scrape', retrieve_current_price_volume_history, data)
         
         # Return response
-        return jsonify(result), 200
+        return jsonify(body), status
         
     except Exception as e:
         rollbar.report_exc_info()
@@ -259,23 +335,29 @@ def company_list():
         if validation is not None:
             logger.error(f"Validation failed: {validation['message']}")
             return jsonify(validation), validation['status']
-        response = nepse.getSectorScrips()
-        records = [
-            {"sector": sector, "symbol": symbol}
-            for sector, symbols in response.items()
-            for symbol in symbols
-        ]
-        df = pd.DataFrame(records)
-        insert_data_symbol_sector = _upsert_sectory_symbol(df)
-        if insert_data_symbol_sector:
-            return jsonify({"status":"success","data":records}), 200
-        else:
-            return jsonify({"message": "Failed to insert sector symbols", "status": 500}), 500
+        body, status = _submit_job('company_list', _refresh_company_list, data)
+        return jsonify(body), status
         
     except Exception as e:
         logger.error(f"Error getting company list: {str(e)}")
         return jsonify({"message": "Failed to retrieve company list", "status": 500}), 500
 
+def _refresh_company_list():
+    import pandas as pd
+    # not through the response cache, whose list may be an hour old
+    response = resilience.call(nepse.getSectorScrips)
+    records = [
+        {"sector": sector, "symbol": symbol}
+        for sector, symbols in response.items()
+        for symbol in symbols
+    ]
+    df = pd.DataFrame(records)
+    insert_data_symbol_sector = _upsert_sectory_symbol(df)
+    if insert_data_symbol_sector:
+        return {"status":"success","data":records,"rows":insert_data_symbol_sector['rows']}
+    else:
+        return {"message": "Failed to insert sector symbols", "status": 500}
+
 @app.route('/api/v1/sector-overview', methods=['POST'])
 def sector_overview():
     logger.info('sector_overview endpoint accessed')
@@ -286,7 +368,7 @@ def sector_overview():
         if validation is not None:
             logger.error(f"Validation failed: {validation['message']}")
             return jsonify(validation), validation['status']
-        response = nepse.getSummary()
+        response = _cached_upstream('sector_overview', lambda: resilience.call(nepse.getSummary))
         return jsonify({"status":"success","data":response}), 200
         
     except Exception as e:
@@ -305,22 +387,221 @@ def market_summary():
             logger.error(f"Validation failed: {validation['message']}")
             return jsonify(validation), validation['status']
             
-        logger.info('Getting authorization headers')
-        
-        auth_header = nepse.getAuthorizationHeaders()
-        logger.info('Authorization successful')
-        url=f'https://www.nepalstock.com.np/api/nots/market-summary-history'
-        client = httpx.Client(verify=False, http2=True, timeout=100)
-        response = client.get(
-                        url,
-                        headers=(auth_header),
-                    )
-        return jsonify({"status":"success","data":response.json()}), 200
+        response = _cached_upstream('market_summary', _fetch_market_summary_history)
+        return jsonify({"status":"success","data":response}), 200
     except Exception as e:
         rollbar.report_exc_info()
         logger.error(f"Error getting market summary: {str(e)}")
         return jsonify({"message": "Failed to retrieve market summary", "status": 500}), 500
- 
+
+@app.route('/api/v1/backfill', methods=['POST'])
+def backfill_price_volume_history():
+    logger.info('backfill endpoint accessed')
+    data = request.get_json()
+    try:
+        validation = api_validation(data)
+        if validation is not None:
+            logger.error(f"Validation failed: {validation['message']}")
+            return jsonify(validation), validation['status']
+        for field in ('start_date', 'end_date'):
+            if field not in data:
+                logger.error(f"{field} is required")
+                return jsonify({"message": f"{field} is required", "status": 400}), 400
+            try:
+                datetime.strptime(data[field], '%Y-%m-%d')
+            except (TypeError, ValueError):
+                logger.error(f"{field} must be a YYYY-MM-DD date")
+                return jsonify({"message": f"{field} must be a YYYY-MM-DD date", "status": 400}), 400
+        if data['start_date'] > data['end_date']:
+            return jsonify({"message": "start_date must not be after end_date", "status": 400}), 400
+        workers = data.get('workers', int(os.getenv('BACKFILL_WORKERS', 4)))
+        if type(workers) is not int or workers < 1:
+            logger.error("workers must be a positive integer")
+            return jsonify({"message": "workers must be a positive integer", "status": 400}), 400
+        rate = data.get('rate', float(os.getenv('BACKFILL_RATE', 2.0)))
+        if type(rate) not in (int, float) or rate <= 0:
+            logger.error("rate must be a positive number")
+            return jsonify({"message": "rate must be a positive number", "status": 400}), 400
+        force = data.get('force', False)
+        if type(force) is not bool:
+            logger.error("force must be true or false")
+            return jsonify({"message": "force must be true or false", "status": 400}), 400
+
+        import backfill
+        result = backfill.run_backfill(
+            data['start_date'],
+            data['end_date'],
+            _stream_price_volume_history,
+            save_price_volume_history_df,
+            workers=workers,
+            rate=float(rate),
+            force=force,
+        )
+        return jsonify(result), result['status']
+    except Exception as e:
+        rollbar.report_exc_info()
+        logger.error(f"Error running backfill: {str(e)}")
+        return jsonify({"message": "Exception occurred while running backfill", "status": 500, "error": str(e)}), 500
+
+@app.route('/api/v1/jobs', methods=['POST'])
+def job_status():
+    import jobs
+    logger.info('jobs endpoint accessed')
+    data = request.get_json()
+    try:
+        validation = api_validation(data)
+        if validation is not None:
+            logger.error(f"Validation failed: {validation['message']}")
+            return jsonify(validation), validation['status']
+        if 'job_id' not in data:
+            return jsonify({"status": "success", "data": jobs.recent(kind=data.get('kind'))}), 200
+        job = jobs.get(str(data['job_id']))
+        if job is None:
+            return jsonify({"message": "Job not found", "status": 404}), 404
+        return jsonify({"status": "success", "data": job}), 200
+    except Exception as e:
+        rollbar.report_exc_info()
+        logger.error(f"Error reading job status: {str(e)}")
+        return jsonify({"message": "Failed to read job status", "status": 500}), 500
+
+@app.route('/api/v1/prices', methods=['POST'])
+def price_history():
+    import history
+    logger.info('prices endpoint accessed')
+    data = request.get_json()
+    try:
+        validation = api_validation(data)
+        if validation is not None:
+            logger.error(f"Validation failed: {validation['message']}")
+            return jsonify(validation), validation['status']
+        result = history.page(
+            security_id=data.get('security_id'),
+            symbol=data.get('symbol'),
+            start_date=data.get('start_date'),
+            end_date=data.get('end_date'),
+            cursor=data.get('cursor'),
+            limit=data.get('limit'),
+        )
+        return jsonify({"status": "success", **result}), 200
+    except history.QueryError as e:
+        logger.error(f"Invalid price history query: {str(e)}")
+        return jsonify({"message": str(e), "status": 400}), 400
+    except Exception as e:
+        rollbar.report_exc_info()
+        logger.error(f"Error reading price history: {str(e)}")
+        return jsonify({"message": "Failed to retrieve price history", "status": 500}), 500
+
+@app.route('/api/v1/prices/export', methods=['POST'])
+def price_history_export():
+    import history
+    logger.info('prices export endpoint accessed')
+    data = request.get_json()
+    try:
+        validation = api_validation(data)
+        if validation is not None:
+            logger.error(f"Validation failed: {validation['message']}")
+            return jsonify(validation), validation['status']
+        mimetype, extension, chunks = history.export(
+            data.get('format', 'csv'),
+            security_id=data.get('security_id'),
+            symbol=data.get('symbol'),
+            start_date=data.get('start_date'),
+            end_date=data.get('end_date'),
+        )
+        return Response(chunks, mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="stock_prices.{extension}"'})
+    except history.QueryError as e:
+        logger.error(f"Invalid price history export: {str(e)}")
+        return jsonify({"message": str(e), "status": 400}), 400
+    except Exception as e:
+        rollbar.report_exc_info()
+        logger.error(f"Error exporting price history: {str(e)}")
+        return jsonify({"message": "Failed to export price history", "status": 500}), 500
+
+def _validate_security_request(data):
+    """
+    Validate a single security report request. Returns a (body, status)
+    error tuple, or None when the request can go upstream.
+    """
+    # Validate request data
+    validation = api_validation(data)
+    if validation is not None:
+        return validation, validation['status']
+    
+    # Log the request
+    logger.info("Received valid scrape request")
+    # Check security code exists
+    if 'security_id' not in data:
+        logger.error("security_id is required")
+        return {"message": "security_id is required", "status": 400}, 400
+    if type(data['security_id']) is not int:
+        logger.error("security_id must be an integer")
+        return {"message": "security_id must be an integer", "status": 400}, 400
+    
+    security_id = get_security_id_from_price_volume(data['security_id'])
+    if security_id is False:
+        logger.error("Could not look up security ids")
+        return {"message": "Failed to look up security_id", "status": 500}, 500
+    if len(security_id) == 0:
+        logger.error(f"Security ID {data['security_id']} not found")
+        return {"message": f"Security ID {data['security_id']} not found", "status": 404}, 404
+    return None
+
+def _submit_job(kind, fn, data):
+    """
+    Queue `fn` as today's `kind` job and return (body, status): 202 with the
+    job while it is queued or running, 200 once it has finished. With
+    "wait": true in the request the response waits for the job, at most
+    JOB_WAIT_TIMEOUT seconds and never past the request's deadline.
+    """
+    import jobs
+    job, created = jobs.submit(kind, datetime.now().strftime('%Y-%m-%d'), fn)
+    waited = data.get('wait')
+    if waited:
+        left = resilience.remaining()
+        timeout = jobs.WAIT_TIMEOUT if left is None else max(0.0, min(jobs.WAIT_TIMEOUT, left))
+        job = jobs.wait(job['id'], timeout=timeout)
+    if job['status'] in jobs.ACTIVE:
+        if waited:
+            message = f"Job still {job['status']}, poll /api/v1/jobs with its job_id"
+        else:
+            message = "Job queued" if created else f"Job already {job['status']}"
+        return {"message": message, "status": 202, "job_id": job['id'], "job": job}, 202
+    return {"message": f"Job {job['status']}", "status": 200, "job_id": job['id'], "job": job}, 200
+
+def _report_result(response):
+    if response.status_code == 200:
+        return {"status":"success","data":response.json()[0]}, 200
+    else:
+        return {"message": "Failed to retrieve data", "status": response.status_code}, response.status_code
+
+def _fetch_market_summary_history():
+    url=f'{upstream.NEPSE_BASE_URL}/api/nots/market-summary-history'
+    response = token_manager.get(url, on_fetch=lambda response: archive.record_response('market_summary', response))
+    # raise instead of caching an error payload
+    response.raise_for_status()
+    return response.json()
+
+def _market_open():
+    try:
+        status = _cached_upstream('market_status', lambda: resilience.call(nepse.getMarketStatus))
+    except Exception as e:
+        logger.error(f"Could not determine market status, assuming open: {str(e)}")
+        return True
+    return cache.market_is_open(status)
+
+def _cached_upstream(endpoint, fetch):
+    """
+    Serve `fetch()` through the response cache. Entries live for the
+    endpoint's TTL while the market is open and until the next session
+    opens once it has closed.
+    """
+    if endpoint == 'market_status':
+        ttl_for = lambda status: cache.endpoint_ttl(endpoint, cache.market_is_open(status))
+    else:
+        ttl_for = lambda _: cache.endpoint_ttl(endpoint, _market_open())
+    return response_cache.get_or_compute(endpoint, fetch, ttl_for)
+
 def api_validation(data):
     """
     Validate the request data for the API.
@@ -340,30 +621,32 @@ def api_validation(data):
     
     return None
 
-def camel_to_snake(name):
-    # Replace capital letters with underscore followed by lowercase letter
-    return re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name).lower()
-
-def _retrieve_current_sector_wise_summary():
-    logger.info('_retrieve_current_sector_wise_summary start')
-    current_date = datetime.now() 
+def _market_closed_message(current_date):
     current_weekday = current_date.weekday()
     
     if current_weekday in [4, 5]:  # 4 is Friday, 5 is Saturday
         logger.info(f"Current date {current_date.strftime('%Y-%m-%d')} is {'Friday' if current_weekday == 4 else 'Saturday'}")
         return {"message": "Market is closed on Friday and Saturday"}
+    if not trading_calendar.is_trading_day(current_date):
+        logger.info(f"Current date {current_date.strftime('%Y-%m-%d')} is a NEPSE holiday")
+        return {"message": "Market is closed for a holiday"}
+    return None
+
+def _retrieve_current_sector_wise_summary():
+    logger.info('_retrieve_current_sector_wise_summary start')
+    current_date = datetime.now() 
+    closed = _market_closed_message(current_date)
+    if closed is not None:
+        return closed
+    current_date_str = current_date.strftime('%Y-%m-%d')
+    logger.info(f'_retrieve_current_sector_wise_summary start for date: {current_date_str}')
+    return _store_sector_wise_summary(_get_current_sector_wise_summary(), current_date_str)
+
+def _store_sector_wise_summary(data, current_date_str):
     try:
-        current_date_str = current_date.strftime('%Y-%m-%d')
-        logger.info(f'_retrieve_current_sector_wise_summary start for date: {current_date_str}')
-        data=_get_current_sector_wise_summary()
         if data['status'] == 200:
             logger.info(f"Sectorwise summary retrieved successfully for {current_date_str}")
-            df = pd.DataFrame(data['data'])
-            df['created_at'] = current_date_str
-            df["businessDate"] = pd.to_datetime(df["businessDate"], errors="coerce")
-            df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce")
-            df.columns = [camel_to_snake(col) for col in df.columns]
-            response = _insert_sector_wise_summary(df)
+            response = _insert_sector_wise_summary(data['data'], current_date_str)
             if response:
                 return {"message": "Sectorwise summary retrieved successfully", "status": 200, 'response': response}
             else:
@@ -380,117 +663,120 @@ def retrieve_current_price_volume_history():
     
     current_date = datetime.now() 
     
-    current_weekday = current_date.weekday()
-    
-    if current_weekday in [4, 5]:  # 4 is Friday, 5 is Saturday
-        logger.info(f"Current date {current_date.strftime('%Y-%m-%d')} is {'Friday' if current_weekday == 4 else 'Saturday'}")
-        return {"message": "Market is closed on Friday and Saturday"}
+    closed = _market_closed_message(current_date)
+    if closed is not None:
+        return closed
     try:
         current_date_str = current_date.strftime('%Y-%m-%d')
         logger.info(f'retrieve_current_price_volume_history start for date: {current_date_str}')
-        data = nepse.getPriceVolumeHistory(current_date_str)
-        return save_price_volume_history_df(data,current_date_str)
+        records = _stream_price_volume_history(current_date_str)
+        return save_price_volume_history_df(records,current_date_str)
     except Exception as e:
         rollbar.report_exc_info()
         logger.error(f"Error retrieving current price volume history: {str(e)}")
         return {"message": "Exception occurred while retrieving current price volume history", "status": 500, "error": str(e)}
 
+def _stream_price_volume_history(date):
+    """
+    Yield the day's price/volume records as they are parsed off the wire,
+    without holding the whole response. Falls back to the buffered nepse
+    call when the library cannot build the POST payload id for us.
+    """
+    import ingest
+    payload_id = getattr(nepse, 'getPOSTPayloadIDForFloorSheet', None)
+    if payload_id is None:
+        payload = resilience.call(nepse.getPriceVolumeHistory, date, hedge_after=resilience.HEDGE_AFTER)
+        archive.record('price_volume', payload, date=date)
+        yield from payload.get('content', [])
+        return
+    url = f"{upstream.NEPSE_BASE_URL}/api/nots/nepse-data/today-price?size=500&businessDate={date}"
+    # the POST only reads, so it is safe to retry and hedge
+    with token_manager.stream('POST', url, json={'id': payload_id()}, retry=True,
+                              hedge_after=resilience.HEDGE_AFTER) as response:
+        response.raise_for_status()
+        chunks = archive.tee('price_volume', response.iter_bytes(), date=date)
+        yield from ingest.iter_array(chunks, key='content')
+        # read the fields after 'content' too, so the archived copy is complete
+        for _ in chunks:
+            pass
+
 def save_price_volume_history_df(data,date):
-    if len(data['content'])>0:
-        df = pd.DataFrame(data['content'])
-        df = df.astype(dtype_spec)
-        df["businessDate"] = pd.to_datetime(df["businessDate"], errors="coerce")
-        df['lastUpdatedTime'] = pd.to_datetime(
-                df['lastUpdatedTime'],
-                errors='coerce',
-                format='%Y-%m-%dT%H:%M:%S.%f'
-            )
-        if 'id' in df.columns:
-            df = df.drop(columns=['id'])
-        df.columns = [camel_to_snake(col) for col in df.columns]
-        if 'total_trades' in df.columns:
-            df['total_trades'] = pd.to_numeric(df['total_trades'], errors='coerce')
-        df = df.sort_values(by="business_date", ascending=True)
-        df['business_date'] = df['business_date'].dt.strftime('%Y-%m-%d')
-        response=insert_data(df)
-        if response:
-            logger.info(f"Data inserted successfully for {date}")
-            return {"message": "success","status":200}
-        else:
-            logger.error(f"Error inserting data for {date}")
-            return {"message": "error","status":500}
-    else:
-        logger.info(f"No data found for {date}")    
+    # data is a nepse payload dict or any iterable of records, e.g. _stream_price_volume_history()
+    records = data['content'] if isinstance(data, dict) else data
+    response=insert_data(records)
+    if response is False:
+        logger.error(f"Error inserting data for {date}")
+        return {"message": "error","status":500}
+    if response['rows'] == 0:
+        logger.info(f"No data found for {date}")
+        return None
+    logger.info(f"Data inserted successfully for {date}")
+    return {"message": "success","status":200,"rows":response['rows'],"inserted":response['inserted'],
+            "updated":response['updated'],"unchanged":response['unchanged']}
     
-def insert_data(df):
-    # Get database URL from environment variable
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        logger.error("DATABASE_URL environment variable is not set")
+def insert_data(records):
+    import db
+    import ingest
+    import rollups
+    from security_master import security_master
+    if db.get_engine() is None:
         return False
         
-    engine = create_engine(database_url)
     table_name = 'stock_prices'
+    dates = set()
+    securities = []
+
+    def on_chunk(df):
+        securities.append(df[['security_id', 'symbol']].drop_duplicates())
+        dates.update(df['business_date'].dropna().dt.strftime('%Y-%m-%d'))
+
     try:
-        with engine.begin() as conn:
-            df.to_sql(
-                name=table_name,
-                con=conn,
-                if_exists='append',
-                index=False,
-                method='multi',
-                chunksize=1000
-            )
-        return True
+        # written in bounded chunks, see ingest.load_records
+        result = ingest.load_records(records, price_volume_schema(), table_name, on_chunk=on_chunk)
+        # the chunks are committed together, so the master only learns of them now
+        security_master.store(securities)
+        if result['inserted'] or result['updated']:
+            rollups.refresh_prices(dates)
+        return result
     except Exception as e:
         logger.error(f"Error inserting data into database:{e}")
         return False
 
-def _insert_sector_wise_summary(df):
+def _insert_sector_wise_summary(records, current_date_str):
+    import db
+    import ingest
+    import rollups
     logger.info(f"_insert_sector_wise_summary start")
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        logger.error("DATABASE_URL environment variable is not set")
+    if db.get_engine() is None:
         return False
         
-    engine = create_engine(database_url)
     table_name = 'stock_sector_wise_summary'
+    dates = set()
     try:
-        with engine.begin() as conn:
-            df.to_sql(
-                name=table_name,
-                con=conn,
-                if_exists='append',
-                index=False,
-                method='multi',
-                chunksize=1000
-            )
-        return True
+        result = ingest.load_records(records, sector_wise_schema(), table_name, extra={'createdAt': current_date_str},
+                                     on_chunk=lambda df: dates.update(df['business_date'].dropna().dt.strftime('%Y-%m-%d')))
+        if result['inserted'] or result['updated']:
+            rollups.refresh_sectors(dates)
+        return result
     except Exception as e:
         logger.error(f"Error inserting data into database:{e}")
         return False
 
-def _upsert_sectory_symbol(df:pd.DataFrame):
+def _upsert_sectory_symbol(df:'pd.DataFrame'):
+    import bulk
+    import db
+    from security_master import security_master
     logger.info(f"_upsert_sectory_symbol start")
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        logger.error("DATABASE_URL environment variable is not set")
+    if db.get_engine() is None:
         return False
         
-    engine = create_engine(database_url)
     table_name = 'stock_symbol_sectors'
     
     try:
-        with engine.begin() as conn:
-            df.to_sql(
-                name=table_name,
-                con=conn,
-                if_exists='replace',
-                index=False,
-                method='multi',
-                chunksize=1000
-            )
-        return True
+        with db.begin() as conn:
+            result = bulk.upsert(conn, df, table_name)
+        security_master.update_sectors(df)
+        return result
     except Exception as e:
         logger.error(f"Error inserting data into database:{e}")
         return False
@@ -498,23 +784,15 @@ def _upsert_sectory_symbol(df:pd.DataFrame):
     
     
 def get_security_id_from_price_volume(securiry_id=None):
-    # Get database URL from environment variable
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        logger.error("DATABASE_URL environment variable is not set")
-        return False
-        
-    engine = create_engine(database_url)
-    table_name = 'stock_prices'
+    import db
+    from security_master import security_master
     try:
-        with engine.begin() as conn:
-            if securiry_id is not None:
-            # If a specific security_id is provided, filter by it
-                query = f"select distinct(security_id),symbol from {table_name} where security_id={securiry_id};"
-            else:
-                query = f"select distinct(security_id),symbol from {table_name} order by security_id;"
-            df = pd.read_sql(query, conn)
-        return df['security_id'].tolist()
+        if db.get_engine() is None:
+            return False
+        if securiry_id is not None:
+            # If a specific security_id is provided, check it against the security master
+            return [securiry_id] if security_master.contains(securiry_id) else []
+        return security_master.ids()
     except Exception as e:
         logger.error(f"Error retrieving data from database:{e}")
         return False
@@ -522,14 +800,8 @@ def get_security_id_from_price_volume(securiry_id=None):
 def _get_current_sector_wise_summary():
     logger.info('_get_current_sector_wise_summary start')
     try:
-        auth_header = nepse.getAuthorizationHeaders()
-        logger.info('Authorization successful')
-        url=f'https://www.nepalstock.com.np/api/nots/sectorwise'
-        client = httpx.Client(verify=False, http2=True, timeout=100)
-        response = client.get(
-                        url,
-                        headers=(auth_header),
-                    )
+        url=f'{upstream.NEPSE_BASE_URL}/api/nots/sectorwise'
+        response = token_manager.get(url, on_fetch=lambda response: archive.record_response('sectorwise', response))
         if response.status_code == 200:
             return {"status":200,"data":response.json()}
         else:
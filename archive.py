@@ -0,0 +1,280 @@
+"""
+Content-addressed archive of raw upstream responses.
+
+    ARCHIVE_DIR/objects/ab/abcdef....json.gz    gzip of the raw body, named by its sha256
+    ARCHIVE_DIR/refs/<endpoint>.jsonl          one line per fetch: params, date, sha256
+
+Identical payloads are stored once however often they are fetched. The
+archive is off unless ARCHIVE_DIR is set. Replaying rebuilds tables from
+the archive without touching nepalstock.com.np:
+
+    python archive.py list
+    python archive.py replay price_volume --start 2024-01-01 --end 2024-03-31
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR')
+ARCHIVE_COMPRESSLEVEL = int(os.getenv('ARCHIVE_COMPRESSLEVEL', 6))
+
+# endpoints whose archived payloads can rebuild a table
+REPLAYABLE = ('price_volume', 'sectorwise')
+
+_READ_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+# (endpoint, params key, date) -> sha256 of the last ref written by this process
+_last_refs = {}
+
+
+def enabled():
+    return bool(ARCHIVE_DIR)
+
+
+def _object_path(sha256):
+    return os.path.join(ARCHIVE_DIR, 'objects', sha256[:2], f'{sha256}.json.gz')
+
+
+def _refs_path(endpoint):
+    return os.path.join(ARCHIVE_DIR, 'refs', f'{endpoint}.jsonl')
+
+
+def _params_key(params):
+    return json.dumps(params or {}, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def _store_object(tmp_path, sha256):
+    path = _object_path(sha256)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+
+def _add_ref(sha256, size, endpoint, params, date):
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    params_key = _params_key(params)
+    ref = {"endpoint": endpoint, "params": json.loads(params_key), "date": date, "sha256": sha256,
+           "size": size, "fetched_at": datetime.now().isoformat(timespec='seconds')}
+    with _lock:
+        if _last_refs.get((endpoint, params_key, date)) == sha256:
+            return sha256
+        os.makedirs(os.path.dirname(_refs_path(endpoint)), exist_ok=True)
+        with open(_refs_path(endpoint), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(ref, separators=(',', ':')) + '\n')
+        _last_refs[(endpoint, params_key, date)] = sha256
+    return sha256
+
+
+def _temp_object():
+    directory = os.path.join(ARCHIVE_DIR, 'objects')
+    os.makedirs(directory, exist_ok=True)
+    return tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+
+def record(endpoint, body, params=None, date=None):
+    """
+    Archive one raw response body (bytes, or an already parsed payload,
+    which is stored as canonical JSON). Returns its sha256, or None when
+    the archive is off or the write failed; archiving never fails a request.
+    """
+    if not enabled():
+        return None
+    try:
+        if not isinstance(body, bytes):
+            body = json.dumps(body, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+        sha256 = hashlib.sha256(body).hexdigest()
+        if not os.path.exists(_object_path(sha256)):
+            fd, tmp_path = _temp_object()
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0,
+                                                           compresslevel=ARCHIVE_COMPRESSLEVEL) as gz:
+                gz.write(body)
+            _store_object(tmp_path, sha256)
+        return _add_ref(sha256, len(body), endpoint, params, date)
+    except OSError as e:
+        logger.warning(f"Could not archive {endpoint} response: {e}")
+        return None
+
+
+def record_response(endpoint, response, params=None, date=None):
+    """
+    Archive an httpx response if it succeeded.
+    """
+    if enabled() and response.status_code == 200:
+        return record(endpoint, response.content, params=params, date=date)
+    return None
+
+
+async def arecord_response(endpoint, response, params=None, date=None):
+    """
+    record_response() for coroutines; the file write runs in a worker thread.
+    """
+    if enabled() and response.status_code == 200:
+        return await asyncio.to_thread(record, endpoint, response.content, params, date)
+    return None
+
+
+def tee(endpoint, chunks, params=None, date=None):
+    """
+    Pass byte chunks through while compressing them into the archive, so a
+    streamed body is archived without being held in memory. The object is
+    committed once `chunks` is exhausted; an abandoned stream leaves nothing.
+    """
+    if not enabled():
+        yield from chunks
+        return
+    try:
+        fd, tmp_path = _temp_object()
+    except OSError as e:
+        logger.warning(f"Could not archive {endpoint} response: {e}")
+        yield from chunks
+        return
+    raw = os.fdopen(fd, 'wb')
+    gz = gzip.GzipFile(fileobj=raw, mode='wb', mtime=0, compresslevel=ARCHIVE_COMPRESSLEVEL)
+    digest = hashlib.sha256()
+    size = 0
+    archiving = True
+    try:
+        for chunk in chunks:
+            if archiving:
+                try:
+                    gz.write(chunk)
+                except OSError as e:
+                    logger.warning(f"Could not archive {endpoint} response: {e}")
+                    archiving = False
+                digest.update(chunk)
+                size += len(chunk)
+            yield chunk
+        if archiving:
+            try:
+                gz.close()
+                raw.close()
+                _store_object(tmp_path, digest.hexdigest())
+                _add_ref(digest.hexdigest(), size, endpoint, params, date)
+            except OSError as e:
+                logger.warning(f"Could not archive {endpoint} response: {e}")
+    finally:
+        try:
+            gz.close()
+            raw.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def refs(endpoint, start=None, end=None):
+    """
+    Latest ref per (params, date) for `endpoint`, optionally limited to
+    dates in [start, end], in date order.
+    """
+    latest = {}
+    try:
+        with open(_refs_path(endpoint), 'r', encoding='utf-8') as f:
+            for line in f:
+                ref = json.loads(line)
+                if (start and ref['date'] < start) or (end and ref['date'] > end):
+                    continue
+                latest[(_params_key(ref['params']), ref['date'])] = ref
+    except FileNotFoundError:
+        return []
+    return sorted(latest.values(), key=lambda ref: (ref['date'], _params_key(ref['params'])))
+
+
+def iter_chunks(sha256):
+    """
+    Yield the raw body of an archived object in decompressed blocks.
+    """
+    with gzip.open(_object_path(sha256), 'rb') as f:
+        while True:
+            block = f.read(_READ_SIZE)
+            if not block:
+                return
+            yield block
+
+
+def load(sha256):
+    """
+    Parsed JSON of an archived object, e.g. for offline fixtures.
+    """
+    with gzip.open(_object_path(sha256), 'rb') as f:
+        return json.loads(f.read())
+
+
+def replay(endpoint, start=None, end=None):
+    """
+    Rebuild the table fed by `endpoint` from archived payloads.
+    """
+    import app
+    import ingest
+    import rollups
+
+    summary = {"endpoint": endpoint, "dates": 0, "rows": 0, "failed_dates": []}
+    # rollups are refreshed once for the whole range at the end
+    with rollups.deferred():
+        for ref in refs(endpoint, start, end):
+            date = ref['date']
+            if endpoint == 'price_volume':
+                records = ingest.iter_array(iter_chunks(ref['sha256']), key='content')
+                result = app.save_price_volume_history_df(records, date)
+                rows = (result or {}).get('rows', 0)
+            else:
+                result = app._store_sector_wise_summary({"status": 200, "data": load(ref['sha256'])}, date)
+                rows = (result.get('response') or {}).get('rows', 0)
+            if result is not None and result.get('status') != 200:
+                logger.error(f"Replay of {endpoint} for {date} failed: {result.get('message')}")
+                summary['failed_dates'].append(date)
+                continue
+            summary['dates'] += 1
+            summary['rows'] += rows
+    summary['status'] = 200 if not summary['failed_dates'] else 207
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect and replay the raw upstream response archive')
+    commands = parser.add_subparsers(dest='command', required=True)
+    listing = commands.add_parser('list', help='archived refs per endpoint')
+    listing.add_argument('endpoint', nargs='?')
+    replaying = commands.add_parser('replay', help='rebuild a table from archived payloads')
+    replaying.add_argument('endpoint', choices=REPLAYABLE)
+    replaying.add_argument('--start', help='first date, YYYY-MM-DD')
+    replaying.add_argument('--end', help='last date, YYYY-MM-DD (inclusive)')
+    args = parser.parse_args(argv)
+
+    if not enabled():
+        logger.error("ARCHIVE_DIR environment variable is not set")
+        return 1
+    if args.command == 'list':
+        refs_dir = os.path.join(ARCHIVE_DIR, 'refs')
+        if args.endpoint:
+            endpoints = [args.endpoint]
+        elif os.path.isdir(refs_dir):
+            endpoints = sorted(name[:-len('.jsonl')] for name in os.listdir(refs_dir) if name.endswith('.jsonl'))
+        else:
+            endpoints = []
+        for endpoint in endpoints:
+            latest = refs(endpoint)
+            objects = {ref['sha256'] for ref in latest}
+            dates = [ref['date'] for ref in latest]
+            span = f"{dates[0]}..{dates[-1]}" if dates else '-'
+            print(f"{endpoint}: {len(latest)} refs, {len(objects)} distinct payloads, {span}")
+        return 0
+    summary = replay(args.endpoint, args.start, args.end)
+    logger.info(f"Replay finished: {summary}")
+    return 0 if summary['status'] == 200 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
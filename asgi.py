@@ -0,0 +1,163 @@
+"""
+ASGI entry point: uvicorn asgi:app
+
+The upstream-bound endpoints (financial, divided and market-summary) are
+served natively on the event loop, so a slow nepalstock.com.np response
+costs a suspended coroutine rather than a worker thread. Every other route
+falls through to the Flask app, including sector-summary, which only queues
+a job (see jobs.py).
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+import archive
+import resilience
+import timing
+import upstream
+
+logger = logging.getLogger(__name__)
+
+wsgi_app = WsgiToAsgi(flask_app.app)
+
+
+def _on_upstream_loop(coro):
+    # the shared AsyncClient lives on the upstream loop; hop there and back,
+    # taking the request's spans and deadline along
+    coro = resilience.carry(timing.carry(coro, timing.current()), resilience.current())
+    return asyncio.wrap_future(upstream.submit(coro))
+
+
+async def _read_json(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return json.loads(body) if body else None
+
+
+async def _send_json(send, body, status, headers=()):
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                    *headers],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _security_report(data, path, endpoint):
+    try:
+        # first use loads the security master from the database, so keep it off the loop
+        error = await asyncio.to_thread(flask_app._validate_security_request, data)
+    except Exception as e:
+        logger.error(f"Error validating security request: {str(e)}")
+        return {"message": "Failed to look up security_id", "status": 500}, 500
+    if error is not None:
+        return error
+    try:
+        url = f"{upstream.NEPSE_BASE_URL}/api/nots/application/{path}/{data['security_id']}"
+        response = await _on_upstream_loop(flask_app.token_manager.aget(
+            url, on_fetch=lambda response: archive.arecord_response(
+                endpoint, response, params={'security_id': data['security_id']})))
+        return flask_app._report_result(response)
+    except Exception as e:
+        logger.error(f"Error during login: {str(e)}")
+        return {"message": "Login failed", "status": 500}, 500
+
+
+async def financial(data):
+    logger.info('financial endpoint accessed (async)')
+    return await _security_report(data, 'reports', 'financial')
+
+
+async def divided(data):
+    logger.info('divided endpoint accessed (async)')
+    return await _security_report(data, 'dividend', 'divided')
+
+
+async def _afetch_market_summary_history():
+    url = f'{upstream.NEPSE_BASE_URL}/api/nots/market-summary-history'
+    response = await _on_upstream_loop(flask_app.token_manager.aget(
+        url, on_fetch=lambda response: archive.arecord_response('market_summary', response)))
+    # raise instead of caching an error payload
+    response.raise_for_status()
+    return response.json()
+
+
+async def market_summary(data):
+    logger.info('market_summary endpoint accessed (async)')
+    try:
+        validation = flask_app.api_validation(data)
+        if validation is not None:
+            logger.error(f"Validation failed: {validation['message']}")
+            return validation, validation['status']
+        response = await flask_app.response_cache.aget_or_compute(
+            'market_summary',
+            _afetch_market_summary_history,
+            lambda _: flask_app.cache.endpoint_ttl('market_summary', flask_app._market_open()),
+        )
+        return {"status": "success", "data": response}, 200
+    except Exception as e:
+        flask_app.rollbar.report_exc_info()
+        logger.error(f"Error getting market summary: {str(e)}")
+        return {"message": "Failed to retrieve market summary", "status": 500}, 500
+
+
+ASYNC_ROUTES = {
+    '/api/v1/financial': financial,
+    '/api/v1/divided': divided,
+    '/api/v1/market-summary': market_summary,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(upstream.close_clients)
+            # db is only imported once a request needed the database
+            db = sys.modules.get('db')
+            if db is not None:
+                await asyncio.to_thread(db.dispose_engines)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler is None or scope['method'] != 'POST':
+        await wsgi_app(scope, receive, send)
+        return
+    started = time.perf_counter()
+    spans = timing.begin_request()
+    resilience.begin_request()
+    try:
+        try:
+            data = await _read_json(receive)
+        except ValueError:
+            body, status = {"message": "Invalid JSON body", "status": 400}, 400
+        else:
+            body, status = await handler(data)
+        elapsed = time.perf_counter() - started
+        timing.request_seconds.observe(elapsed, route=scope['path'], method='POST', status=status)
+        headers = []
+        if timing.SERVER_TIMING:
+            headers.append((b'server-timing', timing.server_timing(spans, elapsed).encode()))
+        await _send_json(send, body, status, headers)
+    finally:
+        timing.end_request()
+        resilience.end_request()
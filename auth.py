@@ -0,0 +1,204 @@
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+import resilience
+import timing
+import upstream
+from singleflight import AsyncSingleFlight, SingleFlight, Timeout
+
+logger = logging.getLogger(__name__)
+
+coalesced = metrics.counter(
+    'upstream_coalesced_requests_total',
+    'Authorized upstream GETs by endpoint, fetched or shared with an identical one already in flight',
+    labelnames=('endpoint', 'result'),
+)
+
+
+def _copy(response):
+    # each caller of a shared fetch gets its own Response over the same body
+    copied = copy.copy(response)
+    copied.headers = response.headers.copy()
+    return copied
+
+
+class TokenManager:
+    """
+    Caches nepse.getAuthorizationHeaders() so requests do not pay for the
+    token proof-of-work on every call.
+
+    Headers are served from cache for `ttl` seconds. Once they are older
+    than `ttl - refresh_ahead` a background refresh is started while the
+    cached headers keep being served. Concurrent refreshes share one call
+    into the nepse library.
+
+    With `coalesce` (UPSTREAM_COALESCE, on by default) concurrent get()s
+    of the same URL share one fetch, so a burst of identical requests
+    costs nepalstock.com.np a single call. Callers waiting for a fetch
+    give up when their own deadline runs out.
+    """
+
+    def __init__(self, nepse, ttl=None, refresh_ahead=None, coalesce=None):
+        self.nepse = nepse
+        # the nepse library treats its access token as valid for 45 seconds
+        self.ttl = ttl if ttl is not None else float(os.getenv('NEPSE_TOKEN_TTL', 40))
+        self.refresh_ahead = (refresh_ahead if refresh_ahead is not None
+                              else float(os.getenv('NEPSE_TOKEN_REFRESH_AHEAD', 10)))
+        self._headers = None
+        self._fetched_at = 0.0
+        self.coalesce = (coalesce if coalesce is not None
+                         else os.getenv('UPSTREAM_COALESCE', 'true').strip().lower() in ('1', 'true', 'yes', 'on'))
+        self._flight = SingleFlight()
+        # upstream URL -> the GET in flight for it
+        self._gets = SingleFlight()
+        self._agets = AsyncSingleFlight()
+        self._background = None
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        started = time.monotonic()
+        with timing.span('auth'):
+            headers = resilience.call(self.nepse.getAuthorizationHeaders)
+        with self._lock:
+            self._headers = dict(headers)
+            self._fetched_at = time.monotonic()
+        logger.info(f"Authorization headers refreshed in {self._fetched_at - started:.2f}s")
+        return self._headers
+
+    def _refresh(self):
+        try:
+            return self._flight.do('headers', self._fetch, timeout=resilience.remaining())
+        except Timeout:
+            raise resilience.DeadlineExceeded("No time left waiting for authorization headers") from None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            self._background = threading.Thread(target=self._background_refresh, daemon=True)
+            self._background.start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            # the cached headers are still valid; the next caller retries
+            logger.error(f"Background authorization refresh failed: {str(e)}")
+
+    def headers(self):
+        """
+        Return authorization headers, refreshing them if needed.
+        """
+        with self._lock:
+            headers, age = self._headers, time.monotonic() - self._fetched_at
+        if headers is None or age >= self.ttl:
+            return dict(self._refresh())
+        if age >= self.ttl - self.refresh_ahead:
+            self._refresh_in_background()
+        return dict(headers)
+
+    def invalidate(self):
+        """
+        Drop the cached headers and make the nepse library mint a new token.
+        """
+        with self._lock:
+            self._headers = None
+            self._fetched_at = 0.0
+        token_manager = getattr(self.nepse, 'token_manager', None)
+        if token_manager is not None and hasattr(token_manager, 'token_time_stamp'):
+            token_manager.token_time_stamp = None
+
+    def _get(self, url, **kwargs):
+        response = upstream.get(url, headers=self.headers(), **kwargs)
+        if response.status_code == 401:
+            logger.info(f"Upstream returned 401 for {url}, refreshing authorization")
+            self.invalidate()
+            response = upstream.get(url, headers=self.headers(), **kwargs)
+        return response
+
+    def get(self, url, on_fetch=None, **kwargs):
+        """
+        Authorized GET through the shared upstream client. A 401 invalidates
+        the cached headers and the request is retried once. Plain GETs of a
+        URL already being fetched wait for that fetch and get a copy of its
+        response. `on_fetch(response)`, e.g. archiving it, runs once per
+        fetch, in the caller that made it.
+        """
+        if kwargs or not self.coalesce:
+            response = self._get(url, **kwargs)
+            if on_fetch is not None:
+                on_fetch(response)
+            return response
+        endpoint = resilience.endpoint_key(url)
+
+        def fetch():
+            coalesced.inc(endpoint=endpoint, result='fetched')
+            response = self._get(url)
+            if on_fetch is not None:
+                on_fetch(response)
+            return response
+
+        try:
+            response = self._gets.do(str(url), fetch, timeout=resilience.remaining(),
+                                     on_join=lambda: coalesced.inc(endpoint=endpoint, result='shared'))
+        except Timeout:
+            raise resilience.DeadlineExceeded(f"No time left waiting for upstream {endpoint}") from None
+        return _copy(response)
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        """
+        Authorized streamed request, see upstream.stream(). A 401 is retried
+        once with fresh headers before the body is handed out.
+        """
+        with upstream.stream(method, url, headers=self.headers(), **kwargs) as response:
+            if response.status_code != 401:
+                yield response
+                return
+        logger.info(f"Upstream returned 401 for {url}, refreshing authorization")
+        self.invalidate()
+        with upstream.stream(method, url, headers=self.headers(), **kwargs) as response:
+            yield response
+
+    async def _aget(self, url, **kwargs):
+        headers = await asyncio.to_thread(self.headers)
+        response = await upstream.aget(url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            logger.info(f"Upstream returned 401 for {url}, refreshing authorization")
+            self.invalidate()
+            headers = await asyncio.to_thread(self.headers)
+            response = await upstream.aget(url, headers=headers, **kwargs)
+        return response
+
+    async def aget(self, url, on_fetch=None, **kwargs):
+        """
+        Async twin of get(), with `on_fetch` a coroutine function. Runs on
+        the upstream loop; header refreshes are pushed to a worker thread so
+        the loop is never blocked by them.
+        """
+        if kwargs or not self.coalesce:
+            response = await self._aget(url, **kwargs)
+            if on_fetch is not None:
+                await on_fetch(response)
+            return response
+        endpoint = resilience.endpoint_key(url)
+
+        async def fetch():
+            coalesced.inc(endpoint=endpoint, result='fetched')
+            response = await self._aget(url)
+            if on_fetch is not None:
+                await on_fetch(response)
+            return response
+
+        try:
+            response = await self._agets.do(str(url), fetch, timeout=resilience.remaining(),
+                                            on_join=lambda: coalesced.inc(endpoint=endpoint, result='shared'))
+        except Timeout:
+            raise resilience.DeadlineExceeded(f"No time left waiting for upstream {endpoint}") from None
+        return _copy(response)
@@ -0,0 +1,187 @@
+import argparse
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+import db
+import resilience
+import rollups
+import trading_calendar
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TABLE = 'backfill_progress'
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1/rate seconds apart across all worker threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def ensure_progress_table(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} ("
+        "business_date VARCHAR(10) PRIMARY KEY, "
+        "status VARCHAR(16) NOT NULL, "
+        "row_count INTEGER, "
+        "error TEXT, "
+        "updated_at TIMESTAMP)"
+    ))
+
+
+def _record_progress(business_date, status, rows=None, error=None):
+    with db.begin() as conn:
+        conn.execute(text(
+            f"INSERT INTO {PROGRESS_TABLE} (business_date, status, row_count, error, updated_at) "
+            "VALUES (:business_date, :status, :row_count, :error, :updated_at) "
+            "ON CONFLICT (business_date) DO UPDATE SET status = excluded.status, row_count = excluded.row_count, "
+            "error = excluded.error, updated_at = excluded.updated_at"
+        ), {"business_date": business_date, "status": status, "row_count": rows,
+            "error": error, "updated_at": datetime.now()})
+
+
+def _completed_dates(conn, start, end):
+    """
+    Dates in range that are already checkpointed or present in stock_prices.
+    """
+    params = {"start": start, "end": end}
+    rows = conn.execute(text(
+        f"SELECT business_date FROM {PROGRESS_TABLE} "
+        "WHERE business_date BETWEEN :start AND :end AND status IN ('done', 'no_data')"
+    ), params).fetchall()
+    completed = {str(row[0])[:10] for row in rows}
+    if inspect(conn).has_table('stock_prices'):
+        rows = conn.execute(text(
+            "SELECT DISTINCT business_date FROM stock_prices WHERE business_date BETWEEN :start AND :end"
+        ), params).fetchall()
+        completed.update(str(row[0])[:10] for row in rows)
+    return completed
+
+
+def plan(start, end, force=False):
+    """
+    Trading days in [start, end] that still need to be fetched.
+    """
+    days = [day.strftime('%Y-%m-%d') for day in trading_calendar.trading_days(start, end)]
+    with db.begin() as conn:
+        ensure_progress_table(conn)
+        if force or not days:
+            return days
+        completed = _completed_dates(conn, days[0], days[-1])
+    return [day for day in days if day not in completed]
+
+
+def run_backfill(start, end, fetch, save, workers=4, rate=2.0, force=False):
+    """
+    Fetch and store price/volume history for every missing trading day in
+    [start, end].
+
+    `fetch(date_str)` returns the upstream payload for a day, or a lazy
+    iterable of its records, and `save(payload, date_str)` writes it,
+    returning None when the day has no data. Progress is checkpointed per day so an interrupted run
+    resumes where it stopped.
+    """
+    if db.get_engine() is None:
+        return {"message": "DATABASE_URL environment variable is not set", "status": 500}
+    days = plan(start, end, force=force)
+    logger.info(f"Backfill {start}..{end}: {len(days)} trading days to fetch with {workers} workers")
+
+    limiter = RateLimiter(rate)
+    summary = {"done": 0, "no_data": 0, "failed": 0, "rows": 0, "failed_dates": []}
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def process(day):
+        limiter.wait()
+        # each day gets its own upstream budget: the copied context carries
+        # the deadline of the request that started the backfill
+        resilience.begin_request()
+        payload = fetch(day)
+        result = save(payload, day)
+        if result is None:
+            return 'no_data', 0
+        if result.get('status') != 200:
+            raise RuntimeError(result.get('message', 'save failed'))
+        if 'rows' in result:
+            return 'done', result['rows']
+        return 'done', len(payload.get('content', [])) if isinstance(payload, dict) else 0
+
+    # rollups are refreshed once for all fetched days when the pool is done;
+    # the workers run in copies of this context to see the deferral
+    with rollups.deferred(), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(contextvars.copy_context().run, process, day): day for day in days}
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                status, rows = future.result()
+                _record_progress(day, status, rows=rows)
+            except Exception as e:
+                status, rows = 'failed', 0
+                logger.error(f"Backfill failed for {day}: {str(e)}")
+                _record_progress(day, status, error=str(e)[:1000])
+            with lock:
+                summary[status] += 1
+                summary['rows'] += rows
+                if status == 'failed':
+                    summary['failed_dates'].append(day)
+                finished = summary['done'] + summary['no_data'] + summary['failed']
+                elapsed = time.perf_counter() - started
+            logger.info(f"Backfill {finished}/{len(days)} ({day} {status}): "
+                        f"{finished / elapsed:.2f} days/s, {summary['rows'] / elapsed:.0f} rows/s")
+
+    elapsed = time.perf_counter() - started
+    summary.update({
+        "status": 200 if not summary['failed'] else 207,
+        "start_date": str(start),
+        "end_date": str(end),
+        "days": len(days),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(summary['rows'] / elapsed) if elapsed > 0 else 0,
+    })
+    summary['failed_dates'].sort()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill NEPSE price/volume history')
+    parser.add_argument('start_date', help='first date, YYYY-MM-DD')
+    parser.add_argument('end_date', help='last date, YYYY-MM-DD (inclusive)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BACKFILL_WORKERS', 4)))
+    parser.add_argument('--rate', type=float, default=float(os.getenv('BACKFILL_RATE', 2.0)),
+                        help='maximum upstream requests per second')
+    parser.add_argument('--force', action='store_true', help='refetch dates that are already stored')
+    args = parser.parse_args(argv)
+
+    from app import _stream_price_volume_history, save_price_volume_history_df
+
+    summary = run_backfill(args.start_date, args.end_date, _stream_price_volume_history,
+                           save_price_volume_history_df, workers=args.workers,
+                           rate=args.rate, force=args.force)
+    logger.info(f"Backfill finished: {summary}")
+    return 0 if summary.get('status') == 200 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import time
+from urllib.parse import urlsplit
+
+import archive
+import upstream
+
+logger = logging.getLogger(__name__)
+
+REPORT_URLS = {
+    'financial': upstream.NEPSE_BASE_URL + '/api/nots/application/reports/{security_id}',
+    'divided': upstream.NEPSE_BASE_URL + '/api/nots/application/dividend/{security_id}',
+}
+
+DEFAULT_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+DEFAULT_HOST_RATE = float(os.getenv('BATCH_HOST_RATE', 5.0))
+
+_DONE = object()
+_host_limiters = {}
+
+
+class AsyncRateLimiter:
+    """
+    Spaces request starts at least 1/rate seconds apart. Only used on the
+    upstream loop, so plain attribute updates are safe.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def _host_limiter(url, rate):
+    host = urlsplit(url).hostname or ''
+    limiter = _host_limiters.get(host)
+    if limiter is None:
+        limiter = _host_limiters[host] = AsyncRateLimiter(rate)
+    return limiter
+
+
+async def _fetch_one(kind, security_id, token_manager, semaphore, rate):
+    url = REPORT_URLS[kind].format(security_id=security_id)
+    async with semaphore:
+        await _host_limiter(url, rate).wait()
+        try:
+            response = await token_manager.aget(url, on_fetch=lambda response: archive.arecord_response(
+                kind, response, params={'security_id': security_id}))
+            if response.status_code == 200:
+                payload = response.json()
+                return {"security_id": security_id, "status": 200, "data": payload[0] if payload else None}
+            return {"security_id": security_id, "status": response.status_code,
+                    "message": "Failed to retrieve data"}
+        except Exception as e:
+            logger.error(f"Error retrieving {kind} for {security_id}: {str(e)}")
+            return {"security_id": security_id, "status": 500, "message": str(e)}
+
+
+async def fetch_many(kind, security_ids, token_manager, emit, concurrency=None, rate=None):
+    """
+    Fetch `kind` reports for every id, calling `emit(result)` as each one
+    completes. Failures are emitted as results, never raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency or DEFAULT_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(_fetch_one(kind, security_id, token_manager, semaphore, rate or DEFAULT_HOST_RATE))
+        for security_id in security_ids
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            emit(await task)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def stream_ndjson(kind, security_ids, token_manager, missing_ids=(), concurrency=None, rate=None):
+    """
+    Generator of NDJSON lines, one per security id in completion order,
+    followed by a summary line.
+    """
+    started = time.perf_counter()
+    results = queue.Queue()
+    counts = {"ok": 0, "failed": 0}
+
+    for security_id in missing_ids:
+        counts['failed'] += 1
+        yield json.dumps({"security_id": security_id, "status": 404,
+                          "message": f"Security ID {security_id} not found"}) + '\n'
+
+    future = upstream.submit(fetch_many(kind, security_ids, token_manager, results.put, concurrency, rate))
+    future.add_done_callback(lambda _: results.put(_DONE))
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            counts['ok' if item['status'] == 200 else 'failed'] += 1
+            yield json.dumps(item) + '\n'
+        future.result()
+    finally:
+        # the client went away or something failed; stop outstanding fetches
+        future.cancel()
+    elapsed = time.perf_counter() - started
+    logger.info(f"Batch {kind} finished: {counts['ok']} ok, {counts['failed']} failed in {elapsed:.2f}s")
+    yield json.dumps({"summary": {"requested": len(security_ids) + len(missing_ids), **counts,
+                                  "seconds": round(elapsed, 3)}}) + '\n'
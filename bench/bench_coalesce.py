@@ -0,0 +1,90 @@
+"""
+Upstream calls made by bursts of identical report requests, with and
+without coalescing.
+
+    python -m bench.bench_coalesce
+    python -m bench.bench_coalesce --clients 32 --securities 4 --latency 0.2
+
+--clients callers ask for the financial report of one of --securities ids
+at the same moment, from threads through TokenManager.get and as
+coroutines through TokenManager.aget, against bench.fake_nepse answering
+after --latency seconds. Printed per path and setting: upstream requests
+the fake received, wall time of the burst and what
+upstream_coalesced_requests_total recorded.
+"""
+import argparse
+import asyncio
+import sys
+import threading
+import time
+
+from bench import fake_nepse
+from bench.suite import NepseStandIn
+
+PATH = '/api/nots/application/reports/{}'
+ENDPOINT = '/api/nots/application/reports/{id}'
+
+
+def _sync_burst(token_manager, urls):
+    barrier = threading.Barrier(len(urls))
+
+    def call(url):
+        barrier.wait()
+        token_manager.get(url)
+
+    threads = [threading.Thread(target=call, args=(url,)) for url in urls]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def _async_burst(token_manager, urls):
+    import upstream
+
+    async def burst():
+        await asyncio.gather(*(token_manager.aget(url) for url in urls))
+
+    started = time.perf_counter()
+    upstream.run(burst())
+    return time.perf_counter() - started
+
+
+def _counted():
+    import auth
+    return {result: auth.coalesced.value(endpoint=ENDPOINT, result=result) for result in ('fetched', 'shared')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--securities', type=int, default=4, help='distinct security ids in a burst')
+    parser.add_argument('--latency', type=float, default=0.2, help='fake upstream latency in seconds')
+    args = parser.parse_args(argv)
+
+    import auth
+
+    server = fake_nepse.start(latency=args.latency)
+    base_url = fake_nepse.base_url(server)
+    urls = [f'{base_url}{PATH.format(100 + i % args.securities)}' for i in range(args.clients)]
+    hits = server.RequestHandlerClass.hits
+
+    print(f"{args.clients} clients, {args.securities} securities, {args.latency}s upstream latency")
+    print(f"{'path':<6} {'coalesce':<9} {'upstream':>8} {'seconds':>8} {'fetched':>8} {'shared':>7}")
+    for name, burst in (('thread', _sync_burst), ('async', _async_burst)):
+        for coalesce in (False, True):
+            token_manager = auth.TokenManager(NepseStandIn(base_url), coalesce=coalesce)
+            token_manager.headers()
+            requests, counted = sum(hits.values()), _counted()
+            seconds = burst(token_manager, urls)
+            after = _counted()
+            print(f"{name:<6} {'on' if coalesce else 'off':<9} {sum(hits.values()) - requests:>8} {seconds:>8.3f} "
+                  f"{after['fetched'] - counted['fetched']:>8.0f} {after['shared'] - counted['shared']:>7.0f}")
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
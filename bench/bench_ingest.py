@@ -0,0 +1,80 @@
+"""
+Peak memory and time of buffered versus streamed price/volume ingestion.
+
+    python -m bench.bench_ingest --rows 5000 50000 200000
+
+Buffered is the old path: response.json(), one frame for the whole payload,
+one upsert. Streamed parses 'content' records off the response with
+ingest.iter_array and writes them in --chunk-rows chunks. Both read from
+bench.fake_nepse and write into a throwaway SQLite database unless
+--database-url is given. Seconds are untraced; peak memory comes from a
+second, tracemalloc-traced run.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import httpx
+
+from bench import fake_nepse
+from bench.bench_normalize import SCHEMA
+
+
+def buffered(url):
+    import bulk
+    import db
+    records = httpx.post(url, json={'id': 1}).json()['content']
+    df = SCHEMA.normalize(records)
+    with db.begin() as conn:
+        return bulk.upsert(conn, df, 'stock_prices')['rows']
+
+
+def streamed(url, chunk_rows):
+    import ingest
+    with httpx.stream('POST', url, json={'id': 1}) as response:
+        records = ingest.iter_array(response.iter_bytes(), key='content')
+        return ingest.load_records(records, SCHEMA, 'stock_prices', chunk_rows=chunk_rows)['rows']
+
+
+def measure(fn, run):
+    import db
+    db.dispose_engines()
+    started = time.perf_counter()
+    rows = fn(run * 2)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn(run * 2 + 1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 200000])
+    parser.add_argument('--chunk-rows', type=int, default=2000)
+    parser.add_argument('--database-url', help='write here instead of a throwaway SQLite file')
+    args = parser.parse_args(argv)
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    print(f"{'rows':>8} {'path':>9} {'seconds':>8} {'peak MB':>8}")
+    run = 0
+    for rows in args.rows:
+        server = fake_nepse.start(price_rows=rows)
+        url = f"{fake_nepse.base_url(server)}/api/nots/nepse-data/today-price?size=500&businessDate="
+        for name, fn in (('buffered', buffered), ('streamed', lambda u: streamed(u, args.chunk_rows))):
+            # every call loads a business date not seen before, so all rows are inserts
+            written, seconds, peak = measure(lambda day: fn(url + str(date(2000, 1, 1) + timedelta(days=day))), run)
+            run += 1
+            assert written == rows, (written, rows)
+            print(f"{rows:>8} {name:>9} {seconds:>8.2f} {peak / 2**20:>8.1f}")
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
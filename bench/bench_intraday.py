@@ -0,0 +1,56 @@
+"""
+Rows written by the intraday poller against a live market where a given
+share of securities trades between snapshots.
+
+    python -m bench.bench_intraday --polls 60 --change-rates 0.02 0.1 0.5
+
+Each change rate polls bench.fake_nepse --polls times with
+intraday.IntradayPoller into a throwaway SQLite database (or
+--database-url) and prints rows seen, rows written, rows in
+stock_prices_intraday and the mean seconds per poll. Writing every
+snapshot in full would store rows seen.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench import fake_nepse
+from bench.suite import NepseStandIn
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--polls', type=int, default=60)
+    parser.add_argument('--change-rates', type=float, nargs='+', default=[0.02, 0.1, 0.5])
+    parser.add_argument('--database-url', help='write here instead of a throwaway SQLite file')
+    args = parser.parse_args(argv)
+
+    import db
+    import intraday
+    from sqlalchemy import text
+
+    print(f"{'change':>7} {'seen':>8} {'written':>8} {'stored':>8} {'s/poll':>7}")
+    for rate in args.change_rates:
+        os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+        db.dispose_engines()
+        server = fake_nepse.start()
+        server.RequestHandlerClass.live_change_rate = rate
+        poller = intraday.IntradayPoller(NepseStandIn(fake_nepse.base_url(server)))
+        seen = written = 0
+        started = time.perf_counter()
+        for _ in range(args.polls):
+            result = poller.poll()
+            seen += result['rows']
+            written += result['changed']
+        seconds = (time.perf_counter() - started) / args.polls
+        with db.begin() as conn:
+            stored = conn.execute(text(f'SELECT count(*) FROM {intraday.TABLE}')).scalar()
+        print(f"{rate:>7.0%} {seen:>8} {written:>8} {stored:>8} {seconds:>7.3f}")
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Time and peak memory of price/volume normalization per payload size.
+
+    python -m bench.bench_normalize --rows 1000 100000
+
+Compares the original multi-pass pipeline from save_price_volume_history_df
+against the compiled FrameSchema used now. Needs no network or database.
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from normalize import FrameSchema, camel_to_snake
+
+# mirrors app.dtype_spec / app.price_volume_schema() without importing the app
+DTYPE_SPEC = {
+    'id': 'Int64', 'businessDate': 'string', 'securityId': 'Int64', 'symbol': 'string',
+    'securityName': 'string', 'openPrice': 'float64', 'highPrice': 'float64', 'lowPrice': 'float64',
+    'closePrice': 'float64', 'totalTradedQuantity': 'float64', 'totalTradedValue': 'float64',
+    'previousDayClosePrice': 'float64', 'fiftyTwoWeekHigh': 'float64', 'fiftyTwoWeekLow': 'float64',
+    'lastUpdatedTime': 'string', 'lastUpdatedPrice': 'float64', 'totalTrades': 'float64',
+    'averageTradedPrice': 'float64', 'marketCapitalization': 'float64',
+}
+SCHEMA = FrameSchema(
+    DTYPE_SPEC,
+    date_formats={'businessDate': 'ISO8601', 'lastUpdatedTime': '%Y-%m-%dT%H:%M:%S.%f'},
+    drop=('id',),
+    float32=('openPrice', 'highPrice', 'lowPrice', 'closePrice', 'previousDayClosePrice',
+             'fiftyTwoWeekHigh', 'fiftyTwoWeekLow', 'lastUpdatedPrice', 'averageTradedPrice'),
+    categorical=('symbol', 'securityName'),
+    sort_by='businessDate',
+)
+
+
+def make_records(rows, securities=250):
+    rng = random.Random(42)
+    records = []
+    for i in range(rows):
+        security = i % securities
+        day = 1 + (i // securities) % 28
+        price = round(rng.uniform(100, 5000), 2)
+        records.append({
+            'id': i, 'businessDate': f'2024-02-{day:02d}', 'securityId': 100 + security,
+            'symbol': f'SYM{security}', 'securityName': f'Security Name {security} Limited',
+            'openPrice': price, 'highPrice': price + 10, 'lowPrice': price - 10, 'closePrice': price + 1,
+            'totalTradedQuantity': float(rng.randint(100, 100000)), 'totalTradedValue': price * 1000,
+            'previousDayClosePrice': price - 1, 'fiftyTwoWeekHigh': price + 500, 'fiftyTwoWeekLow': price - 50,
+            'lastUpdatedTime': f'2024-02-{day:02d}T14:59:59.123', 'lastUpdatedPrice': price + 1,
+            'totalTrades': float(rng.randint(1, 900)), 'averageTradedPrice': price,
+            'marketCapitalization': price * 1e7,
+        })
+    return records
+
+
+def legacy_normalize(records):
+    df = pd.DataFrame(records)
+    df = df.astype(DTYPE_SPEC)
+    df["businessDate"] = pd.to_datetime(df["businessDate"], errors="coerce")
+    df['lastUpdatedTime'] = pd.to_datetime(df['lastUpdatedTime'], errors='coerce', format='%Y-%m-%dT%H:%M:%S.%f')
+    if 'id' in df.columns:
+        df = df.drop(columns=['id'])
+    df.columns = [camel_to_snake(col) for col in df.columns]
+    if 'total_trades' in df.columns:
+        df['total_trades'] = pd.to_numeric(df['total_trades'], errors='coerce')
+    df = df.sort_values(by="business_date", ascending=True)
+    df['business_date'] = df['business_date'].dt.strftime('%Y-%m-%d')
+    return df
+
+
+def measure(fn, records, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(records)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    df = fn(records)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, df.memory_usage(deep=True).sum()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>8} {'pipeline':>8} {'ms':>9} {'ms/1k rows':>10} {'peak MB':>8} {'frame MB':>8}")
+    for rows in args.rows:
+        records = make_records(rows)
+        for name, fn in (('legacy', legacy_normalize), ('schema', SCHEMA.normalize)):
+            seconds, peak, frame = measure(fn, records, args.repeat)
+            print(f"{rows:>8} {name:>8} {seconds * 1000:>9.1f} {seconds * 1e6 / rows:>10.2f} "
+                  f"{peak / 2**20:>8.1f} {frame / 2**20:>8.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
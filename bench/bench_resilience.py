@@ -0,0 +1,126 @@
+"""
+Upstream resilience against a misbehaving bench.fake_nepse.
+
+    python -m bench.bench_resilience
+    python -m bench.bench_resilience --calls 400 --error-rate 0.3
+
+flaky     share of financial GETs that succeed when the fake answers
+          --error-rate of requests with 503, without and with retries
+outage    time for --calls GETs while every request fails, without and
+          with the circuit breaker
+tail      p50/p99 of today-price streams when --slow-rate of responses
+          take --slow-seconds longer, without and with hedging
+deadline  how long a call to a stalled upstream takes under a 1s deadline
+"""
+import argparse
+import time
+
+import httpx
+
+from bench import fake_nepse
+from bench.harness import percentile
+
+
+def _financial(base_url, i):
+    import upstream
+    return upstream.get(f'{base_url}/api/nots/application/reports/{100 + i % 50}')
+
+
+def flaky(base_url, server, args):
+    import resilience
+    server.RequestHandlerClass.error_rate = args.error_rate
+    results = {}
+    for label, retries in (('no retries', 0), (f'{args.retries} retries', args.retries)):
+        resilience.RETRIES = retries
+        # a high threshold so the breaker stays out of this comparison
+        resilience._breakers.clear()
+        resilience.BREAKER_FAILURES = 10 ** 6
+        ok = sum(_financial(base_url, i).status_code == 200 for i in range(args.calls))
+        results[label] = f'{ok / args.calls:.1%} succeeded'
+    server.RequestHandlerClass.error_rate = 0.0
+    return results
+
+
+def outage(base_url, server, args):
+    import resilience
+    server.RequestHandlerClass.error_rate = 1.0
+    resilience.RETRIES = args.retries
+    results = {}
+    for label, threshold in (('no breaker', 10 ** 6), ('breaker', 5)):
+        resilience._breakers.clear()
+        resilience.BREAKER_FAILURES = threshold
+        started = time.perf_counter()
+        for i in range(args.calls):
+            try:
+                _financial(base_url, i)
+            except resilience.CircuitOpen:
+                pass
+        rejected = resilience.rejections.value(endpoint='/api/nots/application/reports/{id}')
+        results[label] = f'{time.perf_counter() - started:.2f}s for {args.calls} calls ({rejected:.0f} rejected so far)'
+    server.RequestHandlerClass.error_rate = 0.0
+    return results
+
+
+def tail(base_url, server, args):
+    import resilience
+    import upstream
+    server.RequestHandlerClass.slow_rate = args.slow_rate
+    server.RequestHandlerClass.slow_seconds = args.slow_seconds
+    resilience._breakers.clear()
+    results = {}
+    url = f'{base_url}/api/nots/nepse-data/today-price?size=500&businessDate=2024-01-04'
+    for label, hedge_after in (('no hedging', None), (f'hedged after {args.hedge_after}s', args.hedge_after)):
+        seconds = []
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            with upstream.stream('POST', url, json={'id': 1}, retry=True, hedge_after=hedge_after) as response:
+                response.read()
+            seconds.append(time.perf_counter() - started)
+        seconds.sort()
+        results[label] = (f'p50 {percentile(seconds, 0.5) * 1000:.0f}ms, '
+                          f'p99 {percentile(seconds, 0.99) * 1000:.0f}ms')
+    server.RequestHandlerClass.slow_rate = 0.0
+    return results
+
+
+def deadline(base_url, server, args):
+    import resilience
+    server.RequestHandlerClass.slow_rate = 1.0
+    server.RequestHandlerClass.slow_seconds = 5.0
+    resilience._breakers.clear()
+    resilience.begin_request(1.0)
+    started = time.perf_counter()
+    try:
+        _financial(base_url, 0)
+        outcome = 'answered'
+    except (httpx.TimeoutException, resilience.DeadlineExceeded) as e:
+        outcome = e.__class__.__name__
+    finally:
+        resilience.end_request()
+    server.RequestHandlerClass.slow_rate = 0.0
+    return {'1s deadline, 5s upstream': f'{outcome} after {time.perf_counter() - started:.2f}s'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-seconds', type=float, default=1.0)
+    parser.add_argument('--hedge-after', type=float, default=0.2)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    server = fake_nepse.start(latency=args.latency)
+    base_url = fake_nepse.base_url(server)
+    import resilience
+    resilience.BACKOFF_BASE = 0.01
+    for name, scenario in (('flaky', flaky), ('outage', outage), ('tail', tail), ('deadline', deadline)):
+        for label, result in scenario(base_url, server, args).items():
+            print(f'{name:<9} {label:<22} {result}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Cold-start cost per route: importing app.py, then the first request.
+
+    python -m bench.bench_startup
+    python -m bench.bench_startup --routes / /api/v1/market_status --repeat 5
+
+Every run is a fresh `python -X importtime` process that imports app,
+swaps the nepse client for one answering from bench.fake_nepse, and sends
+one request with Flask's test client. Printed per route (medians of
+--repeat runs): wall time and modules imported for `import app`, the same
+for the first request, and the request's heaviest top-level imports by
+importtime cumulative time, i.e. what a cold start of that route pays for
+on top of the app. The nepse package is not exercised through the fake, so
+its import and client construction are reported on a line of their own
+when it is installed.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from bench import fake_nepse
+
+SECRET = 'bench-secret'
+
+# path -> request body on top of the secret key; '/' is a GET
+ROUTES = {
+    '/': None,
+    '/metrics': None,
+    '/api/v1/market_status': {},
+    '/api/v1/financial': {'security_id': 100},
+    '/api/v1/market-summary': {},
+    '/api/v1/sector-overview': {},
+    '/api/v1/company-list': {'wait': True},
+    '/api/v1/scrape': {'wait': True},
+    '/api/v1/prices': {'limit': 10},
+}
+
+CHILD = '''
+import os, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+from bench.suite import NepseStandIn
+app.nepse = app.token_manager.nepse = NepseStandIn(os.environ['NEPSE_BASE_URL'])
+app._market_closed_message = lambda current_date: None
+# the stand-in and the test client are imported before the request phase starts
+client = app.app.test_client()
+body = {body}
+print('bench_startup: request', file=sys.stderr, flush=True)
+began = time.perf_counter()
+if body is None:
+    response = client.get({path!r})
+else:
+    response = client.post({path!r}, json=dict(body, secret_key_scrape={secret!r}))
+done = time.perf_counter()
+print('bench_startup: done', file=sys.stderr, flush=True)
+print(imported - started, done - began, response.status_code)
+'''
+
+NEPSE_CHILD = '''
+import time
+started = time.perf_counter()
+from nepse import Nepse
+imported = time.perf_counter()
+Nepse()
+print(imported - started, time.perf_counter() - imported)
+'''
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+def _phases(stderr):
+    """
+    importtime entries (self us, cumulative us, depth, module) for the
+    import of app and for the first request.
+    """
+    phases = {'import': [], 'request': []}
+    phase = 'import'
+    for line in stderr.splitlines():
+        if line.startswith('bench_startup: '):
+            phase = {'request': 'request', 'done': None}[line.split(': ', 1)[1]]
+            continue
+        match = _IMPORT_LINE.match(line)
+        if match and phase is not None:
+            depth = (len(match.group(3)) - 1) // 2
+            phases[phase].append((int(match.group(1)), int(match.group(2)), depth, match.group(4)))
+    return phases
+
+
+def run_route(path, env):
+    body = ROUTES[path]
+    code = CHILD.format(path=path, body=repr(body), secret=SECRET)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'{path} failed:\n{completed.stderr[-2000:]}')
+    import_seconds, request_seconds, status = completed.stdout.split()[-3:]
+    phases = _phases(completed.stderr)
+    request = phases['request']
+    top = sorted((entry for entry in request if entry[2] == 0), key=lambda entry: -entry[1])
+    return {
+        'status': int(status),
+        'import_ms': float(import_seconds) * 1000,
+        'import_modules': len(phases['import']),
+        'request_ms': float(request_seconds) * 1000,
+        'request_modules': len(request),
+        'request_import_ms': sum(entry[0] for entry in request) / 1000,
+        'heaviest': [(name, cumulative / 1000) for _, cumulative, _, name in top[:3]],
+    }
+
+
+def nepse_cost():
+    completed = subprocess.run([sys.executable, '-c', NEPSE_CHILD], capture_output=True, text=True)
+    if completed.returncode != 0:
+        return None
+    return [float(value) * 1000 for value in completed.stdout.split()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', nargs='+', default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    server = fake_nepse.start()
+    env = dict(os.environ, NEPSE_BASE_URL=fake_nepse.base_url(server), SECRET_KEY_SCRAPE=SECRET,
+               BATCH_HOST_RATE='10000')
+    results = {}
+    for path in args.routes:
+        runs = []
+        for _ in range(args.repeat):
+            # a database of its own per run, so nothing is warm
+            env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+            runs.append(run_route(path, env))
+        result = {key: statistics.median(run[key] for run in runs)
+                  for key in ('import_ms', 'import_modules', 'request_ms', 'request_modules', 'request_import_ms')}
+        result['status'] = runs[-1]['status']
+        result['heaviest'] = runs[-1]['heaviest']
+        results[path] = result
+    server.shutdown()
+    nepse = nepse_cost()
+
+    if args.json:
+        print(json.dumps({'routes': results, 'nepse_ms': nepse}, indent=2))
+        return 0
+    print(f"{'route':<24} {'status':>6} {'import ms':>9} {'modules':>7} {'request ms':>10} {'modules':>7} "
+          f"{'importtime ms':>13}  heaviest request imports")
+    for path, result in results.items():
+        heaviest = ', '.join(f'{name} {ms:.0f}ms' for name, ms in result['heaviest'])
+        print(f"{path:<24} {result['status']:>6} {result['import_ms']:>9.0f} {result['import_modules']:>7.0f} "
+              f"{result['request_ms']:>10.0f} {result['request_modules']:>7.0f} "
+              f"{result['request_import_ms']:>13.0f}  {heaviest}")
+    if nepse is None:
+        print("nepse package not installed; its import and Nepse() are not included")
+    else:
+        print(f"nepse package: import {nepse[0]:.0f}ms, Nepse() {nepse[1]:.0f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import collections
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _report(security_id):
+    return [{
+        "securityId": security_id,
+        "fiscalReport": {"peValue": 21.4, "epsValue": 32.1, "netWorthPerShare": 210.5,
+                         "quarterMaster": {"quarterName": "First Quarter"},
+                         "reportTypeMaster": {"reportName": "Quarterly Report"}},
+    }]
+
+
+def _dividend(security_id):
+    return [{"securityId": security_id, "cashDividend": 10.0, "bonusShare": 5.0, "fiscalYear": "2080/2081"}]
+
+
+def _market_summary():
+    return [{"businessDate": "2024-01-04", "totalTurnover": 3.2e9, "totalTradedShares": 8.1e6,
+             "totalTransactions": 61234, "tradedScrips": 302}]
+
+
+def _sectorwise():
+    return [{"businessDate": "2024-01-04", "sectorName": name, "totalTransaction": 1000.0,
+             "turnOverValues": 1.5e8, "turnOverVolume": 4.2e5}
+            for name in ("Commercial Banks", "Hydro Power", "Life Insurance", "Microfinance")]
+
+
+def _price_volume_row(i, business_date):
+    # one row per security, as in a single day's page
+    security = i
+    price = 100.0 + (i * 7919) % 4900
+    return {"id": i, "businessDate": business_date, "securityId": 100 + security, "symbol": f"SYM{security}",
+            "securityName": f"Security Name {security} Limited", "openPrice": price, "highPrice": price + 10,
+            "lowPrice": price - 10, "closePrice": price + 1, "totalTradedQuantity": 1000.0 + i % 997,
+            "totalTradedValue": price * 1000, "previousDayClosePrice": price - 1, "fiftyTwoWeekHigh": price + 500,
+            "fiftyTwoWeekLow": price - 50, "lastUpdatedTime": f"{business_date}T14:59:59.123",
+            "lastUpdatedPrice": price + 1, "totalTrades": float(1 + i % 900), "averageTradedPrice": price,
+            "marketCapitalization": price * 1e7}
+
+
+SECTORS = ("Commercial Banks", "Hydro Power", "Life Insurance", "Microfinance", "Manufacturing And Processing")
+
+
+def _market_open():
+    return {"isOpen": "CLOSE", "asOf": "2024-01-04T15:00:00", "id": 1}
+
+
+def _summary():
+    return [{"detail": detail, "value": value} for detail, value in (
+        ("Total Turnover Rs:", 3.2e9), ("Total Traded Shares", 8.1e6), ("Total Transactions", 61234.0),
+        ("Total Scrips Traded", 302.0), ("Total Market Capitalization Rs:", 4.4e12))]
+
+
+def _company_list(companies=330):
+    return [{"id": i, "companyName": f"Security Name {i} Limited", "symbol": f"SYM{i}",
+             "securityName": f"Security Name {i} Limited", "status": "A", "sectorName": SECTORS[i % len(SECTORS)],
+             "instrumentType": "Equity"} for i in range(companies)]
+
+
+def _live_row(i, price, volume, updated):
+    return {"securityId": 100 + i, "securityName": f"Security Name {i} Limited", "symbol": f"SYM{i}", "indexId": 58,
+            "openPrice": 100.0 + (i * 7919) % 4900, "highPrice": price + 5, "lowPrice": price - 5,
+            "totalTradeQuantity": volume, "totalTradeValue": round(volume * price, 2), "lastTradedPrice": price,
+            "percentageChange": round((price / (100.0 + (i * 7919) % 4900) - 1) * 100, 2),
+            "lastUpdatedDateTime": updated, "lastTradedVolume": 10.0, "previousClose": 100.0 + (i * 7919) % 4900,
+            "averageTradedPrice": price}
+
+
+# (archive endpoint name, path pattern, payload builder)
+ROUTES = [
+    ('financial', re.compile(r'^/api/nots/application/reports/(\d+)$'), lambda m: _report(int(m.group(1)))),
+    ('divided', re.compile(r'^/api/nots/application/dividend/(\d+)$'), lambda m: _dividend(int(m.group(1)))),
+    ('market_summary', re.compile(r'^/api/nots/market-summary-history$'), lambda m: _market_summary()),
+    ('sectorwise', re.compile(r'^/api/nots/sectorwise$'), lambda m: _sectorwise()),
+    ('market_status', re.compile(r'^/api/nots/nepse-data/market-open$'), lambda m: _market_open()),
+    ('sector_overview', re.compile(r'^/api/nots/market-summary/$'), lambda m: _summary()),
+    ('company_list', re.compile(r'^/api/nots/company/list$'), lambda m: _company_list()),
+]
+
+
+def load_fixtures(archive_dir):
+    """
+    Latest recorded body per endpoint from a response archive (see
+    archive.py), so the fake serves realistic payload sizes.
+    """
+    fixtures = {}
+    refs_dir = os.path.join(archive_dir, 'refs')
+    for name in os.listdir(refs_dir):
+        if not name.endswith('.jsonl'):
+            continue
+        with open(os.path.join(refs_dir, name), 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        if lines:
+            sha256 = json.loads(lines[-1])['sha256']
+            with gzip.open(os.path.join(archive_dir, 'objects', sha256[:2], f'{sha256}.json.gz'), 'rb') as f:
+                fixtures[name[:-len('.jsonl')]] = f.read()
+    return fixtures
+
+
+class FakeNepseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    # rows served by today-price regardless of the requested page size
+    price_rows = None
+    # endpoint name -> recorded body served instead of the generated payload
+    fixtures = {}
+    # share of securities that trade between two live-market snapshots
+    live_change_rate = 0.1
+    # security index -> (last price, volume, updated at) served by lives-market
+    live = None
+    live_lock = None
+    # fault injection: share of requests answered 503, and of requests
+    # delayed by slow_seconds on top of latency
+    error_rate = 0.0
+    slow_rate = 0.0
+    slow_seconds = 0.0
+    # path -> requests received, guarded by live_lock
+    hits = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _inject_faults(self):
+        """
+        Apply latency and the configured faults; True if a 503 was sent.
+        """
+        delay = self.latency
+        if self.slow_rate and random.random() < self.slow_rate:
+            delay += self.slow_seconds
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        return False
+
+    def do_POST(self):
+        # today-price is a POST with a payload id; the body is ignored here
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._inject_faults():
+            return
+        path, _, query = self.path.partition('?')
+        if path != '/api/nots/nepse-data/today-price':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'price_volume' in self.fixtures:
+            self._send_body(self.fixtures['price_volume'])
+            return
+        params = dict(pair.partition('=')[::2] for pair in query.split('&') if pair)
+        rows = self.price_rows if self.price_rows is not None else int(params.get('size', 500))
+        business_date = params.get('businessDate', '2024-01-04')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._write_chunk(b'{"content":[')
+        for start in range(0, rows, 1000):
+            rendered = ','.join(json.dumps(_price_volume_row(i, business_date))
+                                for i in range(start, min(rows, start + 1000)))
+            self._write_chunk((',' if start else '').encode() + rendered.encode('utf-8'))
+        self._write_chunk(f'],"totalElements":{rows},"totalPages":1,"number":0}}'.encode())
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        with self.live_lock:
+            self.hits[path] += 1
+        if self._inject_faults():
+            return
+        if path == '/api/nots/lives-market':
+            self._send_body(json.dumps(self._live_market()).encode('utf-8'))
+            return
+        for name, pattern, build in ROUTES:
+            match = pattern.match(path)
+            if match:
+                body = self.fixtures.get(name)
+                self._send_body(body if body is not None else json.dumps(build(match)).encode('utf-8'))
+                return
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _live_market(self, companies=330):
+        # a random walk in which live_change_rate of the securities trade per call
+        with self.live_lock:
+            now = datetime.now().isoformat()
+            for i in range(companies):
+                if i not in self.live:
+                    self.live[i] = (100.0 + (i * 7919) % 4900, 1000.0, now)
+                elif random.random() < self.live_change_rate:
+                    price, volume, _ = self.live[i]
+                    self.live[i] = (round(price * random.uniform(0.98, 1.02), 1), volume + 10, now)
+            return [_live_row(i, *self.live[i]) for i in range(companies)]
+
+    def _send_body(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients hanging up early (hedged requests, cancelled streams) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start(host='127.0.0.1', port=0, latency=0.0, price_rows=None, fixtures=None, faults=None):
+    """
+    Start the fake nepalstock.com.np server in a background thread and
+    return it; server.server_address holds the bound port. `faults` sets
+    error_rate, slow_rate and slow_seconds, which can also be changed on
+    server.RequestHandlerClass while it runs.
+    """
+    handler = type('Handler', (FakeNepseHandler,), {'latency': latency, 'price_rows': price_rows,
+                                                    'fixtures': fixtures or {}, 'live': {},
+                                                    'live_lock': threading.Lock(), 'hits': collections.Counter(),
+                                                    **(faults or {})})
+    server = _Server((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
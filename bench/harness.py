@@ -0,0 +1,114 @@
+"""
+Shared pieces of the benchmarks: in-process servers for the app and a
+concurrent HTTP load driver.
+"""
+import asyncio
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+def serve_wsgi(wsgi_app, threads):
+    """
+    Serve `wsgi_app` from a fixed thread pool (like gunicorn --threads), so
+    slow requests queue behind busy workers. Returns (base_url, stop).
+    """
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        executor = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer('127.0.0.1', 0, wsgi_app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server.shutdown
+
+
+def serve_asgi(asgi_app):
+    """
+    Serve `asgi_app` with uvicorn in a background thread. Returns (base_url, stop).
+    """
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host='127.0.0.1', port=port, log_level='warning',
+                                           lifespan='off'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+    return f'http://127.0.0.1:{port}', stop
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+async def _drive(base_url, path, bodies, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(client, body):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(path, json=body)
+            # streamed endpoints are only done once the whole body is read
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, body) for body in bodies))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(bodies),
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'rps': round(len(bodies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def drive(base_url, path, bodies, concurrency):
+    """
+    POST every JSON body in `bodies` to `path` with at most `concurrency`
+    requests in flight and return throughput and latency percentiles.
+    """
+    return asyncio.run(_drive(base_url, path, bodies, concurrency))
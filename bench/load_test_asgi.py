@@ -0,0 +1,76 @@
+"""
+Concurrent-request throughput of the WSGI app versus the ASGI app.
+
+    python -m bench.load_test_asgi --requests 200 --concurrency 50 --latency 0.5
+
+Both servers run in-process against bench.fake_nepse and a throwaway
+SQLite database. The WSGI server gets a fixed thread pool (like gunicorn
+--threads) so slow upstream calls queue behind busy workers.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from bench import fake_nepse
+from bench.harness import drive, serve_asgi, serve_wsgi
+
+SECRET = 'bench-secret'
+
+
+def _configure(args):
+    upstream_server = fake_nepse.start(latency=args.latency)
+    os.environ['NEPSE_BASE_URL'] = fake_nepse.base_url(upstream_server)
+    os.environ['SECRET_KEY_SCRAPE'] = SECRET
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault('UPSTREAM_MAX_CONNECTIONS', str(args.concurrency))
+    return upstream_server
+
+
+def _seed(app_module, security_ids):
+    import pandas as pd
+    import db
+    frame = pd.DataFrame({'security_id': security_ids, 'symbol': [f'S{i}' for i in security_ids],
+                          'business_date': '2024-01-04'})
+    with db.begin() as conn:
+        frame.to_sql('stock_prices', conn, index=False, if_exists='replace')
+    # the fake upstream does not check authorization; skip the token proof-of-work
+    app_module.token_manager.headers = lambda: {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.5, help='fake upstream latency in seconds')
+    parser.add_argument('--wsgi-threads', type=int, default=8)
+    parser.add_argument('--path', default='/api/v1/financial')
+    args = parser.parse_args(argv)
+
+    _configure(args)
+    import app as app_module
+    import asgi
+
+    security_ids = list(range(100, 150))
+    _seed(app_module, security_ids)
+
+    bodies = [{'secret_key_scrape': SECRET, 'security_id': security_ids[i % len(security_ids)]}
+              for i in range(args.requests)]
+    results = {}
+    for name, serve in (('wsgi', lambda: serve_wsgi(app_module.app, args.wsgi_threads)),
+                        ('asgi', lambda: serve_asgi(asgi.app))):
+        base_url, stop = serve()
+        try:
+            results[name] = drive(base_url, args.path, bodies, args.concurrency)
+        finally:
+            stop()
+
+    print(f"{args.path}: {args.requests} requests, concurrency {args.concurrency}, "
+          f"upstream latency {args.latency}s, {args.wsgi_threads} WSGI threads")
+    for name, result in results.items():
+        print(f"  {name}: {result}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+Benchmark suite: every Flask route and the price/volume write pipeline,
+run against bench.fake_nepse and a throwaway database, compared with a
+stored baseline.
+
+    python -m bench.suite                          # run, compare with bench/baseline.json
+    python -m bench.suite --save-baseline          # record a new baseline
+    python -m bench.suite --only scrape pipeline_5000 --loads 1 16
+    python -m bench.suite --postgres               # throwaway Postgres (needs pgserver)
+    python -m bench.suite --fixtures ARCHIVE_DIR   # serve recorded payloads (see archive.py)
+
+Route scenarios POST `--requests` requests at each concurrency in `--loads`
+to the WSGI app served from `--wsgi-threads` threads. Pipeline scenarios
+stream one day of N price/volume rows through save_price_volume_history_df
+`--repeat` times. Every scenario runs in its own process, so peak RSS is
+per scenario.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import fake_nepse
+from bench.harness import drive, peak_rss_mb, percentile, serve_wsgi
+
+SECRET = 'bench-secret'
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# a trading day has about 330 traded securities
+DAY_ROWS = 330
+SECURITY_IDS = list(range(100, 100 + DAY_ROWS))
+
+ROUTES = {
+    'market_status': ('/api/v1/market_status', lambda i: {}),
+    'financial': ('/api/v1/financial', lambda i: {'security_id': SECURITY_IDS[i % DAY_ROWS]}),
+    'divided': ('/api/v1/divided', lambda i: {'security_id': SECURITY_IDS[i % DAY_ROWS]}),
+    'financial_batch': ('/api/v1/financial/batch', lambda i: {'security_ids': SECURITY_IDS[:20]}),
+    'divided_batch': ('/api/v1/divided/batch', lambda i: {'security_ids': SECURITY_IDS[:20]}),
+    # the job endpoints answer once the job is done, so the whole fetch and write is timed
+    'company_list': ('/api/v1/company-list', lambda i: {'wait': True}),
+    'sector_overview': ('/api/v1/sector-overview', lambda i: {}),
+    'market_summary': ('/api/v1/market-summary', lambda i: {}),
+    'scrape': ('/api/v1/scrape', lambda i: {'wait': True}),
+}
+PIPELINE_ROWS = (DAY_ROWS, 5000, 50000)
+SCENARIOS = list(ROUTES) + [f'pipeline_{rows}' for rows in PIPELINE_ROWS]
+
+# lower is better for these, higher for the rest
+LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'peak_rss_mb')
+COMPARED = ('p50_ms', 'p99_ms', 'rps', 'rows_per_s', 'peak_rss_mb')
+
+
+class NepseStandIn:
+    """
+    The nepse library calls made by app.py, answered by bench.fake_nepse
+    over HTTP instead of nepalstock.com.np (and without the token
+    proof-of-work).
+    """
+
+    def __init__(self, base_url):
+        import httpx
+        self.client = httpx.Client(base_url=base_url, timeout=60)
+
+    def setTLSVerification(self, flag):
+        pass
+
+    def getAuthorizationHeaders(self):
+        return {}
+
+    def getPOSTPayloadIDForFloorSheet(self):
+        return 1
+
+    def _get(self, path):
+        response = self.client.get(path)
+        response.raise_for_status()
+        return response.json()
+
+    def getMarketStatus(self):
+        return self._get('/api/nots/nepse-data/market-open')
+
+    def getSummary(self):
+        return self._get('/api/nots/market-summary/')
+
+    def getSectorScrips(self):
+        sectors = {}
+        for company in self._get('/api/nots/company/list'):
+            sectors.setdefault(company['sectorName'], []).append(company['symbol'])
+        return sectors
+
+    def getLiveMarket(self):
+        return self._get('/api/nots/lives-market')
+
+    def getPriceVolumeHistory(self, business_date):
+        response = self.client.post(f'/api/nots/nepse-data/today-price?size=500&businessDate={business_date}',
+                                    json={'id': 1})
+        response.raise_for_status()
+        return response.json()
+
+
+def _start_app(args, price_rows):
+    fixtures = fake_nepse.load_fixtures(args.fixtures) if args.fixtures else None
+    server = fake_nepse.start(latency=args.latency, price_rows=price_rows, fixtures=fixtures)
+    os.environ['NEPSE_BASE_URL'] = fake_nepse.base_url(server)
+    os.environ['SECRET_KEY_SCRAPE'] = SECRET
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('UPSTREAM_MAX_CONNECTIONS', str(max(args.loads) * 2))
+    # the fake does not need the politeness limit batches apply to nepalstock.com.np
+    os.environ.setdefault('BATCH_HOST_RATE', '10000')
+    import app
+    stand_in = NepseStandIn(fake_nepse.base_url(server))
+    app.nepse = stand_in
+    app.token_manager.nepse = stand_in
+    # benchmark the trading-day code path whatever day it is
+    app._market_closed_message = lambda current_date: None
+    return app
+
+
+def _run_route(args, name):
+    app = _start_app(args, DAY_ROWS)
+    # stock_prices feeds the security master used to validate security ids
+    app.save_price_volume_history_df(app._stream_price_volume_history('2024-01-04'), '2024-01-04')
+    path, body = ROUTES[name]
+    base_url, stop = serve_wsgi(app.app, args.wsgi_threads)
+    results = []
+    try:
+        for load in args.loads:
+            bodies = [{'secret_key_scrape': SECRET, **body(i)} for i in range(args.requests)]
+            result = drive(base_url, path, bodies, load)
+            results.append({'scenario': name, 'load': load, **result})
+    finally:
+        stop()
+    return results
+
+
+def _run_pipeline(args, rows):
+    app = _start_app(args, rows)
+    seconds = []
+    for run in range(args.repeat):
+        # a new business date each run, so every row is an insert
+        date = f'2024-02-{run + 1:02d}'
+        started = time.perf_counter()
+        result = app.save_price_volume_history_df(app._stream_price_volume_history(date), date)
+        seconds.append(time.perf_counter() - started)
+        if not result or result.get('status') != 200:
+            raise RuntimeError(f'pipeline run failed: {result}')
+    seconds.sort()
+    return [{
+        'scenario': f'pipeline_{rows}', 'load': 1, 'requests': args.repeat, 'errors': 0,
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 1), 'p99_ms': round(percentile(seconds, 0.99) * 1000, 1),
+        'rows_per_s': round(rows / percentile(seconds, 0.5)),
+    }]
+
+
+def _child(args):
+    name = args.child
+    if name.startswith('pipeline_'):
+        results = _run_pipeline(args, int(name[len('pipeline_'):]))
+    else:
+        results = _run_route(args, name)
+    rss = round(peak_rss_mb(), 1)
+    for result in results:
+        result['peak_rss_mb'] = rss
+    print(json.dumps(results))
+    return 0
+
+
+def _throwaway_postgres():
+    import pgserver
+    server = pgserver.get_server(tempfile.mkdtemp(), cleanup_mode='delete')
+    return server, server.get_uri()
+
+
+def _database_for(args, scenario, postgres_uri):
+    if args.database_url:
+        return args.database_url
+    if postgres_uri:
+        from sqlalchemy import create_engine, text
+        name = f'bench_{scenario}_{os.getpid()}'
+        engine = create_engine(postgres_uri, isolation_level='AUTOCOMMIT')
+        with engine.connect() as conn:
+            conn.execute(text(f'CREATE DATABASE {name}'))
+        engine.dispose()
+        return postgres_uri.replace('/postgres?', f'/{name}?', 1)
+    return f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+
+def _run_scenario(args, scenario, database_url):
+    command = [sys.executable, '-m', 'bench.suite', '--child', scenario, '--database-url', database_url,
+               '--requests', str(args.requests), '--loads', *map(str, args.loads), '--latency', str(args.latency),
+               '--wsgi-threads', str(args.wsgi_threads), '--repeat', str(args.repeat)]
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'{scenario} failed:\n{completed.stderr[-2000:]}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _key(result):
+    return f"{result['scenario']}@{result['load']}"
+
+
+def _delta(metric, current, baseline):
+    if metric not in current or not baseline.get(metric):
+        return None
+    change = (current[metric] - baseline[metric]) / baseline[metric]
+    # positive means worse
+    return change if metric in LOWER_IS_BETTER else -change
+
+
+def compare(results, baseline, threshold):
+    """
+    Per-result changes against the baseline and the list of regressions.
+    """
+    regressions = []
+    deltas = {}
+    for result in results:
+        previous = baseline.get(_key(result))
+        if previous is None:
+            continue
+        deltas[_key(result)] = {metric: _delta(metric, result, previous) for metric in COMPARED}
+        for metric, change in deltas[_key(result)].items():
+            if change is not None and change > threshold:
+                regressions.append(f"{_key(result)} {metric}: {previous[metric]} -> {result[metric]}")
+    return deltas, regressions
+
+
+def _format_delta(change):
+    # shown as the change in the metric's good direction: +10% is better
+    return '' if change is None else f'{-change * 100:+.0f}%'
+
+
+def report(results, deltas):
+    print(f"{'scenario':<18} {'load':>4} {'p50 ms':>9} {'p99 ms':>9} {'rps':>7} {'rows/s':>9} {'RSS MB':>7}"
+          f" {'p50':>6} {'tput':>6} {'RSS':>6}")
+    for result in results:
+        delta = deltas.get(_key(result), {})
+        throughput = delta.get('rows_per_s') if 'rows_per_s' in result else delta.get('rps')
+        print(f"{result['scenario']:<18} {result['load']:>4} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}"
+              f" {result.get('rps', ''):>7} {result.get('rows_per_s', ''):>9} {result['peak_rss_mb']:>7.1f}"
+              f" {_format_delta(delta.get('p50_ms')):>6} {_format_delta(throughput):>6}"
+              f" {_format_delta(delta.get('peak_rss_mb')):>6}")
+        if result.get('errors'):
+            print(f"  {result['errors']} of {result['requests']} requests failed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, help='scenarios to run, default all')
+    parser.add_argument('--loads', type=int, nargs='+', default=[1, 8, 32], help='concurrency levels')
+    parser.add_argument('--requests', type=int, default=100, help='requests per route and load')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per pipeline scenario')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream latency in seconds')
+    parser.add_argument('--wsgi-threads', type=int, default=8)
+    parser.add_argument('--database-url', help='write here instead of a throwaway database')
+    parser.add_argument('--postgres', action='store_true', help='throwaway Postgres via pgserver instead of SQLite')
+    parser.add_argument('--fixtures', help='response archive whose latest payloads the fake upstream serves')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative change reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return _child(args)
+
+    postgres, postgres_uri = _throwaway_postgres() if args.postgres else (None, None)
+    results = []
+    for scenario in args.only or SCENARIOS:
+        results.extend(_run_scenario(args, scenario, _database_for(args, scenario, postgres_uri)))
+
+    try:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    except FileNotFoundError:
+        baseline = {}
+    deltas, regressions = compare(results, baseline, args.threshold)
+    report(results, deltas)
+
+    if args.save_baseline:
+        merged = {**baseline, **{_key(result): result for result in results}}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                                   'cpus': os.cpu_count(), 'database': 'postgres' if postgres_uri else 'sqlite'},
+                       'results': merged}, f, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"Regressions over {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
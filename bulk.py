@@ -0,0 +1,355 @@
+import io
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from psycopg2 import sql
+from sqlalchemy import MetaData, Table, func, inspect, or_, select, text
+
+import metrics
+import timing
+
+logger = logging.getLogger(__name__)
+
+# rows rendered to CSV at a time while streaming into COPY
+COPY_CHUNK_ROWS = 10000
+
+# natural keys used to make repeated daily writes idempotent
+NATURAL_KEYS = {
+    'stock_prices': ('security_id', 'business_date'),
+    'stock_sector_wise_summary': ('sector_name', 'business_date'),
+    'stock_symbol_sectors': ('symbol',),
+    'stock_securities': ('security_id',),
+    'stock_prices_weekly': ('security_id', 'period_start'),
+    'stock_prices_monthly': ('security_id', 'period_start'),
+    'stock_price_indicators': ('security_id', 'business_date'),
+    'stock_sectors_weekly': ('sector_name', 'period_start'),
+    'stock_sectors_monthly': ('sector_name', 'period_start'),
+    'stock_prices_intraday': ('security_id', 'last_updated_date_time'),
+}
+
+# (engine url, table) pairs whose unique key index has been verified
+_ensured_keys = set()
+# (engine url, table) pairs that are partitioned Postgres tables
+_partitioned = set()
+_ensured_lock = threading.Lock()
+
+rows_loaded = metrics.counter(
+    'bulk_rows_loaded_total',
+    'Rows written by the bulk loader',
+    labelnames=('table', 'loader'),
+)
+load_seconds = metrics.histogram(
+    'bulk_load_seconds',
+    'Time spent in a single bulk load',
+    labelnames=('table', 'loader'),
+)
+
+
+class _CsvStream(io.RawIOBase):
+    """
+    File-like object that renders a DataFrame to CSV one chunk at a time,
+    so COPY never needs the whole frame as a single string.
+    """
+
+    def __init__(self, df, chunk_rows=COPY_CHUNK_ROWS):
+        self._chunks = (
+            df.iloc[start:start + chunk_rows].to_csv(index=False, header=False, na_rep='')
+            for start in range(0, len(df), chunk_rows)
+        )
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk.encode('utf-8')
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _ensure_table(conn, df, table_name):
+    # tables schema.py does not define keep the pandas-inferred layout
+    if not inspect(conn).has_table(table_name):
+        df.head(0).to_sql(name=table_name, con=conn, if_exists='append', index=False)
+
+
+def _ensure_unique_key(conn, table_name, keys):
+    """
+    Make sure `table_name` has a unique index on `keys` so ON CONFLICT can
+    target it. Tables created by earlier to_sql appends may already hold
+    duplicates; those are removed first, keeping the most recent row.
+    """
+    inspector = inspect(conn)
+    if tuple(inspector.get_pk_constraint(table_name)['constrained_columns']) == tuple(keys):
+        return
+    indexes = inspector.get_indexes(table_name)
+    if not any(index['unique'] and tuple(index['column_names']) == tuple(keys) for index in indexes):
+        key_cols = ', '.join(f'"{key}"' for key in keys)
+        if conn.dialect.name == 'postgresql':
+            dedupe = (f'DELETE FROM "{table_name}" WHERE ctid IN ('
+                      f'SELECT ctid FROM (SELECT ctid, row_number() OVER '
+                      f'(PARTITION BY {key_cols} ORDER BY ctid DESC) AS rn FROM "{table_name}") d '
+                      f'WHERE d.rn > 1)')
+        else:
+            dedupe = (f'DELETE FROM "{table_name}" WHERE rowid NOT IN '
+                      f'(SELECT max(rowid) FROM "{table_name}" GROUP BY {key_cols})')
+        removed = conn.execute(text(dedupe)).rowcount
+        if removed:
+            logger.info(f"Removed {removed} duplicate rows from {table_name} before adding its unique key")
+        index_name = f'uq_{table_name}_{"_".join(keys)}'
+        conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({key_cols})'))
+
+
+def _ensure_upsert_target(engine, df, table_name, keys):
+    cache_key = (str(engine.url), table_name)
+    if cache_key in _ensured_keys:
+        return
+    with _ensured_lock:
+        if cache_key in _ensured_keys:
+            return
+        # committed on its own connection so concurrent writers see the key
+        with engine.begin() as conn:
+            _ensure_table(conn, df, table_name)
+            _ensure_unique_key(conn, table_name, keys)
+            if conn.dialect.name == 'postgresql' and conn.execute(
+                    text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+                    {'name': f'"{table_name}"'}).scalar() == 'p':
+                _partitioned.add(cache_key)
+        _ensured_keys.add(cache_key)
+
+
+def _python_records(df):
+    """
+    Rows as dicts of plain Python values for DBAPI drivers that do not
+    accept numpy scalars.
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == 'float32':
+            # go through the shortest float32 repr so 1234.57 stays 1234.57
+            series = pd.to_numeric(series.astype(str), errors='coerce')
+        elif pd.api.types.is_datetime64_any_dtype(series) and (series.dropna().dt.normalize() == series.dropna()).all():
+            series = series.dt.date
+        columns[col] = series.astype(object).where(series.notna(), None)
+    return pd.DataFrame(columns).to_dict('records')
+
+
+class ToSqlLoader:
+    """
+    Portable loader using DataFrame.to_sql. Used for non-Postgres targets.
+    """
+    name = 'to_sql'
+
+    def load(self, conn, df, table_name):
+        df.to_sql(
+            name=table_name,
+            con=conn,
+            if_exists='append',
+            index=False,
+            method='multi',
+            chunksize=1000
+        )
+        return len(df)
+
+    def upsert(self, conn, df, table_name, keys, batch_size=1000):
+        if conn.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        table = Table(table_name, MetaData(), autoload_with=conn)
+        before = conn.execute(select(func.count()).select_from(table)).scalar()
+        values = [col for col in df.columns if col not in keys]
+        records = _python_records(df)
+        written = 0
+        for start in range(0, len(records), batch_size):
+            stmt = insert(table).values(records[start:start + batch_size])
+            if values:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=list(keys),
+                    set_={col: stmt.excluded[col] for col in values},
+                    where=or_(*[table.c[col].is_distinct_from(stmt.excluded[col]) for col in values]),
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=list(keys))
+            written += conn.execute(stmt).rowcount
+        inserted = conn.execute(select(func.count()).select_from(table)).scalar() - before
+        return inserted, written - inserted
+
+
+class CopyLoader:
+    """
+    Streams the frame through COPY FROM STDIN into a temporary staging
+    table, then merges it into the target in one INSERT ... SELECT.
+    """
+    name = 'copy'
+
+    def _merge(self, cursor, table_name, staging_name, columns):
+        cursor.execute(
+            sql.SQL("INSERT INTO {target} ({cols}) SELECT {cols} FROM {staging}").format(
+                target=sql.Identifier(table_name),
+                staging=sql.Identifier(staging_name),
+                cols=columns,
+            )
+        )
+        return cursor.rowcount
+
+    def _existing_keys(self, cursor, table_name, staging_name, keys):
+        # (distinct keys staged, how many of them the target already has)
+        cursor.execute(
+            sql.SQL(
+                "SELECT count(*), count(t.{first}) FROM (SELECT DISTINCT {keys} FROM {staging}) s "
+                "LEFT JOIN {target} t USING ({keys})"
+            ).format(
+                first=sql.Identifier(keys[0]),
+                keys=sql.SQL(', ').join(sql.Identifier(key) for key in keys),
+                staging=sql.Identifier(staging_name),
+                target=sql.Identifier(table_name),
+            )
+        )
+        return cursor.fetchone()
+
+    def _merge_on_conflict(self, cursor, table_name, staging_name, columns, keys, values, partitioned=False):
+        # DISTINCT ON keeps one row per key; ON CONFLICT cannot touch a row twice.
+        # Rows whose values already match are skipped by the WHERE clause and
+        # are not returned, so the returned rows are the inserts and updates.
+        if partitioned:
+            # xmax cannot be returned from a partitioned table, so the new
+            # keys are counted before the merge instead
+            distinct, existing = self._existing_keys(cursor, table_name, staging_name, keys)
+        key_cols = sql.SQL(', ').join(sql.Identifier(key) for key in keys)
+        if values:
+            action = sql.SQL("DO UPDATE SET {assign} WHERE ({current}) IS DISTINCT FROM ({incoming})").format(
+                assign=sql.SQL(', ').join(
+                    sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(col)) for col in values
+                ),
+                current=sql.SQL(', ').join(sql.Identifier(table_name, col) for col in values),
+                incoming=sql.SQL(', ').join(sql.Identifier('excluded', col) for col in values),
+            )
+        else:
+            action = sql.SQL("DO NOTHING")
+        cursor.execute(
+            sql.SQL(
+                "INSERT INTO {target} ({cols}) "
+                "SELECT DISTINCT ON ({keys}) {cols} FROM {staging} ORDER BY {keys} "
+                "ON CONFLICT ({keys}) {action} RETURNING {returned}"
+            ).format(
+                target=sql.Identifier(table_name),
+                staging=sql.Identifier(staging_name),
+                cols=columns,
+                keys=key_cols,
+                action=action,
+                returned=sql.SQL("NULL" if partitioned else "(xmax = 0)"),
+            )
+        )
+        flags = [row[0] for row in cursor.fetchall()]
+        if partitioned:
+            inserted = distinct - existing
+            return inserted, len(flags) - inserted
+        inserted = sum(1 for flag in flags if flag)
+        return inserted, len(flags) - inserted
+
+    def _stage(self, conn, df, table_name):
+        _ensure_table(conn, df, table_name)
+        staging_name = f'_staging_{table_name}'
+        columns = sql.SQL(', ').join(sql.Identifier(col) for col in df.columns)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(
+                sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP").format(
+                    staging=sql.Identifier(staging_name),
+                    target=sql.Identifier(table_name),
+                )
+            )
+            cursor.execute(sql.SQL("TRUNCATE {staging}").format(staging=sql.Identifier(staging_name)))
+            cursor.copy_expert(
+                sql.SQL("COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)").format(
+                    staging=sql.Identifier(staging_name),
+                    cols=columns,
+                ).as_string(cursor),
+                _CsvStream(df),
+            )
+        except Exception:
+            cursor.close()
+            raise
+        return cursor, staging_name, columns
+
+    def load(self, conn, df, table_name):
+        cursor, staging_name, columns = self._stage(conn, df, table_name)
+        try:
+            return self._merge(cursor, table_name, staging_name, columns)
+        finally:
+            cursor.close()
+
+    def upsert(self, conn, df, table_name, keys):
+        cursor, staging_name, columns = self._stage(conn, df, table_name)
+        try:
+            values = [col for col in df.columns if col not in keys]
+            partitioned = (str(conn.engine.url), table_name) in _partitioned
+            return self._merge_on_conflict(cursor, table_name, staging_name, columns, keys, values, partitioned)
+        finally:
+            cursor.close()
+
+
+_LOADERS = {loader.name: loader for loader in (CopyLoader(), ToSqlLoader())}
+
+
+def get_loader(conn):
+    """
+    Pick the loader for `conn`. BULK_LOADER overrides the dialect default.
+    """
+    name = os.getenv('BULK_LOADER')
+    if not name:
+        name = 'copy' if conn.dialect.name == 'postgresql' else 'to_sql'
+    return _LOADERS[name]
+
+
+def load(conn, df, table_name):
+    """
+    Bulk load `df` into `table_name` inside the caller's transaction and
+    return a dict with the row count, elapsed time and rows per second.
+    """
+    loader = get_loader(conn)
+    started = time.perf_counter()
+    rows = loader.load(conn, df, table_name)
+    elapsed = time.perf_counter() - started
+    rows_loaded.inc(rows, table=table_name, loader=loader.name)
+    load_seconds.observe(elapsed, table=table_name, loader=loader.name)
+    timing.add('db_write', elapsed)
+    rows_per_second = rows / elapsed if elapsed > 0 else float(rows)
+    logger.info(f"Loaded {rows} rows into {table_name} via {loader.name} in {elapsed:.3f}s ({rows_per_second:.0f} rows/s)")
+    return {"table": table_name, "loader": loader.name, "rows": rows,
+            "seconds": round(elapsed, 3), "rows_per_second": round(rows_per_second)}
+
+
+def upsert(conn, df, table_name, keys=None):
+    """
+    Idempotently write `df` into `table_name`, keyed on its natural key.
+
+    Existing rows are updated only when a value changed, so re-running the
+    same day is a cheap no-op. Returns inserted/updated/unchanged counts.
+    """
+    keys = tuple(keys or NATURAL_KEYS[table_name])
+    loader = get_loader(conn)
+    started = time.perf_counter()
+    _ensure_upsert_target(conn.engine, df, table_name, keys)
+    inserted, updated = loader.upsert(conn, df, table_name, keys)
+    elapsed = time.perf_counter() - started
+    unchanged = len(df) - inserted - updated
+    rows_loaded.inc(inserted + updated, table=table_name, loader=loader.name)
+    load_seconds.observe(elapsed, table=table_name, loader=loader.name)
+    timing.add('db_write', elapsed)
+    logger.info(f"Upserted {len(df)} rows into {table_name} via {loader.name} in {elapsed:.3f}s: "
+                f"{inserted} inserted, {updated} updated, {unchanged} unchanged")
+    return {"table": table_name, "loader": loader.name, "rows": len(df), "inserted": inserted,
+            "updated": updated, "unchanged": unchanged, "seconds": round(elapsed, 3)}
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import trading_calendar
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# fresh lifetime in seconds while the market is open
+DEFAULT_TTLS = {
+    'market_status': 15,
+    'sector_overview': 30,
+    'market_summary': 60,
+}
+
+cache_requests = metrics.counter(
+    'response_cache_requests_total',
+    'Response cache lookups by result',
+    labelnames=('endpoint', 'result'),
+)
+
+
+class MemoryBackend:
+    """
+    In-process LRU store. Entries are dropped once their stale window ends.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['stale_until'] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """
+    Store for any client speaking the redis-py get/set/delete API, such as
+    redis.Redis or a local stand-in. Eviction is left to the server's
+    maxmemory-policy (allkeys-lru).
+    """
+
+    def __init__(self, client, prefix='scrape:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry):
+        ttl_ms = max(1, int((entry['stale_until'] - time.time()) * 1000))
+        self.client.set(self.prefix + key, json.dumps(entry), px=ttl_ms)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class ResponseCache:
+    """
+    TTL cache for upstream payloads with stale-while-revalidate.
+
+    A fresh entry is returned as is. An expired entry still inside its
+    stale window is returned immediately while one background refresh
+    runs. Missing entries are computed once, with concurrent callers
+    waiting on the same computation.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+        self._background = set()
+
+    def _store(self, key, value, ttl, stale):
+        now = time.time()
+        entry = {'value': value, 'stored_at': now, 'fresh_until': now + ttl, 'stale_until': now + ttl + stale}
+        self.backend.set(key, entry)
+        return entry
+
+    def _compute(self, key, compute, ttl_for):
+        value = compute()
+        ttl = ttl_for(value)
+        self._store(key, value, ttl, ttl)
+        return value
+
+    def _revalidate(self, key, compute, ttl_for):
+        try:
+            self._flight.do(key, lambda: self._compute(key, compute, ttl_for))
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {str(e)}")
+
+    def get_or_compute(self, key, compute, ttl_for):
+        """
+        Return the cached value for `key`, calling `compute()` when needed.
+        `ttl_for(value)` gives the fresh lifetime in seconds for a new value.
+        """
+        entry = self.backend.get(key)
+        now = time.time()
+        if entry is not None and now < entry['fresh_until']:
+            cache_requests.inc(endpoint=key, result='hit')
+            return entry['value']
+        if entry is not None:
+            cache_requests.inc(endpoint=key, result='stale')
+            if not self._flight.in_flight(key):
+                threading.Thread(target=self._revalidate, args=(key, compute, ttl_for), daemon=True).start()
+            return entry['value']
+        cache_requests.inc(endpoint=key, result='miss')
+        return self._flight.do(key, lambda: self._compute(key, compute, ttl_for))
+
+    async def _acompute(self, key, acompute, ttl_for):
+        value = await acompute()
+        # ttl_for may need a (cached) market status lookup, which is blocking
+        ttl = await asyncio.to_thread(ttl_for, value)
+        self._store(key, value, ttl, ttl)
+        return value
+
+    async def _arevalidate(self, key, acompute, ttl_for):
+        try:
+            await self._async_flight.do(key, lambda: self._acompute(key, acompute, ttl_for))
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {str(e)}")
+
+    async def aget_or_compute(self, key, acompute, ttl_for):
+        """
+        Async twin of get_or_compute() for the ASGI app; `acompute` is a
+        coroutine function. Must be called from a single event loop.
+        """
+        entry = self.backend.get(key)
+        now = time.time()
+        if entry is not None and now < entry['fresh_until']:
+            cache_requests.inc(endpoint=key, result='hit')
+            return entry['value']
+        if entry is not None:
+            cache_requests.inc(endpoint=key, result='stale')
+            if not self._async_flight.in_flight(key):
+                task = asyncio.ensure_future(self._arevalidate(key, acompute, ttl_for))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+            return entry['value']
+        cache_requests.inc(endpoint=key, result='miss')
+        return await self._async_flight.do(key, lambda: self._acompute(key, acompute, ttl_for))
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+
+def market_is_open(status):
+    """
+    Interpret a nepse.getMarketStatus() payload.
+    """
+    if not isinstance(status, dict):
+        return True
+    return str(status.get('isOpen', '')).upper() == 'OPEN'
+
+
+def endpoint_ttl(endpoint, market_open):
+    """
+    Fresh lifetime for `endpoint`. While the market is closed nothing
+    changes, so entries live until the next session opens.
+    """
+    ttl = float(os.getenv(f'CACHE_TTL_{endpoint.upper()}', DEFAULT_TTLS.get(endpoint, 30)))
+    if market_open:
+        return ttl
+    return max(ttl, trading_calendar.seconds_until_next_open())
+
+
+def create_backend():
+    name = os.getenv('CACHE_BACKEND', 'memory').lower()
+    if name == 'redis':
+        return RedisBackend.from_url(os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+    return MemoryBackend(int(os.getenv('CACHE_MAX_ENTRIES', 256)))
@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+import metrics
+import timing
+
+logger = logging.getLogger(__name__)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+checkout_wait_seconds = metrics.histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a pooled database connection',
+    labelnames=('engine',),
+)
+connections_opened = metrics.counter(
+    'db_connections_opened_total',
+    'New DBAPI connections opened by the pool',
+    labelnames=('engine',),
+)
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.error(f"{name} must be an integer, using default {default}")
+        return default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _engine_settings():
+    """
+    Build engine settings from the environment.
+
+    DATABASE_POOL_MODE=null (or serverless) disables client side pooling,
+    which is what we want on Vercel where a process may be frozen between
+    invocations. If DATABASE_PGBOUNCER_URL is set it is preferred over
+    DATABASE_URL and pooling is left to pgbouncer.
+    """
+    pgbouncer_url = os.getenv('DATABASE_PGBOUNCER_URL')
+    database_url = pgbouncer_url or os.getenv('DATABASE_URL')
+    mode = os.getenv('DATABASE_POOL_MODE', 'queue').strip().lower()
+    null_pool = bool(pgbouncer_url) or mode in ('null', 'serverless')
+
+    kwargs = {'pool_pre_ping': _env_bool('DATABASE_POOL_PRE_PING', True)}
+    if null_pool:
+        kwargs['poolclass'] = NullPool
+    elif database_url and make_url(database_url).get_backend_name() != 'sqlite':
+        # sqlite (used by the local benchmarks) picks its own pool class
+        kwargs['pool_size'] = _env_int('DATABASE_POOL_SIZE', 5)
+        kwargs['max_overflow'] = _env_int('DATABASE_POOL_MAX_OVERFLOW', 5)
+        kwargs['pool_timeout'] = _env_int('DATABASE_POOL_TIMEOUT', 30)
+        kwargs['pool_recycle'] = _env_int('DATABASE_POOL_RECYCLE', 1800)
+    return database_url, kwargs
+
+
+def get_engine(name='default'):
+    """
+    Return the process wide engine, creating it on first use and applying
+    pending schema migrations to it (unless DATABASE_MIGRATE is off), short
+    of rebuilding existing tables.
+    Returns None when no database URL is configured.
+    """
+    engine = _engines.get(name)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(name)
+        if engine is not None:
+            return engine
+        database_url, kwargs = _engine_settings()
+        if not database_url:
+            logger.error("DATABASE_URL environment variable is not set")
+            return None
+        engine = create_engine(database_url, **kwargs)
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_connection, connection_record):
+            connections_opened.inc(engine=name)
+
+        if _env_bool('DATABASE_MIGRATE', True):
+            import schema
+
+            try:
+                schema.migrate(engine, rebuild=False)
+            except Exception:
+                # not registered, so the next caller tries again
+                engine.dispose()
+                raise
+        _engines[name] = engine
+        logger.info(f"Created database engine '{name}' ({engine.pool.__class__.__name__})")
+        return engine
+
+
+@contextmanager
+def begin(name='default'):
+    """
+    Open a transaction on the shared engine, recording how long the pool
+    checkout took. Commits on success and rolls back on error.
+    """
+    engine = get_engine(name)
+    if engine is None:
+        raise RuntimeError("DATABASE_URL environment variable is not set")
+    started = time.perf_counter()
+    conn = engine.connect()
+    waited = time.perf_counter() - started
+    checkout_wait_seconds.observe(waited, engine=name)
+    timing.add('db_checkout', waited)
+    try:
+        with conn.begin():
+            yield conn
+    finally:
+        conn.close()
+
+
+def pool_stats():
+    """
+    Connection counts for every engine in the registry.
+    """
+    stats = {}
+    for name, engine in list(_engines.items()):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            # NullPool and the sqlite pools do not track checkouts
+            stats[name] = {'pool': pool.__class__.__name__}
+            continue
+        stats[name] = {
+            'pool': pool.__class__.__name__,
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        }
+    return stats
+
+
+def _pool_gauge(field):
+    def read():
+        return {name: stats[field] for name, stats in pool_stats().items() if field in stats}
+    return read
+
+
+for _field in ('size', 'checked_in', 'checked_out', 'overflow'):
+    metrics.gauge(f'db_pool_{_field}', f'Database pool {_field.replace("_", " ")} connections',
+                  _pool_gauge(_field), labelnames=('engine',))
+
+
+def dispose_engines():
+    """
+    Close all pooled connections, e.g. on shutdown or after a fork.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
@@ -0,0 +1,290 @@
+"""
+Extract per-security fundamentals (P/E, EPS, net worth per share, quarter
+and report names) from saved financial report JSON files.
+
+    python fundamentals.py json_data --output fundamentals
+    python fundamentals.py json_data --database
+
+Files are parsed across a process pool. A manifest of file size, mtime and
+content hash is kept with the output, so a re-run only parses and rewrites
+files that changed and drops the rows of files that were deleted.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+
+import bulk
+import db
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+FUNDAMENTALS_TABLE = 'stock_fundamentals'
+FILES_TABLE = 'stock_fundamentals_files'
+MANIFEST_NAME = '_manifest.json'
+
+COLUMNS = ['source_file', 'security_id', 'quarter_name', 'report_name', 'pe_value', 'eps_value',
+           'net_worth_per_share']
+
+# below this many changed files a process pool costs more than it saves
+POOL_MIN_FILES = 8
+
+_SECURITY_ID = re.compile(r'^(\d+)')
+
+
+def _entries(document):
+    # reports are saved as {"data": [...]}, {"<security_id>": [...]} or a bare list
+    if isinstance(document, list):
+        return document
+    if not isinstance(document, dict):
+        return []
+    if 'data' in document:
+        entries = document['data']
+    elif len(document) == 1:
+        entries = next(iter(document.values()))
+    else:
+        return []
+    if isinstance(entries, dict):
+        return [entries]
+    return entries if isinstance(entries, list) else []
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_rows(name, document):
+    """
+    Fundamentals rows from one parsed report file.
+    """
+    match = _SECURITY_ID.match(name)
+    file_security_id = int(match.group(1)) if match else None
+    rows = []
+    for entry in _entries(document):
+        if not isinstance(entry, dict):
+            continue
+        fiscal_report = entry.get('fiscalReport') or {}
+        quarter_master = fiscal_report.get('quarterMaster') or {}
+        report_type = fiscal_report.get('reportTypeMaster') or {}
+        security_id = entry.get('securityId', file_security_id)
+        rows.append({
+            'source_file': name,
+            'security_id': int(security_id) if security_id is not None else None,
+            'quarter_name': quarter_master.get('quarterName'),
+            'report_name': report_type.get('reportName'),
+            'pe_value': _number(fiscal_report.get('peValue')),
+            'eps_value': _number(fiscal_report.get('epsValue')),
+            'net_worth_per_share': _number(fiscal_report.get('netWorthPerShare')),
+        })
+    return rows
+
+
+def _process_file(path, known_sha256):
+    """
+    Worker: hash the file and, unless the content is unchanged, parse it.
+    Returns (sha256, rows or None, error or None).
+    """
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except OSError as e:
+        return None, [], str(e)
+    sha256 = hashlib.sha256(raw).hexdigest()
+    if sha256 == known_sha256:
+        return sha256, None, None
+    try:
+        return sha256, extract_rows(os.path.basename(path), _loads(raw)), None
+    except ValueError as e:
+        return sha256, [], str(e)
+
+
+def _frame(rows):
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df['security_id'] = df['security_id'].astype('Int64')
+    for column in ('pe_value', 'eps_value', 'net_worth_per_share'):
+        df[column] = df[column].astype('float64')
+    return df
+
+
+class ParquetSink:
+    """
+    One Parquet file per source file in `directory` (needs pyarrow), so a
+    changed report rewrites only its own part. Read the whole set back
+    with pd.read_parquet(directory).
+    """
+
+    name = 'parquet'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+    def _part(self, name):
+        return os.path.join(self.directory, os.path.splitext(name)[0] + '.parquet')
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write(self, parsed, removed, manifest, updated):
+        os.makedirs(self.directory, exist_ok=True)
+        for name, rows in parsed.items():
+            _frame(rows).to_parquet(self._part(name), index=False)
+        for name in removed:
+            try:
+                os.remove(self._part(name))
+            except FileNotFoundError:
+                pass
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+
+class TableSink:
+    """
+    Rows in stock_fundamentals, manifest in stock_fundamentals_files. Rows
+    of changed and removed files are replaced in one transaction.
+    """
+
+    name = 'database'
+
+    def load_manifest(self):
+        with db.begin() as conn:
+            if not inspect(conn).has_table(FILES_TABLE):
+                return {}
+            rows = conn.execute(text(f"SELECT source_file, size, mtime_ns, sha256, row_count FROM {FILES_TABLE}"))
+            return {name: {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256, 'rows': row_count}
+                    for name, size, mtime_ns, sha256, row_count in rows}
+
+    @staticmethod
+    def _delete(conn, table, names):
+        if names and inspect(conn).has_table(table):
+            conn.execute(text(f"DELETE FROM {table} WHERE source_file IN :names")
+                         .bindparams(bindparam('names', expanding=True)), {'names': names})
+
+    def write(self, parsed, removed, manifest, updated):
+        with db.begin() as conn:
+            if updated:
+                # first, so that creating the key index is not blocked by our own writes on SQLite
+                files = pd.DataFrame([{'source_file': name, **manifest[name], 'updated_at': datetime.now()}
+                                      for name in updated]).rename(columns={'rows': 'row_count'})
+                bulk.upsert(conn, files, FILES_TABLE, keys=('source_file',))
+            self._delete(conn, FILES_TABLE, removed)
+            self._delete(conn, FUNDAMENTALS_TABLE, sorted(set(parsed) | set(removed)))
+            rows = [row for name in sorted(parsed) for row in parsed[name]]
+            if rows:
+                bulk.load(conn, _frame(rows), FUNDAMENTALS_TABLE)
+
+
+def run(json_dir, sink, workers=None, force=False):
+    """
+    Bring `sink` up to date with the report files in `json_dir`.
+    """
+    started = time.perf_counter()
+    manifest = sink.load_manifest()
+    present = {}
+    for entry in os.scandir(json_dir):
+        if entry.is_file() and entry.name.endswith('.json'):
+            stat = entry.stat()
+            present[entry.name] = (entry.path, stat.st_size, stat.st_mtime_ns)
+
+    candidates = [name for name, (_, size, mtime_ns) in sorted(present.items())
+                  if force or manifest.get(name, {}).get('size') != size
+                  or manifest.get(name, {}).get('mtime_ns') != mtime_ns]
+    removed = sorted(set(manifest) - set(present))
+
+    args = ([present[name][0] for name in candidates],
+            [None if force else manifest.get(name, {}).get('sha256') for name in candidates])
+    if len(candidates) >= POOL_MIN_FILES and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_process_file, *args, chunksize=max(1, len(candidates) // 64)))
+    else:
+        results = list(map(_process_file, *args))
+
+    parsed = {}
+    errors = {}
+    updated = []
+    new_manifest = {name: entry for name, entry in manifest.items() if name in present}
+    for name, (sha256, rows, error) in zip(candidates, results):
+        if error is not None:
+            # keep the previous rows and manifest entry so the next run retries
+            logger.error(f"Error reading {name}: {error}")
+            errors[name] = error
+            continue
+        _, size, mtime_ns = present[name]
+        entry = {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256}
+        if rows is None:
+            # touched but identical: only the manifest entry moves
+            new_manifest[name] = {**new_manifest[name], **entry}
+        else:
+            parsed[name] = rows
+            new_manifest[name] = {**entry, 'rows': len(rows)}
+        updated.append(name)
+
+    sink.write(parsed, removed, new_manifest, updated)
+
+    summary = {
+        "status": 200 if not errors else 207,
+        "files": len(present),
+        "parsed": len(parsed),
+        "unchanged": len(present) - len(parsed) - len(errors),
+        "removed": len(removed),
+        "rows": sum(len(rows) for rows in parsed.values()),
+        "errors": errors,
+        "sink": sink.name,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Fundamentals: {summary['parsed']} of {summary['files']} files parsed, "
+                f"{summary['removed']} removed, {summary['rows']} rows in {summary['seconds']}s")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract fundamentals from saved financial report JSON files')
+    parser.add_argument('json_dir', nargs='?', default='json_data')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--output', default='fundamentals', help='directory of Parquet parts (needs pyarrow)')
+    target.add_argument('--database', action='store_true', help=f'write to the {FUNDAMENTALS_TABLE} table')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, default one per CPU')
+    parser.add_argument('--force', action='store_true', help='ignore the manifest and reparse every file')
+    args = parser.parse_args(argv)
+
+    if args.database and db.get_engine() is None:
+        logger.error("DATABASE_URL environment variable is not set")
+        return 1
+    if not args.database:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.error("--output writes Parquet and needs pyarrow installed (pip install pyarrow), "
+                         "or use --database")
+            return 1
+    sink = TableSink() if args.database else ParquetSink(args.output)
+    summary = run(args.json_dir, sink, workers=args.workers, force=args.force)
+    return 0 if summary['status'] == 200 else 1
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    raise SystemExit(main())
@@ -0,0 +1,242 @@
+"""
+Read path for stock_prices: keyset-paginated pages and streamed exports.
+
+Pages are ordered by (security_id, business_date) and continue from an
+opaque cursor holding the last key served, so every page is an index range
+scan however deep into the history it is. Exports stream the same query
+from a server-side cursor as gzip CSV, Arrow IPC or Parquet (the last two
+need pyarrow), a batch at a time.
+"""
+import base64
+import csv
+import io
+import json
+import logging
+import os
+import zlib
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Date, DateTime, Float, Integer, MetaData, Table, inspect, select, tuple_
+
+import db
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'stock_prices'
+PAGE_SIZE = int(os.getenv('PRICES_PAGE_SIZE', 500))
+MAX_PAGE_SIZE = int(os.getenv('PRICES_MAX_PAGE_SIZE', 5000))
+# rows fetched from the server-side cursor and encoded at a time while exporting
+EXPORT_BATCH_ROWS = int(os.getenv('PRICES_EXPORT_BATCH_ROWS', 10000))
+
+EXPORT_FORMATS = {
+    'csv': ('application/gzip', 'csv.gz'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+_tables = {}
+
+
+class QueryError(ValueError):
+    """
+    A filter, cursor or format the caller has to fix.
+    """
+
+
+def _table(conn):
+    key = str(conn.engine.url)
+    table = _tables.get(key)
+    if table is None:
+        table = Table(TABLE, MetaData(), autoload_with=conn)
+        _tables[key] = table
+    return table
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d')
+    except ValueError:
+        raise QueryError(f"{name} must be a date in YYYY-MM-DD format")
+
+
+def encode_cursor(security_id, business_date):
+    raw = json.dumps([int(security_id), business_date.isoformat()]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        security_id, business_date = json.loads(raw)
+        return int(security_id), datetime.fromisoformat(business_date)
+    except (TypeError, ValueError):
+        raise QueryError("cursor is invalid")
+
+
+def build_query(table, security_id=None, symbol=None, start_date=None, end_date=None, after=None):
+    """
+    SELECT over stock_prices for the filters, in keyset order and starting
+    after the (security_id, business_date) key `after`.
+    """
+    query = select(table).order_by(table.c.security_id, table.c.business_date)
+    if security_id is not None:
+        if type(security_id) is not int:
+            raise QueryError("security_id must be an integer")
+        query = query.where(table.c.security_id == security_id)
+    if symbol is not None:
+        query = query.where(table.c.symbol == str(symbol).upper())
+    if start_date is not None:
+        query = query.where(table.c.business_date >= _parse_date(start_date, 'start_date'))
+    if end_date is not None:
+        query = query.where(table.c.business_date < _parse_date(end_date, 'end_date') + timedelta(days=1))
+    if after is not None:
+        query = query.where(tuple_(table.c.security_id, table.c.business_date) > tuple_(*after))
+    return query
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d') if value == datetime(value.year, value.month, value.day) else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def page(security_id=None, symbol=None, start_date=None, end_date=None, cursor=None, limit=None):
+    """
+    One page of price history as {"data": [...], "next_cursor": ...};
+    next_cursor is None on the last page.
+    """
+    limit = PAGE_SIZE if limit is None else limit
+    if type(limit) is not int or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise QueryError(f"limit must be an integer between 1 and {MAX_PAGE_SIZE}")
+    after = decode_cursor(cursor) if cursor else None
+    with db.begin() as conn:
+        if not inspect(conn).has_table(TABLE):
+            return {"data": [], "next_cursor": None}
+        query = build_query(_table(conn), security_id, symbol, start_date, end_date, after)
+        # one extra row tells whether there is a next page
+        rows = conn.execute(query.limit(limit + 1)).mappings().all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]['security_id'], rows[-1]['business_date']) if more else None
+    return {"data": [{key: _jsonable(value) for key, value in row.items()} for row in rows],
+            "next_cursor": next_cursor}
+
+
+def _batches(security_id, symbol, start_date, end_date):
+    """
+    Yield (columns, list of row tuples) from a server-side cursor.
+    """
+    with db.begin() as conn:
+        if not inspect(conn).has_table(TABLE):
+            return
+        table = _table(conn)
+        query = build_query(table, security_id, symbol, start_date, end_date)
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS).execute(query)
+        columns = list(result.keys())
+        for rows in result.partitions(EXPORT_BATCH_ROWS):
+            yield columns, rows
+
+
+def _csv_chunks(table, batches):
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col.name for col in table.columns])
+    for _, rows in batches:
+        writer.writerows(rows)
+        yield gzip.compress(buffer.getvalue().encode('utf-8'))
+        buffer.seek(0)
+        buffer.truncate()
+    yield gzip.compress(buffer.getvalue().encode('utf-8')) + gzip.flush()
+
+
+class _Drain(io.RawIOBase):
+    """
+    Write-only sink whose contents are handed out and dropped after each batch.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(pa, table):
+    fields = []
+    for col in table.columns:
+        if isinstance(col.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(col.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(col.type, DateTime):
+            arrow_type = pa.timestamp('us')
+        elif isinstance(col.type, Date):
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(col.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _arrow_chunks(table, batches, parquet):
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    schema = _arrow_schema(pa, table)
+    sink = _Drain()
+    writer = pa.parquet.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+    try:
+        for columns, rows in batches:
+            arrays = [pa.array([row[i] for row in rows], type=schema.field(name).type) for i, name in enumerate(columns)]
+            # for Parquet, one row group per batch
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export(fmt, security_id=None, symbol=None, start_date=None, end_date=None):
+    """
+    Validate an export and return (mimetype, file extension, iterator of
+    bytes). Rows are read and encoded EXPORT_BATCH_ROWS at a time, so memory
+    stays flat whatever the range.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise QueryError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if fmt != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise QueryError(f"{fmt} export needs pyarrow installed on the server")
+    with db.begin() as conn:
+        if not inspect(conn).has_table(TABLE):
+            raise QueryError("no price history has been stored yet")
+        table = _table(conn)
+        # surface filter errors before the response starts
+        build_query(table, security_id, symbol, start_date, end_date)
+    batches = _batches(security_id, symbol, start_date, end_date)
+    if fmt == 'csv':
+        chunks = _csv_chunks(table, batches)
+    else:
+        chunks = _arrow_chunks(table, batches, parquet=fmt == 'parquet')
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return mimetype, extension, chunks
@@ -0,0 +1,171 @@
+import codecs
+import json
+import logging
+import os
+import re
+import time
+
+import bulk
+import db
+
+logger = logging.getLogger(__name__)
+
+# records normalized and written per chunk; bounds the dicts and the frame alive at once
+INGEST_CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', 2000))
+
+_WHITESPACE = re.compile(r'\s*')
+# what may follow a top-level number that the next chunk could still extend, e.g. '1.' or '1e-'
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """
+    Text buffer over an iterable of byte chunks. Consumed text is dropped
+    whenever more is read, so the buffer only ever holds the value being
+    parsed plus one chunk.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
+        self.buf = self.buf[self.pos:] + self._utf8.decode(b'', final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON stream, found {found or 'end of input'!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # incomplete value: read more, or give up at the end of the stream
+                if not self.fill():
+                    raise
+                continue
+            # a number near the buffer edge may continue in the next chunk:
+            # '[1.' decodes as 1 until the '5' of '1.5' arrives
+            if type(value) in (int, float) and not self.eof and _NUMBER_TAIL.match(self.buf, end):
+                length = end - self.pos
+                if self.fill():
+                    continue
+                # fill() moved the value to the start of the buffer
+                end = self.pos + length
+            self.pos = end
+            return value
+
+
+def iter_array(chunks, key=None):
+    """
+    Yield the elements of a JSON array one at a time from `chunks`, an
+    iterable of bytes such as httpx's response.iter_bytes().
+
+    With `key`, the array is the value of that top-level object field
+    (e.g. 'content' of a paged NEPSE response); other fields are skipped.
+    Without it the document itself must be an array. Only one element is
+    decoded at a time, so memory does not grow with the payload.
+    """
+    reader = _Reader(chunks)
+    if key is not None:
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            name = reader.value()
+            reader.expect(':')
+            if name == key:
+                break
+            reader.value()
+            separator = reader.peek()
+            reader.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f"Expected ',' or '}}' in JSON stream, found {separator or 'end of input'!r}")
+        if reader.peek() == 'n':
+            # "content": null
+            reader.value()
+            return
+    reader.expect('[')
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.value()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or ']' in JSON stream, found {separator or 'end of input'!r}")
+
+
+def batched(items, size):
+    """
+    Group an iterable into lists of at most `size` items.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_records(records, schema, table, chunk_rows=None, extra=None, on_chunk=None):
+    """
+    Normalize `records` (any iterable of upstream dicts) with `schema` and
+    upsert them into `table`, `chunk_rows` at a time, in one transaction.
+
+    Only one chunk of dicts and its DataFrame are alive at any point, so
+    peak memory is bounded by the chunk size rather than the payload.
+    `on_chunk(df)` is called with every written frame. Returns the summed
+    bulk.upsert() counts; rows is 0 when there was nothing to write.
+    """
+    chunk_rows = chunk_rows or INGEST_CHUNK_ROWS
+    totals = {"table": table, "loader": None, "rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "chunks": 0}
+    started = time.perf_counter()
+    with db.begin() as conn:
+        for chunk in batched(records, chunk_rows):
+            df = schema.normalize(chunk, extra=extra)
+            result = bulk.upsert(conn, df, table)
+            if on_chunk is not None:
+                on_chunk(df)
+            totals['loader'] = result['loader']
+            totals['chunks'] += 1
+            for field in ('rows', 'inserted', 'updated', 'unchanged'):
+                totals[field] += result[field]
+    totals['seconds'] = round(time.perf_counter() - started, 3)
+    if totals['chunks'] > 1:
+        logger.info(f"Ingested {totals['rows']} rows into {table} in {totals['chunks']} chunks "
+                    f"in {totals['seconds']}s")
+    return totals
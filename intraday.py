@@ -0,0 +1,181 @@
+"""
+Intraday live-price polling.
+
+While getMarketStatus reports the market open, the live market is
+snapshotted every INTRADAY_INTERVAL seconds and compared with the previous
+snapshot in memory. Only securities whose price or volume changed are
+upserted into stock_prices_intraday, keyed on (security_id,
+last_updated_date_time), so the table grows with trading activity rather
+than with the poll rate. Run it as a long-lived process next to the web
+app:
+
+    python intraday.py
+    python intraday.py --interval 15 --exit-on-close
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+import bulk
+import cache
+import db
+import metrics
+import resilience
+from normalize import FrameSchema
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'stock_prices_intraday'
+INTERVAL = float(os.getenv('INTRADAY_INTERVAL', 30))
+# how often to check whether the market has opened while it is closed
+CLOSED_INTERVAL = float(os.getenv('INTRADAY_CLOSED_INTERVAL', 300))
+
+live_dtype_spec = {
+    'securityId': 'Int64',
+    'symbol': 'string',
+    'lastUpdatedDateTime': 'string',
+    'lastTradedPrice': 'float64',
+    'lastTradedVolume': 'float64',
+    'totalTradeQuantity': 'float64',
+    'totalTradeValue': 'float64',
+    'openPrice': 'float64',
+    'highPrice': 'float64',
+    'lowPrice': 'float64',
+    'percentageChange': 'float64',
+    'averageTradedPrice': 'float64',
+}
+live_schema = FrameSchema(
+    live_dtype_spec,
+    date_formats={'lastUpdatedDateTime': 'ISO8601'},
+    float32=('lastTradedPrice', 'openPrice', 'highPrice', 'lowPrice', 'percentageChange', 'averageTradedPrice'),
+    categorical=('symbol',),
+)
+
+# a row is written when any of these moved since the previous snapshot; a
+# new last_updated_date_time alone is not a change
+TRACKED = ['last_traded_price', 'last_traded_volume', 'total_trade_quantity', 'total_trade_value',
+           'open_price', 'high_price', 'low_price', 'percentage_change', 'average_traded_price']
+
+polls = metrics.counter(
+    'intraday_polls_total',
+    'Live market snapshots taken by the intraday poller',
+    labelnames=('outcome',),
+)
+rows_seen = metrics.counter(
+    'intraday_rows_polled_total',
+    'Securities in live market snapshots',
+)
+rows_changed = metrics.counter(
+    'intraday_rows_changed_total',
+    'Securities whose price or volume changed between snapshots and were written',
+)
+
+
+def changed_rows(previous, current):
+    """
+    Rows of `current` that are new or differ from `previous` (a frame of
+    TRACKED columns indexed by security_id) in any tracked column.
+    """
+    if previous is None or previous.empty:
+        return current
+    before = previous.reindex(current['security_id'].to_numpy())
+    changed = pd.Series(False, index=current.index)
+    for col in TRACKED:
+        now, then = current[col].reset_index(drop=True), before[col].reset_index(drop=True)
+        same = now.eq(then) | (now.isna() & then.isna())
+        changed |= ~same.to_numpy()
+    return current[changed]
+
+
+class IntradayPoller:
+    """
+    Snapshots `nepse.getLiveMarket()` and writes the securities that
+    changed since the previous snapshot.
+    """
+
+    def __init__(self, nepse, interval=None):
+        self.nepse = nepse
+        self.interval = INTERVAL if interval is None else interval
+        self._previous = None
+
+    def reset(self):
+        # the next snapshot is written in full, e.g. on the first poll of a day
+        self._previous = None
+
+    def market_open(self):
+        try:
+            return cache.market_is_open(resilience.call(self.nepse.getMarketStatus))
+        except Exception as e:
+            logger.error(f"Could not determine market status, assuming open: {str(e)}")
+            return True
+
+    def poll(self):
+        """
+        Take one snapshot and write its changed rows. Returns the number of
+        securities seen and written.
+        """
+        records = resilience.call(self.nepse.getLiveMarket)
+        df = live_schema.normalize(records or [])
+        df = df.dropna(subset=['security_id', 'last_updated_date_time']).drop_duplicates('security_id', keep='last')
+        changed = changed_rows(self._previous, df)
+        result = {"rows": len(df), "changed": len(changed)}
+        if not changed.empty:
+            with db.begin() as conn:
+                written = bulk.upsert(conn, changed, TABLE)
+            result.update(inserted=written['inserted'], updated=written['updated'])
+        # only advanced once the write went through, so failed rows are retried
+        self._previous = df.set_index('security_id')[TRACKED]
+        rows_seen.inc(len(df))
+        rows_changed.inc(len(changed))
+        return result
+
+    def run(self, stop=None, exit_on_close=False):
+        """
+        Poll every `interval` seconds while the market is open until `stop`
+        (a threading.Event) is set, or the market closes if `exit_on_close`.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            started = time.monotonic()
+            if not self.market_open():
+                self.reset()
+                if exit_on_close:
+                    logger.info("Market is closed, intraday polling stopped")
+                    return
+                stop.wait(CLOSED_INTERVAL)
+                continue
+            try:
+                result = self.poll()
+                polls.inc(outcome='ok')
+                logger.info(f"Intraday snapshot: {result['changed']} of {result['rows']} securities changed")
+            except Exception as e:
+                polls.inc(outcome='error')
+                logger.error(f"Intraday poll failed: {str(e)}")
+            # a fixed schedule, whatever the poll took
+            stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Poll NEPSE live prices while the market is open')
+    parser.add_argument('--interval', type=float, default=INTERVAL, help='seconds between snapshots')
+    parser.add_argument('--exit-on-close', action='store_true', help='stop once the market is closed')
+    args = parser.parse_args(argv)
+
+    if db.get_engine() is None:
+        return 1
+    from app import nepse
+
+    if not hasattr(nepse, 'getLiveMarket'):
+        logger.error("The installed nepse library has no getLiveMarket")
+        return 1
+    IntradayPoller(nepse, args.interval).run(exit_on_close=args.exit_on_close)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    raise SystemExit(main())
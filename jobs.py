@@ -0,0 +1,302 @@
+"""
+Background jobs for the scrape endpoints.
+
+POST /api/v1/scrape, /api/v1/sector-summary and /api/v1/company-list hand
+their fetch, normalize and write to a worker pool and answer with a job id
+at once. Jobs are recorded in the scrape_jobs table, created by schema.py,
+so any process can report on them. Each job has a dedupe key, the endpoint
+plus the business date. While a job with that key is queued or running, a
+new submission gets the existing job back rather than starting a second
+write of the same day. A unique index over active jobs enforces this across
+processes. A process refreshes updated_at of the jobs it owns every
+JOB_STALE_AFTER / 3 seconds, so only jobs whose process is gone are
+expired as stale.
+
+With JOB_WORKERS=0 (the default on Vercel, where a process is frozen once
+it has answered) a job runs inside the request before the response is
+sent. It is still recorded.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import db
+import metrics
+import timing
+
+logger = logging.getLogger(__name__)
+
+JOBS_TABLE = 'scrape_jobs'
+WORKERS = int(os.getenv('JOB_WORKERS', 0 if os.getenv('VERCEL') else 2))
+# an active job not heard from for this many seconds is taken to be lost with its process
+STALE_AFTER = float(os.getenv('JOB_STALE_AFTER', 900))
+# longest a "wait": true request waits for its job, within the request's upstream deadline
+WAIT_TIMEOUT = float(os.getenv('JOB_WAIT_TIMEOUT', 60))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+ACTIVE = (QUEUED, RUNNING)
+
+job_seconds = metrics.histogram(
+    'job_duration_seconds',
+    'Run time of background jobs by kind and outcome',
+    labelnames=('kind', 'status'),
+)
+deduplicated = metrics.counter(
+    'jobs_deduplicated_total',
+    'Job submissions answered with an already active job',
+    labelnames=('kind',),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_heartbeat = None
+_ensured = set()
+# job id -> Event set when a job running in this process has finished
+_finished = {}
+
+_COLUMNS = ('id', 'kind', 'dedupe_key', 'business_date', 'status', 'row_count', 'result', 'error', 'stages',
+            'queued_at', 'started_at', 'finished_at', 'updated_at')
+
+
+def _ensure():
+    # the table is created by schema.py (migration 5); checked once per database
+    engine = db.get_engine()
+    if engine is None:
+        raise RuntimeError("DATABASE_URL environment variable is not set")
+    cache_key = str(engine.url)
+    if cache_key in _ensured:
+        return
+    with db.begin() as conn:
+        if not inspect(conn).has_table(JOBS_TABLE):
+            raise RuntimeError(f"{JOBS_TABLE} does not exist yet, run `python schema.py`")
+    _ensured.add(cache_key)
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='job')
+    return _executor
+
+
+def _beat():
+    interval = max(STALE_AFTER / 3, 1.0)
+    while True:
+        time.sleep(interval)
+        owned = list(_finished)
+        if not owned:
+            continue
+        try:
+            with db.begin() as conn:
+                conn.execute(text(
+                    f"UPDATE {JOBS_TABLE} SET updated_at = :now "
+                    "WHERE id IN :ids AND status IN ('queued', 'running')"
+                ).bindparams(bindparam('ids', expanding=True)), {'now': datetime.now(), 'ids': owned})
+        except Exception as e:
+            logger.error(f"Could not refresh the heartbeat of {len(owned)} jobs: {str(e)}")
+
+
+def _start_heartbeat():
+    # one thread per process keeps every job it owns, queued or running, from going stale
+    global _heartbeat
+    if _heartbeat is None:
+        with _executor_lock:
+            if _heartbeat is None:
+                _heartbeat = threading.Thread(target=_beat, name='job-heartbeat', daemon=True)
+                _heartbeat.start()
+
+
+def _update(job_id, **fields):
+    fields['updated_at'] = datetime.now()
+    assignments = ', '.join(f'{name} = :{name}' for name in fields)
+    with db.begin() as conn:
+        conn.execute(text(f"UPDATE {JOBS_TABLE} SET {assignments} WHERE id = :id"), {**fields, 'id': job_id})
+
+
+def _expire_stale(conn):
+    cutoff = datetime.now() - timedelta(seconds=STALE_AFTER)
+    expired = conn.execute(text(
+        f"UPDATE {JOBS_TABLE} SET status = :failed, error = :error, finished_at = :now, updated_at = :now "
+        "WHERE status IN ('queued', 'running') AND updated_at < :cutoff"
+    ), {'failed': FAILED, 'error': 'abandoned: no heartbeat within JOB_STALE_AFTER', 'now': datetime.now(),
+        'cutoff': cutoff}).rowcount
+    if expired:
+        logger.warning(f"Marked {expired} stale jobs as failed")
+
+
+def _active(conn, dedupe_key):
+    row = conn.execute(text(
+        f"SELECT {', '.join(_COLUMNS)} FROM {JOBS_TABLE} "
+        "WHERE dedupe_key = :dedupe_key AND status IN ('queued', 'running')"
+    ), {'dedupe_key': dedupe_key}).mappings().first()
+    return _describe(row) if row is not None else None
+
+
+def submit(kind, business_date, fn):
+    """
+    Queue `fn()` as a `kind` job for `business_date` unless one is already
+    active for the same day. Returns (job, created); `job` is the
+    description get() returns.
+    """
+    dedupe_key = f'{kind}:{business_date}'
+    now = datetime.now()
+    job_id = uuid.uuid4().hex
+    _ensure()
+    with db.begin() as conn:
+        _expire_stale(conn)
+        existing = _active(conn, dedupe_key)
+    if existing is not None:
+        deduplicated.inc(kind=kind)
+        logger.info(f"Job {dedupe_key} is already {existing['status']} as {existing['id']}")
+        return existing, False
+    try:
+        with db.begin() as conn:
+            conn.execute(text(
+                f"INSERT INTO {JOBS_TABLE} (id, kind, dedupe_key, business_date, status, queued_at, updated_at) "
+                "VALUES (:id, :kind, :dedupe_key, :business_date, :status, :now, :now)"
+            ), {'id': job_id, 'kind': kind, 'dedupe_key': dedupe_key, 'business_date': business_date,
+                'status': QUEUED, 'now': now})
+    except IntegrityError:
+        # another process queued the same key between our check and insert
+        with db.begin() as conn:
+            existing = _active(conn, dedupe_key)
+        if existing is None:
+            raise
+        deduplicated.inc(kind=kind)
+        return existing, False
+    logger.info(f"Queued job {job_id} ({dedupe_key})")
+    _finished[job_id] = threading.Event()
+    _start_heartbeat()
+    if WORKERS > 0:
+        _pool().submit(_run, job_id, kind, fn)
+    else:
+        # a context of its own, so the job's spans stay out of the request's
+        contextvars.copy_context().run(_run, job_id, kind, fn)
+    return get(job_id), True
+
+
+def _outcome(result):
+    # the endpoints report failures as {"status": <http code>, ...}
+    code = result.get('status') if isinstance(result, dict) else None
+    if isinstance(code, int) and code >= 400:
+        return FAILED, result.get('error') or result.get('message')
+    return SUCCEEDED, None
+
+
+def _row_count(result):
+    if not isinstance(result, dict):
+        return None
+    for source in (result, result.get('response')):
+        if isinstance(source, dict) and isinstance(source.get('rows'), int):
+            return source['rows']
+    return None
+
+
+def _run(job_id, kind, fn):
+    started = time.perf_counter()
+    spans = timing.begin_request()
+    status, result, error = FAILED, None, None
+    try:
+        _update(job_id, status=RUNNING, started_at=datetime.now())
+        result = fn()
+        status, error = _outcome(result)
+    except Exception as e:
+        logger.error(f"Job {job_id} ({kind}) failed: {str(e)}")
+        error = str(e)
+    finally:
+        timing.end_request()
+        elapsed = time.perf_counter() - started
+        job_seconds.observe(elapsed, kind=kind, status=status)
+        stages = {}
+        for stage, seconds in spans:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        try:
+            _update(job_id, status=status, finished_at=datetime.now(), row_count=_row_count(result),
+                    result=json.dumps(result, default=str), error=error[:1000] if error else None,
+                    stages=json.dumps({stage: round(seconds, 4) for stage, seconds in stages.items()}))
+        except Exception as e:
+            logger.error(f"Could not record the outcome of job {job_id}: {str(e)}")
+        _finished.pop(job_id).set()
+    logger.info(f"Job {job_id} ({kind}) {status} in {elapsed:.2f}s")
+
+
+def _seconds(start, end):
+    if start is None or end is None:
+        return None
+    if isinstance(start, str):
+        start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+    return round((end - start).total_seconds(), 3)
+
+
+def _describe(row):
+    return {
+        "id": row['id'],
+        "kind": row['kind'],
+        "business_date": row['business_date'],
+        "status": row['status'],
+        "rows": row['row_count'],
+        "queued_at": str(row['queued_at']),
+        "started_at": str(row['started_at']) if row['started_at'] is not None else None,
+        "finished_at": str(row['finished_at']) if row['finished_at'] is not None else None,
+        "queue_seconds": _seconds(row['queued_at'], row['started_at']),
+        "run_seconds": _seconds(row['started_at'], row['finished_at']),
+        "stages": json.loads(row['stages']) if row['stages'] else {},
+        "result": json.loads(row['result']) if row['result'] else None,
+        "error": row['error'],
+    }
+
+
+def get(job_id):
+    """
+    A job's status, timings and row count, or None if there is no such job.
+    """
+    _ensure()
+    with db.begin() as conn:
+        row = conn.execute(text(f"SELECT {', '.join(_COLUMNS)} FROM {JOBS_TABLE} WHERE id = :id"),
+                           {'id': job_id}).mappings().first()
+    return _describe(row) if row is not None else None
+
+
+def recent(kind=None, limit=50):
+    """
+    The latest jobs, newest first, optionally of one kind.
+    """
+    query = f"SELECT {', '.join(_COLUMNS)} FROM {JOBS_TABLE}"
+    params = {'limit': limit}
+    if kind is not None:
+        query += " WHERE kind = :kind"
+        params['kind'] = kind
+    _ensure()
+    with db.begin() as conn:
+        rows = conn.execute(text(query + " ORDER BY queued_at DESC LIMIT :limit"), params).mappings().all()
+    return [_describe(row) for row in rows]
+
+
+def wait(job_id, timeout=None, interval=0.2):
+    """
+    Wait until the job has finished or `timeout` seconds passed, then
+    return its description. Jobs running in another process are polled.
+    """
+    finished = _finished.get(job_id)
+    if finished is not None:
+        finished.wait(timeout)
+        return get(job_id)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = get(job_id)
+        if job is None or job['status'] not in ACTIVE:
+            return job
+        if deadline is not None and time.monotonic() >= deadline:
+            return job
+        time.sleep(interval)
@@ -0,0 +1,25 @@
+import threading
+
+
+class Lazy:
+    """
+    Stands in for the object `factory()` returns, calling it on first
+    attribute access. For clients whose import or construction would
+    otherwise be paid by every cold start, e.g. the nepse client and rollbar.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        # only reached for names the proxy itself does not have
+        return getattr(self._resolve(), name)
@@ -0,0 +1,381 @@
+"""
+Retries, circuit breakers, deadlines and hedging for upstream calls.
+
+Every upstream call belongs to an endpoint: the URL path with numeric
+segments folded to {id}, or nepse.<method> for calls into the nepse
+library. Each endpoint has a circuit breaker: after BREAKER_FAILURES
+consecutive failures (transport errors and 5xx) its calls fail fast with
+CircuitOpen for BREAKER_RESET seconds, then a single trial call decides
+whether it closes again.
+
+Transient failures of idempotent calls are retried up to UPSTREAM_RETRIES
+times with full-jitter exponential backoff. A request's deadline bounds
+all of it: attempt timeouts are cut to the time left and no retry starts
+that could not finish in time.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.error(f"{name} must be a number, using default {default}")
+        return default
+
+
+RETRIES = int(_env_float('UPSTREAM_RETRIES', 2))
+BACKOFF_BASE = _env_float('UPSTREAM_BACKOFF_BASE', 0.25)
+BACKOFF_MAX = _env_float('UPSTREAM_BACKOFF_MAX', 4.0)
+# upstream time budget of one incoming request; 0 disables
+REQUEST_DEADLINE = _env_float('UPSTREAM_REQUEST_DEADLINE', 60.0)
+BREAKER_FAILURES = int(_env_float('BREAKER_FAILURES', 5))
+BREAKER_RESET = _env_float('BREAKER_RESET', 30.0)
+# send a second price/volume request if the first has not answered after this many seconds; 0 disables
+HEDGE_AFTER = _env_float('UPSTREAM_HEDGE_AFTER', 0.0)
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+retries = metrics.counter(
+    'upstream_retries_total',
+    'Upstream attempts retried after a transient failure',
+    labelnames=('endpoint',),
+)
+rejections = metrics.counter(
+    'upstream_circuit_rejections_total',
+    'Upstream calls failed fast by an open circuit breaker',
+    labelnames=('endpoint',),
+)
+hedges = metrics.counter(
+    'upstream_hedges_total',
+    'Hedged second requests sent for slow upstream calls',
+    labelnames=('endpoint',),
+)
+
+# monotonic time by which the current request's upstream work must be done
+_deadline = ContextVar('upstream_deadline', default=None)
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+_hedge_pool = ThreadPoolExecutor(max_workers=int(_env_float('UPSTREAM_HEDGE_WORKERS', 8)),
+                                 thread_name_prefix='upstream-hedge')
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"Upstream {endpoint} is unavailable, retry in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a request's upstream time budget ran out before a call.
+    """
+
+
+class _ServerError(httpx.HTTPStatusError):
+    """
+    A 5xx raised by the nepse library, re-raised by call() so that it is
+    retried like a transport error.
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker. Open for `reset_after` seconds once
+    `failures` calls in a row failed; then one half-open trial call closes
+    it on success or reopens it on failure.
+    """
+
+    def __init__(self, endpoint, failures=None, reset_after=None):
+        self.endpoint = endpoint
+        self.failures = failures if failures is not None else BREAKER_FAILURES
+        self.reset_after = reset_after if reset_after is not None else BREAKER_RESET
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if a call may go ahead, or raise CircuitOpen.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            waited = time.monotonic() - self._opened_at
+            if self.state == OPEN and waited >= self.reset_after:
+                self.state = HALF_OPEN
+                self._trial = False
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+        rejections.inc(endpoint=self.endpoint)
+        raise CircuitOpen(self.endpoint, max(0.0, self.reset_after - waited))
+
+    def abandon(self):
+        # the call ended without telling us anything about upstream health
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial = False
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit for {self.endpoint} closed")
+            self.state = CLOSED
+            self._consecutive = 0
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive >= self.failures):
+                logger.warning(f"Circuit for {self.endpoint} opened after {self._consecutive} failures")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+
+def breaker(endpoint):
+    circuit = _breakers.get(endpoint)
+    if circuit is None:
+        with _breakers_lock:
+            circuit = _breakers.setdefault(endpoint, CircuitBreaker(endpoint))
+    return circuit
+
+
+def breaker_states():
+    return {endpoint: circuit.state for endpoint, circuit in list(_breakers.items())}
+
+
+metrics.gauge('upstream_circuit_state', 'Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open)',
+              breaker_states, labelnames=('endpoint',))
+
+
+def endpoint_key(url):
+    return _ID_SEGMENT.sub('/{id}', urlsplit(str(url)).path) or '/'
+
+
+def begin_request(seconds=None):
+    """
+    Start the upstream time budget of the request being served.
+    """
+    seconds = REQUEST_DEADLINE if seconds is None else seconds
+    _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+
+
+def end_request():
+    _deadline.set(None)
+
+
+def current():
+    return _deadline.get()
+
+
+def remaining():
+    """
+    Seconds left in the current deadline, or None when there is none.
+    """
+    limit = _deadline.get()
+    return None if limit is None else limit - time.monotonic()
+
+
+async def carry(coro, limit):
+    """
+    Await `coro` under the caller's deadline, e.g. on the upstream loop.
+    """
+    _deadline.set(limit)
+    return await coro
+
+
+def _backoff(attempt, response=None):
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if response is not None:
+        try:
+            delay = max(delay, min(BACKOFF_MAX, float(response.headers.get('Retry-After', 0))))
+        except ValueError:
+            pass
+    return delay
+
+
+def _check(result):
+    """
+    (retryable, counts as a failure) for a call's result.
+    """
+    if isinstance(result, httpx.Response):
+        return result.status_code in RETRY_STATUSES, result.status_code >= 500
+    return False, False
+
+
+def _plan_retry(endpoint, attempt, retry, response=None):
+    # the delay before the next attempt, or None when there is none
+    if not retry or attempt >= RETRIES:
+        return None
+    delay = _backoff(attempt, response)
+    left = remaining()
+    if left is not None and left <= delay:
+        return None
+    retries.inc(endpoint=endpoint)
+    return delay
+
+
+def _time_left(endpoint):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"No time left for upstream {endpoint}")
+    return left
+
+
+def execute(endpoint, attempt, retry=True, transient=(httpx.TransportError,), discard=None):
+    """
+    Run `attempt(time_left)` under the endpoint's breaker, retrying
+    transient errors and retryable statuses. `time_left` is the remaining
+    deadline in seconds or None. `discard(response)` releases a response
+    that is dropped for a retry.
+    """
+    circuit = breaker(endpoint)
+    for number in range(RETRIES + 1):
+        time_left = _time_left(endpoint)
+        circuit.allow()
+        try:
+            result = attempt(time_left)
+        except transient as e:
+            circuit.failure()
+            delay = _plan_retry(endpoint, number, retry)
+            if delay is None:
+                raise
+            logger.warning(f"Upstream {endpoint} failed ({e.__class__.__name__}: {e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        except BaseException:
+            circuit.abandon()
+            raise
+        retryable, failed = _check(result)
+        if failed:
+            circuit.failure()
+        else:
+            circuit.success()
+        delay = _plan_retry(endpoint, number, retry and retryable, result)
+        if delay is None:
+            return result
+        logger.warning(f"Upstream {endpoint} returned {result.status_code}, retrying in {delay:.2f}s")
+        if discard is not None:
+            discard(result)
+        time.sleep(delay)
+
+
+async def aexecute(endpoint, attempt, retry=True, transient=(httpx.TransportError,)):
+    """
+    Async twin of execute(); `attempt(time_left)` returns an awaitable.
+    """
+    circuit = breaker(endpoint)
+    for number in range(RETRIES + 1):
+        time_left = _time_left(endpoint)
+        circuit.allow()
+        try:
+            result = await attempt(time_left)
+        except transient as e:
+            circuit.failure()
+            delay = _plan_retry(endpoint, number, retry)
+            if delay is None:
+                raise
+            logger.warning(f"Upstream {endpoint} failed ({e.__class__.__name__}: {e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            circuit.abandon()
+            raise
+        retryable, failed = _check(result)
+        if failed:
+            circuit.failure()
+        else:
+            circuit.success()
+        delay = _plan_retry(endpoint, number, retry and retryable, result)
+        if delay is None:
+            return result
+        logger.warning(f"Upstream {endpoint} returned {result.status_code}, retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+def call(fn, *args, retry=True, hedge_after=None):
+    """
+    Call a nepse library method with its endpoint's breaker and retries,
+    hedged after `hedge_after` seconds if given. Only transport errors,
+    timeouts and 5xx responses are retried; anything else, e.g. a 4xx or
+    a parsing error, is raised at once. The library has its own timeouts,
+    so the deadline only bounds retries.
+    """
+    endpoint = f'nepse.{fn.__name__}'
+
+    def attempt(time_left):
+        try:
+            if hedge_after:
+                return hedge(endpoint, lambda: fn(*args), hedge_after)
+            return fn(*args)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500 and not isinstance(e, _ServerError):
+                raise _ServerError(str(e), request=e.request, response=e.response) from e
+            raise
+
+    return execute(endpoint, attempt, retry=retry, transient=(httpx.TransportError, _ServerError))
+
+
+def hedge(endpoint, fn, after, discard=None):
+    """
+    Call `fn()`; if it has not returned after `after` seconds, call it a
+    second time in parallel and return whichever succeeds first. The
+    loser's result is passed to `discard` once it arrives.
+    """
+    first = _hedge_pool.submit(contextvars.copy_context().run, fn)
+    done, _ = wait([first], timeout=after)
+    if done:
+        return first.result()
+    hedges.inc(endpoint=endpoint)
+    logger.info(f"Upstream {endpoint} slower than {after}s, sending a hedged request")
+    pending = {first, _hedge_pool.submit(contextvars.copy_context().run, fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.add_done_callback(lambda f: _discard(f, discard))
+                for other in done - {future}:
+                    _discard(other, discard)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _discard(future, discard):
+    if discard is not None and future.exception() is None:
+        discard(future.result())
@@ -0,0 +1,401 @@
+"""
+Rollups maintained from stock_prices and stock_sector_wise_summary.
+
+    stock_prices_weekly, stock_prices_monthly     OHLCV, turnover and change per security and period
+    stock_price_indicators                        moving averages and 52-week high/low per security and day
+    stock_sectors_weekly, stock_sectors_monthly   turnover, volume, trades and turnover share per sector
+
+Weeks start on Sunday, the first NEPSE trading day. After every ingest only
+the periods containing the ingested dates are recomputed, plus, for
+indicators, the later stored days whose windows include them. Price
+rollups are aggregated by the database with INSERT ... SELECT, so no price
+history is read into the process. Build the tables from existing history
+once with
+
+    python rollups.py rebuild
+    python rollups.py rebuild --start 2024-01-01 --end 2024-03-31
+"""
+import argparse
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pandas as pd
+from sqlalchemy import Date, MetaData, Table, bindparam, func, inspect, select, text
+
+import bulk
+import db
+import timing
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS = os.getenv('ROLLUPS', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+
+# moving average windows, in trading sessions
+MOVING_AVERAGES = (5, 20, 50, 200)
+# history an indicator may look at: 52 weeks, and comfortably 200 sessions
+LOOKBACK = pd.Timedelta(days=400)
+# days after a price whose 52-week window includes it; covers 200 sessions too
+WINDOW_REACH = pd.Timedelta(days=365)
+
+CANDLE_COLUMNS = ['security_id', 'period_start', 'symbol', 'first_date', 'last_date', 'trading_days', 'open_price',
+                  'high_price', 'low_price', 'close_price', 'previous_close', 'total_traded_quantity',
+                  'total_traded_value', 'total_trades', 'change_pct']
+INDICATOR_COLUMNS = (['security_id', 'business_date', 'symbol', 'close_price']
+                     + [f'sma_{window}' for window in MOVING_AVERAGES] + ['high_52_week', 'low_52_week'])
+SECTOR_COLUMNS = ['sector_name', 'business_date', 'total_transaction', 'turn_over_values', 'turn_over_volume']
+
+
+def _week_start(dates):
+    # weekday() is 6 on Sunday
+    return (dates - pd.to_timedelta((dates.dt.weekday + 1) % 7, unit='D')).dt.normalize()
+
+
+def _month_start(dates):
+    return dates.dt.to_period('M').dt.start_time
+
+
+PERIODS = {'weekly': _week_start, 'monthly': _month_start}
+
+# {'prices': set(), 'sectors': set()} of dates waiting for the end of the
+# caller's deferred(); threads it starts see it only if they run in a copy
+# of its context
+_deferred = ContextVar('rollups_deferred', default=None)
+_deferred_lock = threading.Lock()
+
+
+def _dates(dates):
+    return sorted({pd.Timestamp(str(day)[:10]) for day in dates if day is not None})
+
+
+def _read(conn, table_name, columns, start, end):
+    """
+    `columns` of `table_name` for business dates in [start, end).
+    """
+    if not inspect(conn).has_table(table_name):
+        return pd.DataFrame(columns=columns)
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    query = select(*[table.c[col] for col in columns]).where(
+        table.c.business_date >= start.to_pydatetime(), table.c.business_date < end.to_pydatetime())
+    df = pd.read_sql(query, conn)
+    df['business_date'] = pd.to_datetime(df['business_date']).dt.normalize()
+    return df
+
+
+def _touched(df, period, dates):
+    # rows in the periods that contain any of `dates`
+    starts = PERIODS[period](df['business_date'])
+    touched = set(PERIODS[period](pd.Series(dates)))
+    return df.assign(period_start=starts)[starts.isin(touched)]
+
+
+# OHLCV per security over the stock_prices rows in [start, end); open, close,
+# symbol and previous close are the first or last non-null value, as pandas'
+# first()/last()
+CANDLES_QUERY = """
+SELECT security_id, period_start, symbol, first_date, last_date, trading_days, open_price, high_price, low_price,
+       close_price, previous_close, total_traded_quantity, total_traded_value, total_trades,
+       CASE WHEN previous_close > 0 THEN (close_price / previous_close - 1) * 100 END AS change_pct
+FROM (
+    SELECT security_id, :period_start AS period_start,
+           MAX(CASE WHEN symbol_row = 1 THEN symbol END) AS symbol,
+           MIN(business_date) AS first_date,
+           MAX(business_date) AS last_date,
+           COUNT(*) AS trading_days,
+           MAX(CASE WHEN open_row = 1 THEN open_price END) AS open_price,
+           MAX(high_price) AS high_price,
+           MIN(low_price) AS low_price,
+           MAX(CASE WHEN close_row = 1 THEN close_price END) AS close_price,
+           MAX(CASE WHEN previous_row = 1 THEN previous_day_close_price END) AS previous_close,
+           SUM(total_traded_quantity) AS total_traded_quantity,
+           SUM(total_traded_value) AS total_traded_value,
+           SUM(total_trades) AS total_trades
+    FROM (
+        SELECT security_id, business_date, symbol, open_price, high_price, low_price, close_price,
+               previous_day_close_price, total_traded_quantity, total_traded_value, total_trades,
+               ROW_NUMBER() OVER (PARTITION BY security_id
+                                  ORDER BY symbol IS NULL, business_date DESC) AS symbol_row,
+               ROW_NUMBER() OVER (PARTITION BY security_id
+                                  ORDER BY open_price IS NULL, business_date) AS open_row,
+               ROW_NUMBER() OVER (PARTITION BY security_id
+                                  ORDER BY close_price IS NULL, business_date DESC) AS close_row,
+               ROW_NUMBER() OVER (PARTITION BY security_id
+                                  ORDER BY previous_day_close_price IS NULL, business_date) AS previous_row
+        FROM stock_prices
+        WHERE business_date >= :start AND business_date < :end
+    ) p
+    GROUP BY security_id
+) c
+"""
+
+# moving averages and 52-week high/low of the securities traded on :dates,
+# for :dates and their later stored days before :until; a moving average is
+# null until the security has that many sessions
+INDICATORS_QUERY = """
+SELECT {columns} FROM (
+    SELECT security_id, business_date, symbol, close_price, {averages},
+           MAX(high_price) OVER past_year AS high_52_week,
+           MIN(low_price) OVER past_year AS low_52_week
+    FROM stock_prices
+    WHERE business_date >= :read_from AND business_date < :until
+      AND security_id IN (SELECT security_id FROM stock_prices WHERE business_date IN :dates)
+    WINDOW {windows},
+           past_year AS (PARTITION BY security_id ORDER BY {day} RANGE BETWEEN {year} PRECEDING AND CURRENT ROW)
+) i
+WHERE business_date IN :dates OR business_date > :last
+"""
+
+
+def _indicators_query(conn):
+    averages = ', '.join(f'CASE WHEN COUNT(close_price) OVER sma_{window} = {window} '
+                         f'THEN AVG(close_price) OVER sma_{window} END AS sma_{window}' for window in MOVING_AVERAGES)
+    windows = ', '.join(f'sma_{window} AS (PARTITION BY security_id ORDER BY business_date '
+                        f'ROWS BETWEEN {window - 1} PRECEDING AND CURRENT ROW)' for window in MOVING_AVERAGES)
+    # the 365 days up to and including a day, as pandas' rolling('365D')
+    if conn.dialect.name == 'postgresql':
+        day, year = 'business_date', "INTERVAL '364 days'"
+    else:
+        day, year = 'julianday(business_date)', '364'
+    return INDICATORS_QUERY.format(columns=', '.join(INDICATOR_COLUMNS), averages=averages, windows=windows,
+                                   day=day, year=year)
+
+
+def _upsert_select(conn, table_name, columns, query, params, dates=()):
+    """
+    Upsert the rows of `query` into `table_name` on its natural key, only
+    touching rows whose values changed. `dates` names the parameters that
+    hold dates. Returns the rows written.
+    """
+    keys = bulk.NATURAL_KEYS[table_name]
+    values = [col for col in columns if col not in keys]
+    distinct = 'IS DISTINCT FROM' if conn.dialect.name == 'postgresql' else 'IS NOT'
+    listed = ', '.join(columns)
+    # WHERE true: SQLite would otherwise read ON CONFLICT as a join constraint
+    statement = text(
+        f'INSERT INTO {table_name} ({listed}) SELECT {listed} FROM ({query}) s WHERE true '
+        f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {", ".join(f"{col} = excluded.{col}" for col in values)} '
+        f'WHERE {" OR ".join(f"{table_name}.{col} {distinct} excluded.{col}" for col in values)}'
+    ).bindparams(*[bindparam(name, type_=Date, expanding=isinstance(params[name], list)) for name in dates])
+    with timing.span('db_write'):
+        return conn.execute(statement, params).rowcount
+
+
+def sector_totals(df, period):
+    """
+    Turnover, volume and trades per sector and period, with each sector's
+    share of the period's total turnover.
+    """
+    df = df.assign(period_start=PERIODS[period](df['business_date']))
+    totals = df.groupby(['sector_name', 'period_start'], sort=False).agg(
+        trading_days=('business_date', 'nunique'),
+        turnover=('turn_over_values', 'sum'),
+        volume=('turn_over_volume', 'sum'),
+        transactions=('total_transaction', 'sum'),
+    ).reset_index()
+    period_turnover = totals.groupby('period_start')['turnover'].transform('sum')
+    totals['turnover_share'] = totals['turnover'] / period_turnover.where(period_turnover > 0)
+    return totals
+
+
+def _write(frames):
+    written = {}
+    for table_name, df in frames.items():
+        if df.empty:
+            continue
+        # a transaction per table: on SQLite a second upsert could not create
+        # its unique key while the first one holds the write lock
+        with db.begin() as conn:
+            result = bulk.upsert(conn, df, table_name)
+        written[table_name] = result['inserted'] + result['updated']
+    return written
+
+
+def _refresh_prices(dates, until):
+    """
+    Upsert the candles of every period containing one of `dates`, and the
+    indicators of `dates` and of the later stored days before `until`.
+    """
+    first, last = dates[0], dates[-1]
+    written = {}
+    with db.begin() as conn:
+        for period, period_start in PERIODS.items():
+            table_name = f'stock_prices_{period}'
+            if not inspect(conn).has_table(table_name):
+                logger.warning(f"{table_name} does not exist yet, run `python schema.py`")
+                continue
+            written[table_name] = 0
+            for start in sorted(set(period_start(pd.Series(dates)))):
+                end = start + (pd.offsets.MonthBegin(1) if period == 'monthly' else pd.Timedelta(days=7))
+                written[table_name] += _upsert_select(
+                    conn, table_name, CANDLE_COLUMNS, CANDLES_QUERY,
+                    {'period_start': start.date(), 'start': start.date(), 'end': end.date()},
+                    dates=('period_start', 'start', 'end'))
+        if inspect(conn).has_table('stock_price_indicators'):
+            written['stock_price_indicators'] = _upsert_select(
+                conn, 'stock_price_indicators', INDICATOR_COLUMNS, _indicators_query(conn),
+                {'read_from': (first - LOOKBACK).date(), 'until': until.date(),
+                 'dates': [day.date() for day in dates], 'last': last.date()},
+                dates=('read_from', 'until', 'dates', 'last'))
+        else:
+            logger.warning("stock_price_indicators does not exist yet, run `python schema.py`")
+    logger.info(f"Price rollups refreshed for {first.date()}..{last.date()}: {written}")
+    return written
+
+
+def _refresh_sectors(dates):
+    # a month always covers the week that contains any of its days
+    start = min(_month_start(pd.Series(dates)).min(), _week_start(pd.Series(dates)).min())
+    end = dates[-1] + pd.Timedelta(days=32)
+    with db.begin() as conn:
+        history = _read(conn, 'stock_sector_wise_summary', SECTOR_COLUMNS, start, end)
+    if history.empty:
+        return {}
+    frames = {f'stock_sectors_{period}': sector_totals(_touched(history, period, dates), period)
+              for period in PERIODS}
+    written = _write(frames)
+    logger.info(f"Sector rollups refreshed for {dates[0].date()}..{dates[-1].date()}: {written}")
+    return written
+
+
+def _months(dates):
+    # sorted `dates` in one list per month, oldest month first
+    months = {}
+    for day in dates:
+        months.setdefault(day.to_period('M'), []).append(day)
+    return [months[month] for month in sorted(months)]
+
+
+def _refresh_prices_by_month(dates, tail):
+    """
+    _refresh_prices a month at a time, so one statement never reads more
+    than a month plus its lookback. With `tail`, the indicators of stored
+    days within WINDOW_REACH after each month are recomputed too; a rebuild
+    recomputes those days itself.
+    """
+    written = {}
+    for chunk in _months(dates):
+        until = chunk[-1] + (WINDOW_REACH if tail else pd.Timedelta(0)) + pd.Timedelta(days=1)
+        for table_name, rows in _refresh_prices(chunk, until).items():
+            written[table_name] = written.get(table_name, 0) + rows
+    return written
+
+
+def _refresh_sectors_by_month(dates):
+    written = {}
+    for chunk in _months(dates):
+        for table_name, rows in _refresh_sectors(chunk).items():
+            written[table_name] = written.get(table_name, 0) + rows
+    return written
+
+
+def _defer(kind, dates):
+    pending = _deferred.get()
+    if pending is None:
+        return False
+    with _deferred_lock:
+        pending[kind].update(dates)
+    return True
+
+
+def refresh_prices(dates):
+    """
+    Recompute the price rollups touched by newly written stock_prices
+    dates. A failure is logged, never raised: rollups must not fail an
+    ingest, and the next refresh or a rebuild recomputes the same rows.
+    """
+    dates = _dates(dates)
+    if not ROLLUPS or not dates or _defer('prices', dates):
+        return None
+    try:
+        with timing.span('rollups'):
+            # indicators of later days may include these dates in their windows
+            return _refresh_prices_by_month(dates, tail=True)
+    except Exception as e:
+        logger.error(f"Error refreshing price rollups: {str(e)}")
+        return None
+
+
+def refresh_sectors(dates):
+    """
+    Recompute the sector rollups touched by newly written
+    stock_sector_wise_summary dates; failures are logged like refresh_prices.
+    """
+    dates = _dates(dates)
+    if not ROLLUPS or not dates or _defer('sectors', dates):
+        return None
+    try:
+        with timing.span('rollups'):
+            return _refresh_sectors_by_month(dates)
+    except Exception as e:
+        logger.error(f"Error refreshing sector rollups: {str(e)}")
+        return None
+
+
+@contextmanager
+def deferred():
+    """
+    Collect the refreshes requested inside the block and run them once at
+    the end, a month at a time, e.g. around a backfill of many days. Only
+    the calling context defers: worker threads join in when submitted
+    through contextvars.copy_context().run, and other requests and jobs are
+    not affected.
+    """
+    if _deferred.get() is not None:
+        yield
+        return
+    pending = {'prices': set(), 'sectors': set()}
+    token = _deferred.set(pending)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+        refresh_prices(pending['prices'])
+        refresh_sectors(pending['sectors'])
+
+
+def _stored_dates(conn, table_name, start, end):
+    if not inspect(conn).has_table(table_name):
+        return []
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    query = select(func.distinct(table.c.business_date))
+    if start:
+        query = query.where(table.c.business_date >= pd.Timestamp(start).to_pydatetime())
+    if end:
+        query = query.where(table.c.business_date < (pd.Timestamp(end) + pd.Timedelta(days=1)).to_pydatetime())
+    return _dates(row[0] for row in conn.execute(query))
+
+
+def rebuild(start=None, end=None):
+    """
+    Recompute every rollup for stored dates in [start, end], a month at a
+    time.
+    """
+    with db.begin() as conn:
+        price_dates = _stored_dates(conn, 'stock_prices', start, end)
+        sector_dates = _stored_dates(conn, 'stock_sector_wise_summary', start, end)
+    written = _refresh_prices_by_month(price_dates, tail=False) if price_dates else {}
+    written.update(_refresh_sectors_by_month(sector_dates))
+    return {"months": len({day.to_period('M') for day in price_dates + sector_dates}),
+            "price_dates": len(price_dates), "sector_dates": len(sector_dates), "rows": sum(written.values())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the OHLCV, indicator and sector rollup tables')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuilding = commands.add_parser('rebuild', help='recompute rollups from stored history')
+    rebuilding.add_argument('--start', help='first date, YYYY-MM-DD')
+    rebuilding.add_argument('--end', help='last date, YYYY-MM-DD (inclusive)')
+    args = parser.parse_args(argv)
+
+    if db.get_engine() is None:
+        return 1
+    summary = rebuild(args.start, args.end)
+    logger.info(f"Rollups rebuilt: {summary}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    raise SystemExit(main())
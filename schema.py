@@ -0,0 +1,418 @@
+"""
+Schema for the tables the service owns, and the migrations that get a
+database there.
+
+stock_prices and stock_sector_wise_summary used to be created by the first
+to_sql append, with pandas-inferred types, no key and no indexes. They are
+now created from explicit DDL with a primary key on their natural key. On
+Postgres stock_prices is range partitioned by year on business_date, with a
+BRIN index on business_date in every partition and a default partition for
+dates no yearly partition covers yet.
+
+Migrations are numbered and recorded in schema_migrations. Pending ones
+run when a process creates its engine (see db.get_engine), under an
+advisory lock so concurrent cold starts apply each one once. Rebuilding a
+table that to_sql created copies all of its rows, which is too slow for a
+request, so a process starting up leaves such a migration, and the ones
+after it, pending. Run them before deploying:
+
+    python schema.py            # apply pending migrations
+    python schema.py --status   # list applied and pending migrations
+"""
+import argparse
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = 'schema_migrations'
+# pg_advisory_xact_lock key held while migrating
+LOCK_ID = 7263001
+
+# (column, type, nullable); numeric types follow the frames written into
+# them, float32 -> real, float64 -> double, Int64 -> bigint
+PRICE_COLUMNS = [
+    ('business_date', 'date', False),
+    ('security_id', 'bigint', False),
+    ('symbol', 'text', True),
+    ('security_name', 'text', True),
+    ('open_price', 'real', True),
+    ('high_price', 'real', True),
+    ('low_price', 'real', True),
+    ('close_price', 'real', True),
+    ('total_traded_quantity', 'double', True),
+    ('total_traded_value', 'double', True),
+    ('previous_day_close_price', 'real', True),
+    ('fifty_two_week_high', 'real', True),
+    ('fifty_two_week_low', 'real', True),
+    ('last_updated_time', 'timestamp', True),
+    ('last_updated_price', 'real', True),
+    ('total_trades', 'double', True),
+    ('average_traded_price', 'real', True),
+    ('market_capitalization', 'double', True),
+]
+PRICE_KEY = ('security_id', 'business_date')
+
+SECTOR_COLUMNS = [
+    ('business_date', 'date', False),
+    ('sector_name', 'text', False),
+    ('total_transaction', 'double', True),
+    ('turn_over_values', 'double', True),
+    ('turn_over_volume', 'double', True),
+    ('created_at', 'date', True),
+]
+SECTOR_KEY = ('sector_name', 'business_date')
+
+# one row per listed security with its latest symbol, kept up by every
+# stock_prices write, so the security master loads without scanning prices
+SECURITY_COLUMNS = [
+    ('security_id', 'bigint', False),
+    ('symbol', 'text', True),
+]
+SECURITY_KEY = ('security_id',)
+
+# rollups.py tables, created by their first to_sql append before migration 4
+CANDLE_COLUMNS = [
+    ('security_id', 'bigint', False),
+    ('period_start', 'date', False),
+    ('symbol', 'text', True),
+    ('first_date', 'date', True),
+    ('last_date', 'date', True),
+    ('trading_days', 'bigint', True),
+    ('open_price', 'double', True),
+    ('high_price', 'double', True),
+    ('low_price', 'double', True),
+    ('close_price', 'double', True),
+    ('previous_close', 'double', True),
+    ('total_traded_quantity', 'double', True),
+    ('total_traded_value', 'double', True),
+    ('total_trades', 'double', True),
+    ('change_pct', 'double', True),
+]
+CANDLE_KEY = ('security_id', 'period_start')
+
+# one sma_<n> per rollups.MOVING_AVERAGES
+INDICATOR_COLUMNS = [
+    ('security_id', 'bigint', False),
+    ('business_date', 'date', False),
+    ('symbol', 'text', True),
+    ('close_price', 'double', True),
+    ('sma_5', 'double', True),
+    ('sma_20', 'double', True),
+    ('sma_50', 'double', True),
+    ('sma_200', 'double', True),
+    ('high_52_week', 'double', True),
+    ('low_52_week', 'double', True),
+]
+INDICATOR_KEY = ('security_id', 'business_date')
+
+SECTOR_TOTAL_COLUMNS = [
+    ('sector_name', 'text', False),
+    ('period_start', 'date', False),
+    ('trading_days', 'bigint', True),
+    ('turnover', 'double', True),
+    ('volume', 'double', True),
+    ('transactions', 'double', True),
+    ('turnover_share', 'double', True),
+]
+SECTOR_TOTAL_KEY = ('sector_name', 'period_start')
+
+ROLLUP_TABLES = [
+    ('stock_prices_weekly', CANDLE_COLUMNS, CANDLE_KEY),
+    ('stock_prices_monthly', CANDLE_COLUMNS, CANDLE_KEY),
+    ('stock_price_indicators', INDICATOR_COLUMNS, INDICATOR_KEY),
+    ('stock_sectors_weekly', SECTOR_TOTAL_COLUMNS, SECTOR_TOTAL_KEY),
+    ('stock_sectors_monthly', SECTOR_TOTAL_COLUMNS, SECTOR_TOTAL_KEY),
+]
+
+_TYPES = {
+    'postgresql': {'date': 'DATE', 'timestamp': 'TIMESTAMP', 'bigint': 'BIGINT', 'real': 'REAL',
+                   'double': 'DOUBLE PRECISION', 'text': 'TEXT'},
+    'sqlite': {'date': 'DATE', 'timestamp': 'TIMESTAMP', 'bigint': 'BIGINT', 'real': 'REAL',
+               'double': 'FLOAT', 'text': 'TEXT'},
+}
+
+
+def _postgres(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _types(conn):
+    return _TYPES['sqlite'] if conn.dialect.name == 'sqlite' else _TYPES['postgresql']
+
+
+def _quoted(columns):
+    return ', '.join(f'"{col}"' for col in columns)
+
+
+def _create_table(conn, table_name, columns, key, partition_by=None):
+    types = _types(conn)
+    definitions = [f'"{name}" {types[kind]}{"" if nullable else " NOT NULL"}' for name, kind, nullable in columns]
+    ddl = f'CREATE TABLE "{table_name}" ({", ".join(definitions)}, PRIMARY KEY ({_quoted(key)}))'
+    if partition_by and _postgres(conn):
+        ddl += f' PARTITION BY RANGE ("{partition_by}")'
+    conn.execute(text(ddl))
+    if partition_by and _postgres(conn):
+        conn.execute(text(f'CREATE TABLE "{table_name}_default" PARTITION OF "{table_name}" DEFAULT'))
+
+
+def _copy_rows(conn, source, table_name, columns, key):
+    """
+    Copy the columns `source` shares with `table_name`, cast to their new
+    types. Rows without a key are dropped and of duplicate keys the most
+    recently written row is kept, as bulk's unique key migration did.
+    """
+    types = _types(conn)
+    present = {col['name'] for col in inspect(conn).get_columns(source)}
+    kept = [(name, kind) for name, kind, _ in columns if name in present]
+    names = _quoted(name for name, _ in kept)
+    not_null = ' AND '.join(f'"{col}" IS NOT NULL' for col in key)
+    if _postgres(conn):
+        # the keys in DISTINCT ON and ORDER BY name the cast output columns
+        selected = ', '.join(f'CAST("{name}" AS {types[kind]}) AS "{name}"' for name, kind in kept)
+        query = (f'INSERT INTO "{table_name}" ({names}) SELECT DISTINCT ON ({_quoted(key)}) {selected} '
+                 f'FROM "{source}" WHERE {not_null} ORDER BY {_quoted(key)}, ctid DESC')
+    else:
+        # later rows replace earlier ones with the same key
+        selected = ', '.join(f'date("{name}")' if kind == 'date' else f'"{name}"' for name, kind in kept)
+        query = (f'INSERT OR REPLACE INTO "{table_name}" ({names}) SELECT {selected} '
+                 f'FROM "{source}" WHERE {not_null} ORDER BY rowid')
+    return conn.execute(text(query)).rowcount
+
+
+def _install(conn, table_name, columns, key, partition_by=None, partition_years=None):
+    """
+    Create `table_name`. A table of that name left by to_sql is renamed out
+    of the way first and its rows copied into the new one.
+    """
+    legacy = None
+    if inspect(conn).has_table(table_name):
+        legacy = f'{table_name}_legacy'
+        conn.execute(text(f'ALTER TABLE "{table_name}" RENAME TO "{legacy}"'))
+    _create_table(conn, table_name, columns, key, partition_by)
+    if legacy is None:
+        return
+    if partition_by and _postgres(conn):
+        # partitions for the history being copied, so none of it lands in the default one
+        ensure_partitions(conn, partition_years(conn, legacy))
+    copied = _copy_rows(conn, legacy, table_name, columns, key)
+    # dropping the old table also drops its indexes, whose names are reused below
+    conn.execute(text(f'DROP TABLE "{legacy}"'))
+    logger.info(f"Rebuilt {table_name} with explicit schema, {copied} rows copied")
+
+
+def _create_index(conn, name, table_name, columns, using=None):
+    method = f' USING {using}' if using and _postgres(conn) else ''
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table_name}"{method} ({_quoted(columns)})'))
+
+
+def _years(conn, table_name):
+    # business_date of a table to_sql created may be TEXT
+    return {int(year) for year in conn.execute(text(
+        f'SELECT DISTINCT CAST(EXTRACT(YEAR FROM CAST("business_date" AS DATE)) AS INTEGER) FROM "{table_name}" '
+        'WHERE "business_date" IS NOT NULL'
+    )).scalars()}
+
+
+def ensure_partitions(conn, years):
+    """
+    Create the yearly stock_prices partitions in `years` that are missing.
+    Rows already in the default partition for such a year are moved into it.
+    """
+    existing = set(conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'stock_prices'"
+    )).scalars())
+    created = []
+    for year in sorted(years):
+        name = f'stock_prices_{year}'
+        if name in existing:
+            continue
+        bounds = f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        in_range = f"\"business_date\" >= '{year}-01-01' AND \"business_date\" < '{year + 1}-01-01'"
+        if conn.execute(text(f'SELECT 1 FROM "stock_prices_default" WHERE {in_range} LIMIT 1')).first() is None:
+            conn.execute(text(f'CREATE TABLE "{name}" PARTITION OF "stock_prices" {bounds}'))
+        else:
+            # a partition cannot be added while the default one holds rows it would cover
+            conn.execute(text(f'CREATE TABLE "{name}" (LIKE "stock_prices")'))
+            conn.execute(text(
+                f'WITH moved AS (DELETE FROM "stock_prices_default" WHERE {in_range} RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved'
+            ))
+            conn.execute(text(f'ALTER TABLE "stock_prices" ATTACH PARTITION "{name}" {bounds}'))
+        created.append(year)
+    if created:
+        logger.info(f"Created stock_prices partitions for {', '.join(map(str, created))}")
+    return created
+
+
+def _migrate_stock_prices(conn):
+    _install(conn, 'stock_prices', PRICE_COLUMNS, PRICE_KEY, partition_by='business_date', partition_years=_years)
+    # the primary key serves security_id lookups and keyset pages
+    _create_index(conn, 'ix_stock_prices_symbol_security_id_business_date', 'stock_prices',
+                  ('symbol', 'security_id', 'business_date'))
+    # rows arrive in business_date order, so a BRIN index stays small and selective
+    _create_index(conn, 'ix_stock_prices_business_date', 'stock_prices', ('business_date',), using='brin')
+
+
+def _migrate_sector_summary(conn):
+    _install(conn, 'stock_sector_wise_summary', SECTOR_COLUMNS, SECTOR_KEY)
+    _create_index(conn, 'ix_stock_sector_wise_summary_business_date', 'stock_sector_wise_summary',
+                  ('business_date',))
+
+
+def _migrate_securities(conn):
+    _create_table(conn, 'stock_securities', SECURITY_COLUMNS, SECURITY_KEY)
+    if not inspect(conn).has_table('stock_prices'):
+        return
+    # the symbol of each security's latest day
+    copied = conn.execute(text(
+        'INSERT INTO "stock_securities" ("security_id", "symbol") '
+        'SELECT p."security_id", max(p."symbol") FROM "stock_prices" p JOIN ('
+        'SELECT "security_id", max("business_date") AS "business_date" FROM "stock_prices" '
+        'WHERE "security_id" IS NOT NULL GROUP BY "security_id") latest '
+        'ON latest."security_id" = p."security_id" AND latest."business_date" = p."business_date" '
+        'GROUP BY p."security_id"'
+    )).rowcount
+    logger.info(f"Created stock_securities with {copied} securities")
+
+
+def _migrate_rollups(conn):
+    # rollups.py upserts into these with INSERT ... SELECT, which needs their key up front
+    for table_name, columns, key in ROLLUP_TABLES:
+        _install(conn, table_name, columns, key)
+
+
+def _migrate_jobs(conn):
+    # jobs.py created this on first use before migration 5, with the same DDL
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS scrape_jobs ("
+        "id VARCHAR(32) PRIMARY KEY, "
+        "kind VARCHAR(32) NOT NULL, "
+        "dedupe_key VARCHAR(128) NOT NULL, "
+        "business_date VARCHAR(10), "
+        "status VARCHAR(16) NOT NULL, "
+        "row_count INTEGER, "
+        "result TEXT, "
+        "error TEXT, "
+        "stages TEXT, "
+        "queued_at TIMESTAMP NOT NULL, "
+        "started_at TIMESTAMP, "
+        "finished_at TIMESTAMP, "
+        "updated_at TIMESTAMP NOT NULL)"
+    ))
+    # at most one queued or running job per key
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_scrape_jobs_active ON scrape_jobs (dedupe_key) "
+        "WHERE status IN ('queued', 'running')"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_scrape_jobs_queued_at ON scrape_jobs (queued_at)"))
+
+
+# (version, name, fn(conn)); append only, never renumber
+MIGRATIONS = [
+    (1, 'stock_prices explicit schema', _migrate_stock_prices),
+    (2, 'stock_sector_wise_summary explicit schema', _migrate_sector_summary),
+    (3, 'stock_securities', _migrate_securities),
+    (4, 'rollup tables explicit schema', _migrate_rollups),
+    (5, 'scrape_jobs', _migrate_jobs),
+]
+# version -> existing tables whose rows the migration copies; too slow for
+# startup once any of them holds rows
+REBUILDS = {
+    1: ('stock_prices',),
+    2: ('stock_sector_wise_summary',),
+    3: ('stock_prices',),
+    4: tuple(table_name for table_name, _, _ in ROLLUP_TABLES),
+}
+
+
+def _applied(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(128) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+    return {row[0]: row[1] for row in conn.execute(text(f"SELECT version, applied_at FROM {MIGRATIONS_TABLE}"))}
+
+
+def _has_rows(conn, table_name):
+    if not inspect(conn).has_table(table_name):
+        return False
+    return conn.execute(text(f'SELECT 1 FROM "{table_name}" LIMIT 1')).first() is not None
+
+
+def migrate(engine, rebuild=True):
+    """
+    Apply pending migrations in one transaction and make sure stock_prices
+    has partitions for this year and the next. Returns the versions applied.
+    With rebuild=False, as on startup, migrations stop at the first one that
+    would have to copy the rows of an existing table.
+    """
+    with engine.begin() as conn:
+        if _postgres(conn):
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': LOCK_ID})
+        applied = _applied(conn)
+        done = []
+        for version, name, fn in MIGRATIONS:
+            if version in applied:
+                continue
+            full = [table_name for table_name in REBUILDS.get(version, ()) if _has_rows(conn, table_name)]
+            if not rebuild and full:
+                logger.warning(f"Migration {version} ({name}) copies the existing {', '.join(full)} "
+                               "and is left pending; run `python schema.py` to apply it")
+                break
+            logger.info(f"Applying migration {version}: {name}")
+            fn(conn)
+            conn.execute(text(f"INSERT INTO {MIGRATIONS_TABLE} (version, name, applied_at) "
+                              "VALUES (:version, :name, :applied_at)"),
+                         {'version': version, 'name': name, 'applied_at': datetime.now()})
+            done.append(version)
+        if _postgres(conn) and inspect(conn).has_table('stock_prices_default'):
+            year = date.today().year
+            # and any year a backfill wrote into the default partition
+            ensure_partitions(conn, {year, year + 1} | _years(conn, 'stock_prices_default'))
+    return done
+
+
+def status(engine):
+    """
+    [{version, name, applied_at}] for every known migration; applied_at is
+    None while pending.
+    """
+    with engine.begin() as conn:
+        if not inspect(conn).has_table(MIGRATIONS_TABLE):
+            applied = {}
+        else:
+            applied = {row[0]: row[1] for row in
+                       conn.execute(text(f"SELECT version, applied_at FROM {MIGRATIONS_TABLE}"))}
+    return [{"version": version, "name": name,
+             "applied_at": str(applied[version]) if version in applied else None}
+            for version, name, _ in MIGRATIONS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply or list schema migrations')
+    parser.add_argument('--status', action='store_true', help='list migrations instead of applying them')
+    args = parser.parse_args(argv)
+
+    import db
+
+    engine = db.get_engine()
+    if engine is None:
+        return 1
+    if not args.status:
+        # get_engine has applied them unless DATABASE_MIGRATE is off
+        applied = migrate(engine)
+        logger.info(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+    for migration in status(engine):
+        print(f"{migration['version']:>4}  {migration['applied_at'] or 'pending':<26}  {migration['name']}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    raise SystemExit(main())
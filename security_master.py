@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+import bulk
+import db
+
+logger = logging.getLogger(__name__)
+
+SECURITIES_TABLE = 'stock_securities'
+# seconds an id found nowhere is answered from memory before it is looked up again
+MISS_TTL = float(os.getenv('SECURITY_MISS_TTL', 60))
+
+LOAD_QUERY = (
+    f"SELECT p.security_id, p.symbol, s.sector FROM {SECURITIES_TABLE} p "
+    "LEFT JOIN stock_symbol_sectors s ON s.symbol = p.symbol"
+)
+LOAD_QUERY_NO_SECTORS = f"SELECT security_id, symbol, NULL AS sector FROM {SECURITIES_TABLE}"
+LOOKUP_QUERY = "SELECT security_id, symbol FROM stock_prices WHERE security_id = :security_id LIMIT 1"
+
+
+class SecurityMaster:
+    """
+    In-memory map of security_id -> {symbol, sector}.
+
+    Loaded once from stock_securities/stock_symbol_sectors and then kept up
+    to date from the frames we write, so validating an id is a dict lookup
+    instead of a scan over the price history.
+    """
+
+    def __init__(self):
+        self._by_id = None
+        # security_id -> monotonic time until which it is known to be missing
+        self._missing = {}
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        inspector = inspect(conn)
+        if not inspector.has_table(SECURITIES_TABLE):
+            # until schema.py has created it, unknown ids are looked up one by one
+            logger.warning(f"{SECURITIES_TABLE} does not exist yet, run `python schema.py`")
+            return {}
+        query = LOAD_QUERY if inspector.has_table('stock_symbol_sectors') else LOAD_QUERY_NO_SECTORS
+        by_id = {}
+        for security_id, symbol, sector in conn.execute(text(query)):
+            by_id[int(security_id)] = {"symbol": symbol, "sector": sector}
+        return by_id
+
+    def _ensure_loaded(self):
+        if self._by_id is not None:
+            return self._by_id
+        with self._lock:
+            if self._by_id is None:
+                with db.begin() as conn:
+                    self._by_id = self._load(conn)
+                logger.info(f"Security master loaded with {len(self._by_id)} securities")
+        return self._by_id
+
+    def refresh(self):
+        """
+        Reload the whole map from the database.
+        """
+        with db.begin() as conn:
+            by_id = self._load(conn)
+        with self._lock:
+            self._by_id = by_id
+            self._missing.clear()
+        logger.info(f"Security master refreshed with {len(by_id)} securities")
+
+    def get(self, security_id):
+        """
+        Return {symbol, sector} for `security_id`, or None if it is unknown.
+        Ids missing from memory are looked up in the price history in case
+        another process stored them; an id found nowhere is not looked up
+        again for MISS_TTL seconds.
+        """
+        by_id = self._ensure_loaded()
+        security = by_id.get(security_id)
+        if security is not None:
+            return security
+        with self._lock:
+            if self._missing.get(security_id, 0) > time.monotonic():
+                return None
+        with db.begin() as conn:
+            row = None
+            if inspect(conn).has_table('stock_prices'):
+                row = conn.execute(text(LOOKUP_QUERY), {"security_id": security_id}).first()
+        with self._lock:
+            if row is None:
+                self._missing[security_id] = time.monotonic() + MISS_TTL
+                return None
+            security = {"symbol": row[1], "sector": None}
+            by_id[int(row[0])] = security
+        return security
+
+    def contains(self, security_id):
+        return self.get(security_id) is not None
+
+    def ids(self):
+        by_id = self._ensure_loaded()
+        with self._lock:
+            return sorted(by_id)
+
+    def store(self, frames):
+        """
+        Upsert the securities of committed stock_prices frames into
+        stock_securities, then add them to the map. A failure is logged:
+        lookups fall back to stock_prices for ids the table is missing.
+        """
+        if not frames:
+            return
+        securities = (pd.concat(frames)[['security_id', 'symbol']].dropna(subset=['security_id'])
+                      .drop_duplicates(subset=['security_id'], keep='last'))
+        try:
+            with db.begin() as conn:
+                if inspect(conn).has_table(SECURITIES_TABLE):
+                    bulk.upsert(conn, securities, SECURITIES_TABLE)
+        except Exception as e:
+            logger.error(f"Error storing securities: {str(e)}")
+        self.update_prices(securities)
+
+    def update_prices(self, df):
+        """
+        Add securities from a stock_prices frame. Call it only once the
+        write has committed, so a rolled back insert leaves no ids behind.
+        """
+        securities = df[['security_id', 'symbol']].dropna(subset=['security_id']).drop_duplicates()
+        with self._lock:
+            for security_id, _ in securities.itertuples(index=False):
+                self._missing.pop(int(security_id), None)
+            if self._by_id is None:
+                return
+            for security_id, symbol in securities.itertuples(index=False):
+                security = self._by_id.get(int(security_id))
+                if security is None:
+                    self._by_id[int(security_id)] = {"symbol": symbol, "sector": None}
+                else:
+                    security['symbol'] = symbol
+
+    def update_sectors(self, df):
+        """
+        Apply sectors from a committed stock_symbol_sectors frame.
+        """
+        if self._by_id is None:
+            return
+        sectors = dict(zip(df['symbol'], df['sector']))
+        with self._lock:
+            for security in self._by_id.values():
+                if security['symbol'] in sectors:
+                    security['sector'] = sectors[security['symbol']]
+
+
+security_master = SecurityMaster()
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+
+class Timeout(TimeoutError):
+    """
+    Raised to a caller that gave up waiting for another caller's flight.
+    """
+
+
+def _left(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key onto one execution.
+
+    The first caller for a key runs `fn`; callers arriving while it is in
+    flight wait for it and receive the same result, after calling
+    `on_join()` if given. A caller waits at most `timeout` seconds, then
+    raises Timeout. An exception belongs to the caller that raised it:
+    when the flight fails, each waiting caller runs `fn` again itself,
+    joining whichever flight for the key is then under way.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    def do(self, key, fn, on_join=None, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if on_join is not None:
+                on_join()
+            if not call.event.wait(timeout):
+                raise Timeout(f"Gave up waiting for {key}")
+            if call.error is None:
+                return call.result
+            return self.do(key, fn, timeout=_left(deadline))
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight. Must be used from a single event
+    loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    async def do(self, key, fn, on_join=None, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = self._calls.get(key)
+        if future is not None:
+            if on_join is not None:
+                on_join()
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # this caller was cancelled, not the flight
+                    raise
+            except Exception:
+                if not future.done():
+                    raise Timeout(f"Gave up waiting for {key}") from None
+            # the flight failed or the caller running it was cancelled; run it here instead
+            return await self.do(key, fn, timeout=_left(deadline))
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark retrieved so a failed flight nobody joined is not logged
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
@@ -0,0 +1,51 @@
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    A throwaway SQLite database behind db.get_engine(), migrated.
+    """
+    monkeypatch.delenv('DATABASE_PGBOUNCER_URL', raising=False)
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(db, '_engines', {})
+    engine = db.get_engine()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def postgres_uri():
+    pgserver = pytest.importorskip('pgserver')
+    server = pgserver.get_server(tempfile.mkdtemp(), cleanup_mode='delete')
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def engine(request, tmp_path):
+    """
+    An empty database of each dialect; Postgres tests are skipped without
+    pgserver.
+    """
+    if request.param == 'sqlite':
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        yield engine
+        engine.dispose()
+        return
+    uri = request.getfixturevalue('postgres_uri')
+    name = f'test_{tmp_path.name.lower()}'.replace('-', '_')
+    admin = create_engine(uri, isolation_level='AUTOCOMMIT')
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE {name}'))
+    engine = create_engine(uri.replace('/postgres?', f'/{name}?', 1))
+    yield engine
+    engine.dispose()
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE {name}'))
+    admin.dispose()
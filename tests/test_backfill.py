@@ -0,0 +1,24 @@
+import time
+
+import backfill
+import resilience
+
+
+def test_days_get_their_own_deadline(database, monkeypatch):
+    monkeypatch.setattr(resilience, 'REQUEST_DEADLINE', 0.3)
+    # as under a Flask request: the whole backfill outlasts this budget
+    resilience.begin_request()
+
+    def fetch(day):
+        time.sleep(0.1)
+        if resilience.remaining() <= 0:
+            raise resilience.DeadlineExceeded(f"No time left for {day}")
+        return {'content': [{'businessDate': day}]}
+
+    try:
+        summary = backfill.run_backfill('2024-01-01', '2024-01-10', fetch, lambda payload, day: {'status': 200},
+                                        workers=2, rate=0)
+    finally:
+        resilience.end_request()
+    assert summary['failed_dates'] == []
+    assert summary['done'] == summary['days'] > 3
@@ -0,0 +1,43 @@
+import pandas as pd
+from sqlalchemy import text
+
+import bulk
+
+TABLE = 'stock_symbol_sectors'
+
+
+def _upsert(engine, rows):
+    df = pd.DataFrame(rows, columns=['symbol', 'sector'])
+    with engine.begin() as conn:
+        return bulk.upsert(conn, df, TABLE)
+
+
+def _rows(engine):
+    with engine.begin() as conn:
+        return conn.execute(text(f'SELECT symbol, sector FROM {TABLE} ORDER BY symbol')).all()
+
+
+def _counts(result):
+    return result['inserted'], result['updated'], result['unchanged']
+
+
+def test_rewrite_is_a_no_op(engine):
+    rows = [('NABIL', 'Commercial Banks'), ('NICA', 'Commercial Banks')]
+    assert _counts(_upsert(engine, rows)) == (2, 0, 0)
+    assert _counts(_upsert(engine, rows)) == (0, 0, 2)
+    assert _rows(engine) == rows
+
+
+def test_conflicts_update_changed_rows_only(engine):
+    _upsert(engine, [('NABIL', 'Commercial Banks'), ('NICA', 'Commercial Banks')])
+    result = _upsert(engine, [('NABIL', 'Commercial Banks'), ('NICA', 'Finance'), ('UPPER', 'Hydro Power')])
+    assert _counts(result) == (1, 1, 1)
+    assert _rows(engine) == [('NABIL', 'Commercial Banks'), ('NICA', 'Finance'), ('UPPER', 'Hydro Power')]
+
+
+def test_unique_key_keeps_the_last_duplicate(engine):
+    # as a plain to_sql append left the table: no key, a day written twice
+    with engine.begin() as conn:
+        pd.DataFrame({'symbol': ['NABIL', 'NABIL'], 'sector': ['Old', 'New']}).to_sql(TABLE, conn, index=False)
+    assert _counts(_upsert(engine, [('NICA', 'Finance')])) == (1, 0, 0)
+    assert _rows(engine) == [('NABIL', 'New'), ('NICA', 'Finance')]
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import cache
+
+
+def _counter(*values):
+    calls = []
+
+    def compute():
+        calls.append(None)
+        return values[min(len(calls), len(values)) - 1]
+
+    return compute, calls
+
+
+def test_fresh_entries_are_served_from_cache():
+    responses = cache.ResponseCache(cache.MemoryBackend())
+    compute, calls = _counter('a', 'b')
+    assert responses.get_or_compute('k', compute, lambda _: 60) == 'a'
+    assert responses.get_or_compute('k', compute, lambda _: 60) == 'a'
+    assert len(calls) == 1
+
+
+def test_stale_entry_is_served_while_it_revalidates():
+    responses = cache.ResponseCache(cache.MemoryBackend())
+    refreshed = threading.Event()
+    compute, calls = _counter('a', 'b')
+
+    def compute_and_signal():
+        value = compute()
+        if len(calls) > 1:
+            refreshed.set()
+        return value
+
+    assert responses.get_or_compute('k', compute_and_signal, lambda _: 0.05) == 'a'
+    time.sleep(0.06)
+    # past its fresh lifetime but inside the stale window, which is as long again
+    assert responses.get_or_compute('k', compute_and_signal, lambda _: 0.05) == 'a'
+    assert refreshed.wait(1)
+    time.sleep(0.01)
+    assert responses.get_or_compute('k', compute_and_signal, lambda _: 60) == 'b'
+    assert len(calls) == 2
+
+
+def test_expired_entry_is_recomputed():
+    responses = cache.ResponseCache(cache.MemoryBackend())
+    compute, calls = _counter('a', 'b')
+    responses.get_or_compute('k', compute, lambda _: 0.02)
+    time.sleep(0.05)
+    assert responses.get_or_compute('k', compute, lambda _: 0.02) == 'b'
+
+
+def test_ttl_lasts_until_the_next_session_while_closed(monkeypatch):
+    monkeypatch.setattr(cache.trading_calendar, 'seconds_until_next_open', lambda: 7200.0)
+    assert cache.endpoint_ttl('market_summary', market_open=True) == 60
+    assert cache.endpoint_ttl('market_summary', market_open=False) == 7200.0
+    monkeypatch.setenv('CACHE_TTL_MARKET_SUMMARY', '9000')
+    assert cache.endpoint_ttl('market_summary', market_open=False) == 9000.0
+
+
+def test_market_status_payload():
+    assert cache.market_is_open({'isOpen': 'OPEN'})
+    assert not cache.market_is_open({'isOpen': 'CLOSE'})
+    # an unreadable status is treated as open, so entries stay short-lived
+    assert cache.market_is_open(None)
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from ingest import iter_array
+
+PAYLOADS = [
+    ('[1.5, -2e5, 3, 1E-7, 0.25, -0.0, 12345678901234567890]', None),
+    ('[1.5]', None),
+    ('[-1e+5]', None),
+    ('{"totalElements": 12.5e1, "number": -3, "content": [{"closePrice": 1.25, "symbol": "NABIL"}, 7.5, -0.5e-3], '
+     '"totalPages": 1}', 'content'),
+    ('{"number": 1.5, "content": [1.5e3, true, null, "नेप्से"]}', 'content'),
+    ('{"content": null, "number": 2}', 'content'),
+]
+
+
+def _expected(payload, key):
+    document = json.loads(payload)
+    return (document[key] or []) if key is not None else document
+
+
+@pytest.mark.parametrize('payload,key', PAYLOADS)
+def test_split_at_every_offset(payload, key):
+    raw = payload.encode('utf-8')
+    expected = _expected(payload, key)
+    for offset in range(len(raw) + 1):
+        assert list(iter_array([raw[:offset], raw[offset:]], key)) == expected, offset
+
+
+@pytest.mark.parametrize('payload,key', PAYLOADS)
+def test_one_byte_chunks(payload, key):
+    raw = payload.encode('utf-8')
+    assert list(iter_array([raw[i:i + 1] for i in range(len(raw))], key)) == _expected(payload, key)
+
+
+def test_truncated_number_at_end_of_stream_fails():
+    with pytest.raises(ValueError):
+        list(iter_array([b'[1.', b'']))
@@ -0,0 +1,56 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import db
+import jobs
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    monkeypatch.setattr(jobs, 'WORKERS', 2)
+    monkeypatch.setattr(jobs, '_executor', None)
+
+
+def test_active_job_is_reused(database, workers):
+    release = threading.Event()
+    job, created = jobs.submit('scrape', '2024-01-07', lambda: release.wait() and {'rows': 3})
+    assert created
+    again, created = jobs.submit('scrape', '2024-01-07', lambda: {'rows': 0})
+    assert not created
+    assert again['id'] == job['id']
+    release.set()
+    finished = jobs.wait(job['id'], timeout=5)
+    assert finished['status'] == jobs.SUCCEEDED
+    assert finished['rows'] == 3
+    # a finished job no longer holds the key
+    later, created = jobs.submit('scrape', '2024-01-07', lambda: {'rows': 0})
+    assert created
+    assert later['id'] != job['id']
+    jobs.wait(later['id'], timeout=5)
+
+
+def test_stale_job_is_expired(database, monkeypatch):
+    monkeypatch.setattr(jobs, 'WORKERS', 0)
+    jobs._ensure()
+    lost = datetime.now() - timedelta(seconds=jobs.STALE_AFTER + 60)
+    with db.begin() as conn:
+        conn.execute(text(
+            f"INSERT INTO {jobs.JOBS_TABLE} (id, kind, dedupe_key, business_date, status, queued_at, updated_at) "
+            "VALUES ('lost', 'scrape', 'scrape:2024-01-07', '2024-01-07', 'running', :at, :at)"
+        ), {'at': lost})
+    job, created = jobs.submit('scrape', '2024-01-07', lambda: {'rows': 1})
+    assert created
+    assert job['status'] == jobs.SUCCEEDED
+    abandoned = jobs.get('lost')
+    assert abandoned['status'] == jobs.FAILED
+    assert abandoned['error'].startswith('abandoned')
+
+
+def test_error_response_fails_the_job(database, monkeypatch):
+    monkeypatch.setattr(jobs, 'WORKERS', 0)
+    job, _ = jobs.submit('scrape', '2024-01-08', lambda: {'status': 500, 'error': 'upstream down'})
+    assert job['status'] == jobs.FAILED
+    assert job['error'] == 'upstream down'
@@ -0,0 +1,104 @@
+import time
+
+import httpx
+import pytest
+
+import resilience
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    monkeypatch.setattr(resilience, '_breakers', {})
+    monkeypatch.setattr(resilience, 'BACKOFF_BASE', 0.0)
+    monkeypatch.setattr(resilience, 'RETRIES', 2)
+    yield
+    resilience.end_request()
+
+
+def _failing(*errors):
+    # a nepse-library-like method raising `errors` in turn, then returning 'ok'
+    calls = []
+
+    def getThing():
+        calls.append(None)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return 'ok'
+
+    return getThing, calls
+
+
+def _status_error(code):
+    request = httpx.Request('GET', 'https://nepse/x')
+    return httpx.HTTPStatusError(f'{code}', request=request, response=httpx.Response(code, request=request))
+
+
+def test_transport_errors_and_5xx_are_retried():
+    fn, calls = _failing(httpx.ConnectError('down'), _status_error(503))
+    assert resilience.call(fn) == 'ok'
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('error', [_status_error(404), ValueError('bad payload')])
+def test_other_errors_are_raised_at_once(error):
+    fn, calls = _failing(error)
+    with pytest.raises(type(error)):
+        resilience.call(fn)
+    assert len(calls) == 1
+
+
+def test_no_call_once_the_deadline_passed():
+    fn, calls = _failing()
+    resilience.begin_request(0.01)
+    time.sleep(0.02)
+    with pytest.raises(resilience.DeadlineExceeded):
+        resilience.call(fn)
+    assert calls == []
+
+
+def test_no_retry_that_cannot_finish_in_time(monkeypatch):
+    monkeypatch.setattr(resilience, 'BACKOFF_BASE', 10.0)
+    fn, calls = _failing(httpx.ConnectError('down'))
+    resilience.begin_request(1.0)
+    with pytest.raises(httpx.ConnectError):
+        resilience.call(fn)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_and_half_opens():
+    circuit = resilience.CircuitBreaker('x', failures=2, reset_after=0.05)
+    circuit.failure()
+    assert circuit.allow()
+    circuit.failure()
+    with pytest.raises(resilience.CircuitOpen):
+        circuit.allow()
+    time.sleep(0.06)
+    # one trial call at a time
+    assert circuit.allow()
+    with pytest.raises(resilience.CircuitOpen):
+        circuit.allow()
+    circuit.success()
+    assert circuit.state == resilience.CLOSED
+    assert circuit.allow()
+
+
+def test_failed_trial_reopens():
+    circuit = resilience.CircuitBreaker('x', failures=1, reset_after=0.05)
+    circuit.failure()
+    time.sleep(0.06)
+    assert circuit.allow()
+    circuit.failure()
+    with pytest.raises(resilience.CircuitOpen):
+        circuit.allow()
+
+
+def test_call_fails_fast_while_open(monkeypatch):
+    monkeypatch.setattr(resilience, 'BREAKER_FAILURES', 2)
+    fn, calls = _failing(*[httpx.ConnectError('down')] * 10)
+    with pytest.raises(httpx.ConnectError):
+        resilience.call(fn, retry=False)
+    with pytest.raises(httpx.ConnectError):
+        resilience.call(fn, retry=False)
+    with pytest.raises(resilience.CircuitOpen):
+        resilience.call(fn)
+    assert len(calls) == 2
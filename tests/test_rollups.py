@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import bulk
+import rollups
+
+
+def _prices(engine, days, security_id=101, close=None):
+    opens = pd.Series([100.0 + number for number in range(len(days))]) - 1
+    closes = pd.Series(close if close is not None else opens + 1, dtype='float64')
+    df = pd.DataFrame({
+        'business_date': pd.to_datetime(days), 'security_id': security_id, 'symbol': f'S{security_id}',
+        'open_price': opens, 'high_price': opens + 3, 'low_price': opens - 1, 'close_price': closes,
+        'previous_day_close_price': opens,
+        'total_traded_quantity': 10.0, 'total_traded_value': 1000.0, 'total_trades': 1.0,
+    })
+    with engine.begin() as conn:
+        bulk.upsert(conn, df, 'stock_prices')
+
+
+def _rows(engine, query):
+    with engine.begin() as conn:
+        return conn.execute(text(query)).mappings().all()
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(rollups, 'ROLLUPS', True)
+
+
+def test_weekly_candle_skips_null_close(database, enabled):
+    # Sunday 2024-01-07 to Thursday 2024-01-11; the last close is missing
+    _prices(database, pd.date_range('2024-01-07', periods=5), close=[100.0, 101.0, 102.0, 103.0, None])
+    rollups.rebuild()
+    candle, = _rows(database, 'SELECT * FROM stock_prices_weekly')
+    assert str(candle['period_start'])[:10] == '2024-01-07'
+    assert candle['trading_days'] == 5
+    assert candle['open_price'] == 99.0
+    assert candle['close_price'] == 103.0
+    assert candle['previous_close'] == 99.0
+    assert candle['change_pct'] == pytest.approx((103.0 / 99.0 - 1) * 100)
+
+
+def test_moving_average_needs_full_window(database, enabled):
+    _prices(database, pd.bdate_range('2024-01-01', periods=6))
+    rollups.rebuild()
+    rows = _rows(database, 'SELECT sma_5, high_52_week FROM stock_price_indicators ORDER BY business_date')
+    assert [row['sma_5'] for row in rows[:4]] == [None] * 4
+    assert rows[4]['sma_5'] == pytest.approx(102.0)
+    assert rows[5]['sma_5'] == pytest.approx(103.0)
+    assert rows[5]['high_52_week'] == 107.0
+
+
+def test_refresh_recomputes_later_indicators(database, enabled):
+    days = pd.bdate_range('2024-01-01', periods=6)
+    _prices(database, days)
+    _prices(database, days, security_id=102)
+    rollups.rebuild()
+    # a correction to an earlier day of one security moves its later windows only
+    _prices(database, days[:1], close=[200.0])
+    written = rollups.refresh_prices(days[:1])
+    # its own close and the one 5-session window that includes it
+    assert written['stock_price_indicators'] == 2
+    rows = _rows(database, 'SELECT security_id, sma_5 FROM stock_price_indicators '
+                           f"WHERE business_date = '{days[4].date()}' ORDER BY security_id")
+    assert [row['sma_5'] for row in rows] == [pytest.approx(122.0), pytest.approx(102.0)]
+
+
+def test_deferred_refreshes_once_at_the_end(database, enabled, monkeypatch):
+    calls = []
+    refresh = rollups._refresh_prices
+    monkeypatch.setattr(rollups, '_refresh_prices', lambda dates, until: calls.append(dates) or refresh(dates, until))
+    days = pd.bdate_range('2024-01-29', periods=4)
+    with rollups.deferred():
+        for day in days:
+            _prices(database, [day])
+            rollups.refresh_prices([day])
+        assert calls == []
+    # one call per month
+    assert [len(dates) for dates in calls] == [3, 1]
+    assert len(_rows(database, 'SELECT * FROM stock_price_indicators')) == 4
@@ -0,0 +1,93 @@
+import pandas as pd
+from sqlalchemy import inspect, text
+
+import schema
+
+# as the first to_sql append left it: business_date TEXT, no key
+LEGACY_PRICES = pd.DataFrame({
+    'business_date': ['2023-12-29', '2024-01-04', '2024-01-04', '2024-01-05', '2024-01-05'],
+    'security_id': [101, 101, 101, 102, None],
+    'symbol': ['NABIL', 'NABIL', 'NABIL', 'NICA', 'NONE'],
+    'close_price': [500.0, 510.0, 512.0, 300.0, 1.0],
+})
+
+
+def _legacy(engine):
+    with engine.begin() as conn:
+        LEGACY_PRICES.to_sql('stock_prices', conn, index=False)
+        column = {col['name']: col for col in inspect(conn).get_columns('stock_prices')}['business_date']
+    assert 'TEXT' in str(column['type']).upper()
+
+
+def _prices(engine):
+    with engine.begin() as conn:
+        rows = conn.execute(text(
+            'SELECT security_id, business_date, close_price FROM stock_prices ORDER BY security_id, business_date'
+        )).all()
+    return [(security_id, str(business_date)[:10], close_price) for security_id, business_date, close_price in rows]
+
+
+def test_migrates_text_business_date(engine):
+    _legacy(engine)
+    assert schema.migrate(engine) == [1, 2, 3, 4, 5]
+    assert _prices(engine) == [
+        (101, '2023-12-29', 500.0),
+        (101, '2024-01-04', 512.0),
+        (102, '2024-01-05', 300.0),
+    ]
+    with engine.begin() as conn:
+        assert not inspect(conn).has_table('stock_prices_legacy')
+        assert conn.execute(text('SELECT security_id, symbol FROM stock_securities ORDER BY security_id')).all() == [
+            (101, 'NABIL'), (102, 'NICA')]
+        column = {col['name']: col for col in inspect(conn).get_columns('stock_prices')}['business_date']
+        assert str(column['type']).upper() == 'DATE'
+        if engine.dialect.name == 'postgresql':
+            partitions = set(conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'stock_prices'")).scalars())
+            assert {'stock_prices_2023', 'stock_prices_2024'} <= partitions
+            assert conn.execute(text('SELECT count(*) FROM stock_prices_default')).scalar() == 0
+
+
+def test_startup_leaves_rebuilds_pending(engine):
+    _legacy(engine)
+    assert schema.migrate(engine, rebuild=False) == []
+    assert [migration['applied_at'] for migration in schema.status(engine)] == [None, None, None, None, None]
+    with engine.begin() as conn:
+        assert conn.execute(text('SELECT count(*) FROM stock_prices')).scalar() == len(LEGACY_PRICES)
+    assert schema.migrate(engine) == [1, 2, 3, 4, 5]
+    assert len(_prices(engine)) == 3
+
+
+def test_startup_creates_missing_tables(engine):
+    assert schema.migrate(engine, rebuild=False) == [1, 2, 3, 4, 5]
+    assert schema.migrate(engine, rebuild=False) == []
+    assert _prices(engine) == []
+
+
+def test_startup_leaves_securities_copy_pending(engine):
+    # migrations 1 and 2 ran before stock_securities existed
+    schema.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE stock_securities'))
+        conn.execute(text('DELETE FROM schema_migrations WHERE version = 3'))
+        conn.execute(text("INSERT INTO stock_prices (security_id, business_date, symbol) VALUES (7, '2024-02-01', 'X')"))
+    assert schema.migrate(engine, rebuild=False) == []
+    assert schema.migrate(engine) == [3]
+    with engine.begin() as conn:
+        assert conn.execute(text('SELECT security_id, symbol FROM stock_securities')).all() == [(7, 'X')]
+
+
+def test_copies_legacy_rollups(engine):
+    schema.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE stock_prices_weekly'))
+        conn.execute(text('DELETE FROM schema_migrations WHERE version = 4'))
+        pd.DataFrame({'security_id': [101, 101], 'period_start': ['2024-01-07 00:00:00', '2024-01-07 00:00:00'],
+                      'close_price': [510.0, 512.0]}).to_sql('stock_prices_weekly', conn, index=False)
+    assert schema.migrate(engine, rebuild=False) == []
+    assert schema.migrate(engine) == [4]
+    with engine.begin() as conn:
+        rows = conn.execute(text('SELECT security_id, period_start, close_price FROM stock_prices_weekly')).all()
+    assert [(security_id, str(period_start)[:10], close) for security_id, period_start, close in rows] == [
+        (101, '2024-01-07', 512.0)]
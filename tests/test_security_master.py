@@ -0,0 +1,43 @@
+import pandas as pd
+from sqlalchemy import text
+
+from security_master import SecurityMaster
+
+
+def _prices(engine, rows):
+    with engine.begin() as conn:
+        for security_id, symbol in rows:
+            conn.execute(text("INSERT INTO stock_prices (security_id, business_date, symbol) "
+                              "VALUES (:security_id, '2024-01-04', :symbol)"),
+                         {'security_id': security_id, 'symbol': symbol})
+
+
+def test_loads_from_securities_table(database):
+    with database.begin() as conn:
+        conn.execute(text("INSERT INTO stock_securities (security_id, symbol) VALUES (101, 'NABIL')"))
+    master = SecurityMaster()
+    assert master.ids() == [101]
+    assert master.get(101) == {'symbol': 'NABIL', 'sector': None}
+
+
+def test_misses_are_cached(database, monkeypatch):
+    master = SecurityMaster()
+    assert master.get(7) is None
+    # written by another process: not seen until the miss expires
+    _prices(database, [(7, 'NEW')])
+    assert master.get(7) is None
+    monkeypatch.setattr('security_master.MISS_TTL', 0)
+    master._missing.clear()
+    assert master.get(7) == {'symbol': 'NEW', 'sector': None}
+
+
+def test_store_upserts_and_clears_misses(database):
+    master = SecurityMaster()
+    assert master.get(5) is None
+    master.store([pd.DataFrame({'security_id': [5, 6, None], 'symbol': ['OLD', 'B', 'X']}),
+                  pd.DataFrame({'security_id': [5], 'symbol': ['NEW']})])
+    assert master.get(5) == {'symbol': 'NEW', 'sector': None}
+    with database.begin() as conn:
+        assert conn.execute(text('SELECT security_id, symbol FROM stock_securities ORDER BY security_id')).all() == [
+            (5, 'NEW'), (6, 'B')]
+    assert SecurityMaster().ids() == [5, 6]
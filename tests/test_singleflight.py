@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+import auth
+import resilience
+from singleflight import AsyncSingleFlight, SingleFlight, Timeout
+
+
+def _in_flight(flight, key, fn):
+    # start `fn` as the leader for `key` on another thread and wait until it runs
+    started = threading.Event()
+    results = []
+
+    def run():
+        try:
+            results.append(flight.do(key, lambda: started.set() or fn()))
+        except Exception as e:
+            results.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    return thread, results
+
+
+def test_followers_share_the_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    thread, results = _in_flight(flight, 'k', lambda: release.wait() and 'value')
+    joined = []
+    follower = threading.Thread(target=lambda: joined.append(flight.do('k', lambda: 'own', on_join=lambda: None)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join()
+    follower.join()
+    assert results == ['value']
+    assert joined == ['value']
+
+
+def test_follower_gives_up_at_its_timeout():
+    flight = SingleFlight()
+    release = threading.Event()
+    thread, _ = _in_flight(flight, 'k', lambda: release.wait())
+    started = time.monotonic()
+    with pytest.raises(Timeout):
+        flight.do('k', lambda: 'own', timeout=0.1)
+    assert time.monotonic() - started < 1
+    release.set()
+    thread.join()
+
+
+def test_failed_flight_is_run_again_by_followers():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait()
+        raise resilience.DeadlineExceeded('leader ran out of time')
+
+    thread, results = _in_flight(flight, 'k', fail)
+    joined = []
+    follower = threading.Thread(target=lambda: joined.append(flight.do('k', lambda: 'own')))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join()
+    follower.join()
+    assert isinstance(results[0], resilience.DeadlineExceeded)
+    assert joined == ['own']
+
+
+def test_async_follower_gives_up_and_reruns_failed_flight():
+    async def main():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            raise RuntimeError('leader failed')
+
+        async def own():
+            return 'own'
+
+        leader = asyncio.ensure_future(flight.do('k', slow))
+        await asyncio.sleep(0)
+        with pytest.raises(Timeout):
+            await flight.do('k', own, timeout=0.05)
+        follower = asyncio.ensure_future(flight.do('k', own))
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == 'own'
+
+
+def test_get_coalesces_and_archives_once(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def get(url, headers=None):
+        calls.append(url)
+        release.wait()
+        return httpx.Response(200, json={'a': 1}, request=httpx.Request('GET', url))
+
+    monkeypatch.setattr(auth.upstream, 'get', get)
+    manager = auth.TokenManager(nepse=None, coalesce=True)
+    monkeypatch.setattr(manager, 'headers', lambda: {})
+    fetched, responses = [], []
+
+    def call():
+        responses.append(manager.get('http://nepse/x', on_fetch=fetched.append))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(fetched) == 1
+    assert len({id(response) for response in responses}) == 3
+    assert [response.json() for response in responses] == [{'a': 1}] * 3
+
+
+def test_get_waits_within_the_callers_deadline(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(auth.upstream, 'get', lambda url, headers=None: release.wait() and httpx.Response(200))
+    manager = auth.TokenManager(nepse=None, coalesce=True)
+    monkeypatch.setattr(manager, 'headers', lambda: {})
+    leader = threading.Thread(target=manager.get, args=('http://nepse/x',))
+    leader.start()
+    time.sleep(0.05)
+    resilience.begin_request(0.1)
+    try:
+        with pytest.raises(resilience.DeadlineExceeded):
+            manager.get('http://nepse/x')
+    finally:
+        resilience.end_request()
+        release.set()
+        leader.join()
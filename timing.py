@@ -0,0 +1,108 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+import metrics
+
+# add a Server-Timing header with the request's stage breakdown to every response
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+
+stage_seconds = metrics.histogram(
+    'stage_duration_seconds',
+    'Time spent in a processing stage (auth, normalize, ...)',
+    labelnames=('stage',),
+)
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds',
+    'End-to-end request latency by route',
+    labelnames=('route', 'method', 'status'),
+)
+
+# (stage, seconds) pairs collected for the request being served, or None
+_spans = ContextVar('timing_spans', default=None)
+
+
+def begin_request():
+    """
+    Start collecting spans for the current request and return the list
+    they are appended to.
+    """
+    spans = []
+    _spans.set(spans)
+    return spans
+
+
+def end_request():
+    _spans.set(None)
+
+
+def add(stage, seconds):
+    """
+    Attribute `seconds` to `stage` in the current request only. For timings
+    that already feed their own histogram (upstream calls, bulk writes).
+    """
+    spans = _spans.get()
+    if spans is not None:
+        # list.append is atomic, so worker threads of one request can share it
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the block into stage_duration_seconds{stage} and the current request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        add(stage, elapsed)
+
+
+def timed(stage):
+    """
+    Decorator form of span().
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def carry(coro, spans=None):
+    """
+    Await `coro` with the caller's spans. Use when handing a coroutine to
+    another loop (upstream.submit), which would otherwise lose the context.
+    """
+    _spans.set(spans)
+    return await coro
+
+
+def current():
+    return _spans.get()
+
+
+def server_timing(spans, total=None):
+    """
+    Render spans as a Server-Timing header value, summing repeated stages.
+    """
+    totals = {}
+    for stage, seconds in spans:
+        duration, calls = totals.get(stage, (0.0, 0))
+        totals[stage] = (duration + seconds, calls + 1)
+    parts = []
+    for stage, (duration, calls) in totals.items():
+        part = f'{stage};dur={duration * 1000:.1f}'
+        if calls > 1:
+            part += f';desc="{calls} calls"'
+        parts.append(part)
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
@@ -0,0 +1,99 @@
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# NEPSE trades Sunday to Thursday
+WEEKEND_DAYS = (4, 5)  # 4 is Friday, 5 is Saturday
+
+NEPAL_TZ = ZoneInfo('Asia/Kathmandu')
+
+_holidays = None
+
+
+def _session_time(name, default):
+    hours, minutes = os.getenv(name, default).split(':')
+    return time(int(hours), int(minutes))
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+
+def load_holidays():
+    """
+    Exchange holidays from NEPSE_HOLIDAYS (comma separated YYYY-MM-DD) and
+    the file named by NEPSE_HOLIDAYS_FILE (one date per line, # comments).
+    """
+    holidays = set()
+    for value in os.getenv('NEPSE_HOLIDAYS', '').split(','):
+        if value.strip():
+            holidays.add(_parse_date(value))
+    path = os.getenv('NEPSE_HOLIDAYS_FILE')
+    if path:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        holidays.add(_parse_date(line))
+        except OSError as e:
+            logger.error(f"Could not read NEPSE holidays file {path}: {e}")
+    return holidays
+
+
+def holidays():
+    global _holidays
+    if _holidays is None:
+        _holidays = load_holidays()
+    return _holidays
+
+
+def is_weekend(day):
+    return _parse_date(day).weekday() in WEEKEND_DAYS
+
+
+def is_trading_day(day):
+    day = _parse_date(day)
+    return day.weekday() not in WEEKEND_DAYS and day not in holidays()
+
+
+def trading_days(start, end):
+    """
+    Trading days between `start` and `end`, both inclusive.
+    """
+    day, end = _parse_date(start), _parse_date(end)
+    while day <= end:
+        if is_trading_day(day):
+            yield day
+        day += timedelta(days=1)
+
+
+def market_open_time():
+    return _session_time('NEPSE_MARKET_OPEN', '11:00')
+
+
+def next_open(now=None):
+    """
+    The next regular session open after `now`, as an aware datetime in
+    Nepal time.
+    """
+    now = now.astimezone(NEPAL_TZ) if now is not None else datetime.now(NEPAL_TZ)
+    day = now.date()
+    while True:
+        if is_trading_day(day):
+            opens = datetime.combine(day, market_open_time(), NEPAL_TZ)
+            if opens > now:
+                return opens
+        day += timedelta(days=1)
+
+
+def seconds_until_next_open(now=None):
+    now = now if now is not None else datetime.now(NEPAL_TZ)
+    return max(0.0, (next_open(now) - now).total_seconds())
@@ -0,0 +1,251 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+import resilience
+import timing
+
+logger = logging.getLogger(__name__)
+
+NEPSE_BASE_URL = os.getenv('NEPSE_BASE_URL', 'https://www.nepalstock.com.np').rstrip('/')
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+# all async upstream work runs on one background loop so the shared
+# AsyncClient and its connections are never used from a foreign loop
+_loop = None
+_loop_thread = None
+
+request_seconds = metrics.histogram(
+    'upstream_request_seconds',
+    'Latency of upstream HTTP requests',
+    labelnames=('host', 'status'),
+)
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.error(f"{name} must be a number, using default {default}")
+        return default
+
+
+def _timeout(time_left=None):
+    # nepalstock.com.np is slow to answer but quick to accept connections,
+    # so fail fast on connect and be patient on read
+    timeouts = {
+        'connect': _env_float('UPSTREAM_CONNECT_TIMEOUT', 5.0),
+        'read': _env_float('UPSTREAM_READ_TIMEOUT', 30.0),
+        'write': _env_float('UPSTREAM_WRITE_TIMEOUT', 10.0),
+        'pool': _env_float('UPSTREAM_POOL_TIMEOUT', 5.0),
+    }
+    if time_left is not None:
+        # never wait past the request's deadline
+        timeouts = {phase: min(seconds, time_left) for phase, seconds in timeouts.items()}
+    return httpx.Timeout(**timeouts)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=int(_env_float('UPSTREAM_MAX_CONNECTIONS', 20)),
+        max_keepalive_connections=int(_env_float('UPSTREAM_MAX_KEEPALIVE', 10)),
+        keepalive_expiry=_env_float('UPSTREAM_KEEPALIVE_EXPIRY', 60.0),
+    )
+
+
+def _client_kwargs():
+    return {
+        'verify': False,
+        'http2': True,
+        'timeout': _timeout(),
+        'limits': _limits(),
+    }
+
+
+def get_client():
+    """
+    Return the shared, keep-alive httpx.Client used for upstream calls.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(**_client_kwargs())
+    return _client
+
+
+def get_loop():
+    """
+    Return the background event loop that owns the shared AsyncClient,
+    starting it on first use.
+    """
+    global _loop, _loop_thread
+    if _loop is None:
+        with _client_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _loop_thread = threading.Thread(target=loop.run_forever, name='upstream-loop', daemon=True)
+                _loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """
+    Schedule `coro` on the upstream loop and return a concurrent.futures.Future.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """
+    Run `coro` on the upstream loop and block until it finishes.
+    """
+    return submit(coro).result(timeout)
+
+
+def get_async_client():
+    """
+    Return the shared httpx.AsyncClient. It must only be used from
+    coroutines running on the upstream loop (see submit()/run()).
+    """
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = httpx.AsyncClient(**_client_kwargs())
+    return _async_client
+
+
+def _observe(url, started, status):
+    host = urlsplit(str(url)).hostname or ''
+    elapsed = time.perf_counter() - started
+    request_seconds.observe(elapsed, host=host, status=status)
+    timing.add('upstream', elapsed)
+
+
+def _get(url, headers, time_left, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = get_client().get(url, headers=headers, timeout=_timeout(time_left), **kwargs)
+    except httpx.HTTPError:
+        _observe(url, started, 'error')
+        raise
+    _observe(url, started, response.status_code)
+    return response
+
+
+def get(url, headers=None, **kwargs):
+    """
+    GET `url` through the shared client, recording per-host latency.
+    Transient failures are retried and the endpoint's circuit breaker is
+    honoured, see resilience.execute().
+    """
+    return resilience.execute(resilience.endpoint_key(url),
+                              lambda time_left: _get(url, headers, time_left, **kwargs))
+
+
+def _send(method, url, headers, time_left, **kwargs):
+    client = get_client()
+    request = client.build_request(method, url, headers=headers, timeout=_timeout(time_left), **kwargs)
+    started = time.perf_counter()
+    try:
+        response = client.send(request, stream=True)
+    except httpx.HTTPError:
+        _observe(url, started, 'error')
+        raise
+    _observe(url, started, response.status_code)
+    return response
+
+
+@contextmanager
+def stream(method, url, headers=None, retry=None, hedge_after=None, **kwargs):
+    """
+    Send a request through the shared client without reading the body.
+    Iterate response.iter_bytes() inside the block; latency is recorded
+    once the response headers arrive.
+
+    Failures before the headers arrive are retried when `retry` is true
+    (default: for GET). With `hedge_after` seconds, a second request is
+    sent if the first has not answered by then and the faster one wins.
+    """
+    endpoint = resilience.endpoint_key(url)
+    retry = method.upper() in ('GET', 'HEAD') if retry is None else retry
+
+    def attempt(time_left):
+        if hedge_after:
+            return resilience.hedge(endpoint, lambda: _send(method, url, headers, time_left, **kwargs),
+                                    hedge_after, discard=httpx.Response.close)
+        return _send(method, url, headers, time_left, **kwargs)
+
+    response = resilience.execute(endpoint, attempt, retry=retry, discard=httpx.Response.close)
+    try:
+        yield response
+    finally:
+        response.close()
+
+
+async def _aget(url, headers, time_left, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await get_async_client().get(url, headers=headers, timeout=_timeout(time_left), **kwargs)
+    except httpx.HTTPError:
+        _observe(url, started, 'error')
+        raise
+    _observe(url, started, response.status_code)
+    return response
+
+
+async def aget(url, headers=None, **kwargs):
+    """
+    Async twin of get().
+    """
+    return await resilience.aexecute(resilience.endpoint_key(url),
+                                     lambda time_left: _aget(url, headers, time_left, **kwargs))
+
+
+async def aclose_async_client():
+    global _async_client
+    with _client_lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
+
+
+def close_clients():
+    """
+    Close the shared clients and their pooled connections, then stop the
+    upstream loop.
+    """
+    global _client, _loop, _loop_thread
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+    loop = _loop
+    if loop is not None and loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(aclose_async_client(), loop).result(5)
+        except Exception as e:
+            # sockets are released when the process exits anyway
+            logger.warning(f"Could not close async upstream client: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        _loop_thread.join(5)
+        _loop, _loop_thread = None, None
+
+
+atexit.register(close_clients)